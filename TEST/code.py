@@ -1,33 +1,172 @@
-import pyodbc
 import pandas as pd
-from google.cloud import firestore, storage
 from datetime import datetime, date, timedelta
 import json
 import re
+import os
+import sys
+import argparse
+import time
+import traceback
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import warnings
 warnings.filterwarnings('ignore')
 
+# Shared modules live in the repo root (one level above TEST/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_queries import (
+    fetch_batch_doctor_metrics, compare_rx_rollups,
+    clean_aid, clean_prescription_key, REPORT_RX_ROLLUPS, RX_PARSE_MODES
+)
+from metrics_cache import fetch_month_to_date, DEFAULT_RECHECK_DAYS
+from employee_master import load_employee_master
+from doctor_pivot import doctor_index, doctor_sheet, DOCTOR_LAYOUTS, DEFAULT_DOCTOR_LAYOUT
+from hierarchy import OrgTree, relabel_vacant_abms, relabel_vacant_rbms
+from waterfall import build_waterfall
+from stages import (
+    mark, end_stage, rows_out, stage_context, with_context,
+    record_stages, run_telemetry, add_sink, clear_sinks, json_line_sink, start_memory_tracing,
+    telemetry_dir_from_env, add_stage_hook
+)
+import query_log
+from profiling import StageProfiler, profile_stages, DEFAULT_PROFILE_DIR
+from sql_conn import DEFAULT_POOL_SIZE, DEFAULT_QUERY_TIMEOUT
+from backends import get_bucket, get_sql_manager
+
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
 import math
 
 # ------------------------------------------------------------
-# 0️⃣ READ PHARMA LIST
+# 0️⃣ ARGS
 # ------------------------------------------------------------
 PHARMA_LIST_FILE = "Pharma_list.xlsx"
-
-pharma_df = pd.read_excel(PHARMA_LIST_FILE)
+RUN_HISTORY_FILE = "run_history.json"
 
 # Expecting columns: pharma_name, aid, json_file, prescription_key
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate employee-doctor reports for every pharma in the list")
+    parser.add_argument(
+        "--batch-sql",
+        action="store_true",
+        help="Fetch doctor metrics for ALL pharmas with one SQL query, then split per aId"
+    )
+    parser.add_argument(
+        "--rx-rollup",
+        choices=REPORT_RX_ROLLUPS,
+        default="oid",
+        help="oid = pre-aggregate rx per oId before the join (default), camp = original per-camp-date rollup"
+    )
+    parser.add_argument(
+        "--rx-parse",
+        choices=RX_PARSE_MODES,
+        default="server",
+        help="client = fetch the raw 'rx|strips' value once per row and split it in pandas"
+    )
+    parser.add_argument(
+        "--check-rx-rollup",
+        action="store_true",
+        help="Before each report, run both rx rollups and compare Rx/Strips totals"
+    )
+    parser.add_argument(
+        "--metrics-cache-dir",
+        default=None,
+        help="Keep per-day metric aggregates here and only re-query days after the last run"
+    )
+    parser.add_argument(
+        "--recheck-days",
+        type=int,
+        default=DEFAULT_RECHECK_DAYS,
+        help="With --metrics-cache-dir: days before the cached watermark to re-query for late edits"
+    )
+    parser.add_argument(
+        "--master-cache-dir",
+        default=None,
+        help="Keep parsed employee masters here; re-download only when the GCS blob generation changes"
+    )
+    parser.add_argument(
+        "--doctor-layout",
+        choices=DOCTOR_LAYOUTS,
+        default=DEFAULT_DOCTOR_LAYOUT,
+        help="Employee-doctor sheet: long = one row per employee × doctor (default), "
+             "wide = one row per employee with six columns per doctor"
+    )
+    parser.add_argument(
+        "--query-timeout",
+        type=int,
+        default=DEFAULT_QUERY_TIMEOUT,
+        help="Per-query timeout in seconds; a tenant whose query runs longer is marked failed"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes (each with its own SQL connection + GCS client)"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Serial run only: load the next N pharmas (GCS + SQL) on background threads "
+             "while the current report is built (0 = off)"
+    )
+    parser.add_argument(
+        "--history-file",
+        default=RUN_HISTORY_FILE,
+        help="Per-pharma run times from earlier runs, used to start the largest pharmas first"
+    )
+    parser.add_argument(
+        "--telemetry-dir",
+        default=telemetry_dir_from_env(),
+        help="Log one JSON line per stage (time, rows, memory) and write the run summary "
+             "here (default: $REPORT_TELEMETRY_DIR, off when unset)"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="cProfile every stage per pharma (.pstats + collapsed stacks, hot functions "
+             "in the run summary); off by default, turns --prefetch off"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=DEFAULT_PROFILE_DIR,
+        help="With --profile: profiles go to <profile-dir>/<run timestamp>/<pharma>/"
+    )
+    parser.add_argument(
+        "--slow-query-log",
+        default=None,
+        help="Append queries slower than --slow-query-seconds here "
+             f"(default: ${query_log.LOG_ENV} or {query_log.DEFAULT_LOG}; \"\" = off)"
+    )
+    parser.add_argument(
+        "--slow-query-seconds",
+        type=float,
+        default=None,
+        help=f"Slow-query threshold (default: ${query_log.SECONDS_ENV} or {query_log.DEFAULT_SLOW_SECONDS:g})"
+    )
+    parser.add_argument(
+        "--sql-statistics",
+        action="store_true",
+        help="Run query shapes known to be slow with SET STATISTICS IO, TIME ON and log the output"
+    )
+    args = parser.parse_args(argv)
+
+    # One active cProfile per process (Python 3.12+): the prefetch thread's
+    # stages would overlap the main thread's
+    if args.profile and args.prefetch > 0:
+        print("⚠️ --profile runs stages one at a time: --prefetch ignored")
+        args.prefetch = 0
+
+    return args
+
+
 # ------------------------------------------------------------
 # 1️⃣ COMMON SETUP: GCS + SQL + DATE RANGE
 # ------------------------------------------------------------
-# Firebase Storage
-st = storage.Client("neodocs-8d6cd")
-bucket = st.bucket("neodocs-8d6cd-utils")
-
 # SQL SERVER — CONNECTION
 server = 'neodocs-sql-server.database.windows.net'
 database = 'neodocs-sql-db'
@@ -46,29 +185,35 @@ TrustServerCertificate=no;
 Connection Timeout=30;
 """
 
-conn = pyodbc.connect(conn_str)
-print("✅ Connected to SQL Server")
 
-# DATE RANGE — CURRENT MONTH
-today = date.today()
-first_day_this_month = today.replace(day=1)
-START_DATE = first_day_this_month.strftime('%Y-%m-%d')
-END_DATE = today.strftime('%Y-%m-%d')
-print("SQL Range (Current Month):", START_DATE, "to", END_DATE)
+def connect_bucket():
+    """Firebase Storage bucket with the org_access_codes masters
+    (a local directory with REPORT_BACKEND=local, see backends.py)."""
+    return get_bucket()
+
+
+def connect_sql(query_timeout, pool_size=DEFAULT_POOL_SIZE):
+    """Pooled + retrying connection; every query gets query_timeout."""
+    return get_sql_manager(conn_str, query_timeout=query_timeout, pool_size=pool_size)
+
+
+def clean_json_file(json_file):
+    return str(json_file).strip().strip("'").strip('"')
+
+
+def current_month_range():
+    """DATE RANGE — CURRENT MONTH (1st of the month → today)."""
+    today = date.today()
+    first_day_this_month = today.replace(day=1)
+    return first_day_this_month.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
 
 
 # ------------------------------------------------------------
 # 2️⃣ FUNCTION: GENERATE REPORT FOR ONE PHARMA
+#    load_master_stage + load_doctor_metrics → I/O (GCS, SQL)
+#    build_pharma_report                        → CPU (pandas, openpyxl)
 # ------------------------------------------------------------
-def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
-                           conn, bucket, start_date, end_date):
-    """
-    Generates the full Excel report for a single pharma:
-    - Reads employee master from given json_file in GCS
-    - Runs SQL for given aId + prescription_key
-    - Builds all sheets + styling
-    """
-
+def print_pharma_header(aid, pharma_name, json_file, prescription_key):
     print(f"\n==============================")
     print(f"▶ Processing pharma: {pharma_name}")
     print(f"   aId: {aid}")
@@ -76,212 +221,80 @@ def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
     print(f"   prescription_key: {prescription_key}")
     print(f"==============================")
 
-    # -----------------------------
-    # CLEAN INPUTS
-    # -----------------------------
-    json_file = str(json_file).strip().strip("'").strip('"')
-    pres_key = str(prescription_key).strip() if not (isinstance(prescription_key, float) and math.isnan(prescription_key)) else ""
-    has_prescription = bool(pres_key)
-
-    # --------------------------------------------------------
-    # A) LOAD EMPLOYEE MASTER FROM FIREBASE (pharma-specific)
-    # --------------------------------------------------------
-    blob = bucket.blob(json_file)
-    json_data = blob.download_as_text()
-    employee_dict = json.loads(json_data)
-
-    # Convert to DataFrame
-    emp_df = pd.DataFrame(employee_dict).transpose().reset_index()
-    emp_df.rename(columns={"index": "empId", "mr_region": "hq"}, inplace=True)
-
-    # Remove Training rows
-    emp_df = emp_df[emp_df['mr_name'] != "Training"]
 
-    # Convert region_list to comma-separated text
-    if "region_list" in emp_df.columns:
-        emp_df["region_list"] = emp_df["region_list"].apply(
-            lambda x: ", ".join(x) if isinstance(x, list) else x
-        )
-
-    # Ensure empId is string
-    emp_df["empId"] = emp_df["empId"].astype(str)
-
-    print("Employee Master Loaded:", emp_df.shape)
+def load_master_stage(bucket, json_file, master_cache_dir=None):
+    """A) EMPLOYEE MASTER FROM FIREBASE (pharma-specific)."""
+    mark("master_load")
+    emp_df = load_employee_master(bucket, clean_json_file(json_file), cache_dir=master_cache_dir)
+    rows_out(len(emp_df))
+    end_stage()
+    return emp_df
 
-    # --------------------------------------------------------
-    # B) SQL — DOCTOR METRICS (dynamic aId + prescription_key)
-    # --------------------------------------------------------
 
-    if has_prescription:
-        # With Rx & Strips
-        query = f"""
-        WITH test_summary AS (
-            SELECT 
-                u.empId,
-                u.docId AS [Doctor ID],
-                u.drName AS Doctor,
-                u.oId,
-                COUNT(DISTINCT u.testId) AS [Total Tests],
-                COUNT(DISTINCT CONVERT(date, u.campDate)) AS [Total Camps]
-            FROM dbo.user_tests u
-            LEFT JOIN dbo.aId a ON u.aId = a.aId
-            WHERE 
-                a.aId = '{aid}'
-                AND u.statusCode = 200
-                AND u.isDeleted = 0
-                AND u.campDate BETWEEN ? AND ?
-            GROUP BY u.empId, u.docId, u.drName, u.oId
-        ),
-
-        rx_summary AS (
-            SELECT 
-                r.aId,
-                r.oId,
-                r.campDate,
-                SUM(TRY_CAST(LEFT(JSON_VALUE(r.prescriptions, '$.{pres_key}'), 
-                    CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.{pres_key}')) - 1) AS INT)) AS [Total Rx],
-                SUM(TRY_CAST(LTRIM(RIGHT(JSON_VALUE(r.prescriptions, '$.{pres_key}'), 
-                    LEN(JSON_VALUE(r.prescriptions, '$.{pres_key}')) - 
-                    CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.{pres_key}')))) AS INT)) AS [Total Strips]
-            FROM dbo.rx r
-            LEFT JOIN dbo.aId a ON r.aId = a.aId
-            WHERE 
-                a.aId = '{aid}'
-                AND r.isDeleted = 0
-                AND r.campDate BETWEEN ? AND ?
-            GROUP BY r.aId, r.oId, r.campDate
-        )
+def load_doctor_metrics(aid, prescription_key, conn, start_date, end_date, sql_df=None,
+                        rx_rollup="oid", rx_parse="server",
+                        metrics_cache_dir=None, recheck_days=DEFAULT_RECHECK_DAYS):
+    """
+    B) SQL — DOCTOR METRICS (aId + prescription_key as parameters).
+    Skipped when sql_df is passed in from the batch query,
+    incremental when metrics_cache_dir is set.
+    """
+    mark("sql_fetch")
+    pres_key = str(prescription_key).strip() if not (isinstance(prescription_key, float) and math.isnan(prescription_key)) else ""
+    has_prescription = bool(pres_key)
 
-        SELECT 
-            t.empId AS [empId],
-            t.Doctor,
-            t.[Doctor ID],
-            t.[Total Camps] AS [Doc Total Camps],
-            ISNULL(SUM(rx.[Total Rx]), 0) AS [Total Rx],
-            ISNULL(SUM(rx.[Total Strips]), 0) AS [Total Strips],
-            t.[Total Tests]
-        FROM test_summary t
-        LEFT JOIN rx_summary rx
-            ON t.oId = rx.oId
-        GROUP BY 
-            t.empId, t.Doctor, t.[Doctor ID], t.[Total Camps], t.[Total Tests]
-        ORDER BY t.empId;
-        """
-        params = [start_date, end_date, start_date, end_date]
+    if sql_df is not None:
+        # Already fetched by the multi-tenant batch query
+        pass
     else:
-        # No prescription_key -> Rx & Strips = 0
-        print("No prescription_key provided → Rx/Strips will be 0 for this pharma.")
-        query = f"""
-        WITH test_summary AS (
-            SELECT 
-                u.empId,
-                u.docId AS [Doctor ID],
-                u.drName AS Doctor,
-                u.oId,
-                COUNT(DISTINCT u.testId) AS [Total Tests],
-                COUNT(DISTINCT CONVERT(date, u.campDate)) AS [Total Camps]
-            FROM dbo.user_tests u
-            LEFT JOIN dbo.aId a ON u.aId = a.aId
-            WHERE 
-                a.aId = '{aid}'
-                AND u.statusCode = 200
-                AND u.isDeleted = 0
-                AND u.campDate BETWEEN ? AND ?
-            GROUP BY u.empId, u.docId, u.drName, u.oId
+        if not has_prescription:
+            # No prescription_key -> Rx & Strips = 0
+            print("No prescription_key provided → Rx/Strips will be 0 for this pharma.")
+
+        sql_df = fetch_month_to_date(
+            conn, aid, pres_key, start_date, end_date,
+            cache_dir=metrics_cache_dir, recheck_days=recheck_days,
+            rx_rollup=rx_rollup, rx_parse=rx_parse
         )
-
-        SELECT 
-            t.empId AS [empId],
-            t.Doctor,
-            t.[Doctor ID],
-            t.[Total Camps] AS [Doc Total Camps],
-            0 AS [Total Rx],
-            0 AS [Total Strips],
-            t.[Total Tests]
-        FROM test_summary t
-        ORDER BY t.empId;
-        """
-        params = [start_date, end_date]
-
-    sql_df = pd.read_sql(query, conn, params=params)
     print("Doctor Metrics Loaded:", sql_df.shape)
+    rows_out(len(sql_df))
+    end_stage()
 
-    # --------------------------------------------------------
-    # C) ASSIGN DOCTOR INDEX PER empId
-    # --------------------------------------------------------
-    sql_df['Doctor Index'] = sql_df.groupby(['empId']).cumcount() + 1
-
-    # --------------------------------------------------------
-    # D) PIVOT DOCTOR METRICS — Wide format
-    # --------------------------------------------------------
-    pivoted = sql_df.pivot_table(
-        index=['empId'],
-        columns='Doctor Index',
-        values=['Doctor', 'Doctor ID', 'Doc Total Camps', 'Total Rx', 'Total Strips', 'Total Tests'],
-        aggfunc='first'
-    )
+    return sql_df
 
-    # Flatten columns
-    pivoted.columns = [f"{col[0]} {int(col[1])}" for col in pivoted.columns]
-    pivoted = pivoted.reset_index()
 
-    # --------------------------------------------------------
-    # ADD TOTAL CAMPS COLUMN (SUM OF ALL DOC TOTAL CAMPS)
-    # --------------------------------------------------------
-    doc_camp_cols = [col for col in pivoted.columns if col.startswith("Doc Total Camps")]
-    pivoted["Total Camps"] = pivoted[doc_camp_cols].sum(axis=1)
+def build_pharma_report(pharma_name, emp_df, sql_df, doctor_layout=DEFAULT_DOCTOR_LAYOUT):
+    """
+    CPU side of a report (no GCS / SQL): pivot, hierarchy,
+    all sheets + styling. Returns the output file name.
+    """
+    mark("doctor_pivot", rows_in=len(sql_df))
 
     # --------------------------------------------------------
-    # REORDER COLUMNS WITH TOTAL CAMPS FIRST, THEN DOCTORS
+    # C) ASSIGN DOCTOR INDEX PER empId
     # --------------------------------------------------------
-    doctor_indices = sorted(
-        list({
-            int(col.split()[-1]) 
-            for col in pivoted.columns 
-            if col not in ["empId", "Total Camps"]
-        })
-    )
-
-    order_template = [
-        "Doctor",
-        "Doctor ID",
-        "Doc Total Camps",
-        "Total Tests",
-        "Total Rx",
-        "Total Strips"
-    ]
-
-    ordered_columns = ["empId", "Total Camps"]
-
-    for idx in doctor_indices:
-        for field in order_template:
-            col_name = f"{field} {idx}"
-            if col_name in pivoted.columns:
-                ordered_columns.append(col_name)
-
-    pivoted = pivoted.reindex(columns=ordered_columns)
+    sql_df['Doctor Index'] = doctor_index(sql_df)
 
     # --------------------------------------------------------
-    # E) JOIN WITH EMPLOYEE MASTER
+    # D) DOCTOR SHEET — long (employee × doctor) or wide
     # --------------------------------------------------------
-    final_df = emp_df.merge(pivoted, on="empId", how="left")
-
-    cols = final_df.columns.tolist()
-    cols = ['empId'] + [c for c in cols if c != "empId"]
-    final_df = final_df[cols]
-
-    final_df = final_df.drop(columns=["region_list"], errors="ignore")
+    # sheet_df → main sheet; final_df → one row per employee
+    # (Total Camps / Total Tests) for the summary sheets
+    sheet_df, final_df = doctor_sheet(emp_df, sql_df, doctor_layout)
+    rows_out(len(sheet_df))
 
     # --------------------------------------------------------
-    # F) EXPORT BASE EXCEL (main sheet)
+    # E) EXPORT BASE EXCEL (main sheet)
     # --------------------------------------------------------
+    mark("excel_write", rows_in=len(sheet_df))
     output_file = f"{pharma_name}_employee_doctor_report.xlsx"
-    final_df.to_excel(output_file, index=False)
+    sheet_df.to_excel(output_file, index=False)
     print("✅ Final Report Generated:", output_file)
 
     # ------------------------------------------------------------
     # 7️⃣ CREATE SUMMARY SHEET (MR → ABM → RBM → SM)
     # ------------------------------------------------------------
+    mark("hierarchy", rows_in=len(final_df))
     mr_camps = final_df[["empId", "Total Camps"]].copy()
 
     mr_camps = mr_camps.merge(
@@ -339,67 +352,17 @@ def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
     true_mr["total_camps"] = true_mr["Total Camps"].fillna(0)
 
     # ⭐ 0) FIX ABM NAMES PER RBM BLOCK (NEW RULE)
-    df = summary_df.copy()
-
-    for abm, abm_group in df.groupby("abm_name", dropna=False):
-        true_block = abm_group[abm_group["name"] == abm]
-        if true_block.empty:
-            continue
-        true_rbm = true_block.iloc[0]["rbm_name"]
-        rbm_list_local = abm_group["rbm_name"].fillna("").unique().tolist()
-        for rbm in rbm_list_local:
-            if rbm == true_rbm:
-                continue
-            vacant_abm = f"Vacant ({rbm})"
-            mask = (df["abm_name"] == abm) & (df["rbm_name"] == rbm)
-            df.loc[mask, "abm_name"] = vacant_abm
-            df.loc[mask & (df["designation"] == "abm"), "name"] = vacant_abm
-
-    summary_df = df.copy()
+    summary_df = relabel_vacant_abms(summary_df)
 
     # ⭐ 1) FIX RBM NAMES PER SM BLOCK (Opposite Rule)
-    df = summary_df.copy()
-
-    for rbm, rbm_group in df.groupby("rbm_name", dropna=False):
-        rbm_row = rbm_group[(rbm_group["designation"] == "rbm") & 
-                            (rbm_group["name"] == rbm)]
-        if rbm_row.empty:
-            continue
-        true_sm = rbm_row.iloc[0]["sm_name"]
-        all_sms = rbm_group["sm_name"].fillna("").unique().tolist()
-        for sm in all_sms:
-            if sm != true_sm:
-                vacant_name = f"Vacant ({sm})"
-                mask = (df["rbm_name"] == rbm) & (df["sm_name"] == sm)
-                df.loc[mask, "rbm_name"] = vacant_name
-
-    summary_df = df.copy()
-
-    # 🔄 RECOMPUTE group_maps AFTER renaming
-    true_mr_after = summary_df[summary_df["designation"] == "mr"].copy()
-
-    group_maps = {}
-
-    for role, col in [("abm", "abm_name"), ("rbm", "rbm_name"), ("sm", "sm_name")]:
-        g = true_mr_after.groupby(col)["total_camps"].agg(["sum", "count"]).reset_index()
-        g["expected"] = g["count"] * 4
-
-        group_maps[role] = {
-            "total": dict(zip(g[col], g["sum"])),
-            "expected": dict(zip(g[col], g["expected"]))
-        }
+    summary_df = relabel_vacant_rbms(summary_df)
 
-    for role in manager_roles:
-        mask = summary_df["designation"] == role
-        name_col = "name"
-
-        summary_df.loc[mask, "total_camps"] = (
-            summary_df.loc[mask, name_col].map(group_maps[role]["total"]).fillna(0)
-        )
-
-        summary_df.loc[mask, "expected_camps"] = (
-            summary_df.loc[mask, name_col].map(group_maps[role]["expected"]).fillna(0)
-        )
+    # 🔄 RECOMPUTE TOTALS AFTER renaming
+    # ABM / RBM / SM rows (matched by name) = sum over the MRs under them:
+    # total = MR camps, expected = 4 per MR (hierarchy.py)
+    org_tree = OrgTree(summary_df, key="name", dropna=True)
+    for col in ["total_camps", "expected_camps"]:
+        summary_df[col] = org_tree.rollup(summary_df[col], chained=False)
 
     summary_df["execution_percent"] = summary_df.apply(
         lambda r: (r["total_camps"] / r["expected_camps"] * 100)
@@ -407,118 +370,18 @@ def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
         axis=1
     ).round(0).astype(int)
 
-    # ⭐ 2) BUILD WATERFALL SUMMARY (MR → ABM → RBM → SM)
-    final_rows = []
-
-    for sm, sm_group in summary_df.groupby("sm_name", dropna=False):
-
-        for rbm, rbm_group in sm_group.groupby("rbm_name", dropna=False):
-
-            rbm_str = str(rbm) if not pd.isna(rbm) else ""
-            is_vacant_rbm = rbm_str.startswith("Vacant (")
-
-            real_abm_groups = {}
-
-            for abm, abm_group in rbm_group.groupby("abm_name", dropna=False):
-
-                if isinstance(abm, str) and abm.startswith("Vacant ("):
-                    continue
-
-                if abm_group[abm_group["designation"] == "abm"].shape[0] == 0:
-                    continue
-
-                real_abm_groups[abm] = abm_group
-
-            mrs_assigned = []
-
-            for abm, abm_group in real_abm_groups.items():
-
-                mrs = abm_group[abm_group["designation"] == "mr"]
-
-                for _, row in mrs.iterrows():
-                    final_rows.append(row)
-                    mrs_assigned.append(row.name)
-
-                abm_row = abm_group[abm_group["designation"] == "abm"]
-                if not abm_row.empty:
-                    final_rows.append(abm_row.iloc[0])
-
-            mrs_assigned = set(mrs_assigned)
+    rows_out(len(summary_df))
 
-            all_mrs = rbm_group[rbm_group["designation"] == "mr"]
-            leftover_mrs = all_mrs[~all_mrs.index.isin(mrs_assigned)]
-
-            for _, row in leftover_mrs.iterrows():
-                final_rows.append(row)
-
-            if not leftover_mrs.empty:
-
-                total_camps = leftover_mrs["total_camps"].sum()
-                expected_camps = leftover_mrs["expected_camps"].sum()
-                exec_percent = (
-                    round((total_camps / expected_camps) * 100)
-                    if expected_camps > 0 else 0
-                )
-
-                vacant_abm = {
-                    "empId": "",
-                    "name": f"Vacant ({rbm})",
-                    "abm_name": f"Vacant ({rbm})",
-                    "rbm_name": rbm,
-                    "sm_name": sm,
-                    "state": "",
-                    "city": "",
-                    "designation": "abm",
-                    "hq": "",
-                    "total_camps": total_camps,
-                    "expected_camps": expected_camps,
-                    "execution_percent": exec_percent
-                }
-
-                final_rows.append(pd.Series(vacant_abm))
-
-            rbm_row = rbm_group[rbm_group["designation"] == "rbm"]
-
-            if not is_vacant_rbm:
-                if not rbm_row.empty:
-                    final_rows.append(rbm_row.iloc[0])
-
-            else:
-                abm_rows = rbm_group[rbm_group["designation"] == "abm"]
-
-                total_camps = abm_rows["total_camps"].sum()
-                expected_camps = abm_rows["expected_camps"].sum()
-
-                exec_percent = (
-                    round((total_camps / expected_camps) * 100)
-                    if expected_camps > 0 else 0
-                )
-
-                synthetic_rbm = {
-                    "empId": "",
-                    "name": rbm,
-                    "abm_name": rbm,
-                    "rbm_name": rbm,
-                    "sm_name": sm,
-                    "state": "",
-                    "city": "",
-                    "designation": "rbm",
-                    "hq": "",
-                    "total_camps": total_camps,
-                    "expected_camps": expected_camps,
-                    "execution_percent": exec_percent
-                }
-
-                final_rows.append(pd.Series(synthetic_rbm))
-
-        sm_row = sm_group[sm_group["designation"] == "sm"]
-        if not sm_row.empty:
-            final_rows.append(sm_row.iloc[0])
-
-    waterfall_df = pd.DataFrame(final_rows)
+    # ⭐ 2) BUILD WATERFALL SUMMARY (MR → ABM → RBM → SM)
+    mark("waterfall", rows_in=len(summary_df))
+    # MRs under their ABM, "Vacant (<rbm>)" ABM rows for MRs without one,
+    # synthetic rows for vacant RBMs (waterfall.py)
+    waterfall_df = build_waterfall(summary_df)
     waterfall_df = waterfall_df.drop(columns=["abm_name","sm_name","rank"], errors="ignore")
+    rows_out(len(waterfall_df))
 
     # ⭐ 3) EXPORT WATERFALL SUMMARY
+    mark("excel_write", rows_in=len(waterfall_df))
     with pd.ExcelWriter(
         output_file,
         engine="openpyxl",
@@ -618,6 +481,7 @@ def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
             print(f"Created RBM Sheet: '{safe_sheet_name}'  (RBM: '{raw_name}')")
 
     # 🔟 APPLY PROFESSIONAL EXCEL STYLING (CUSTOM COLORS)
+    mark("styling")
     wb = load_workbook(output_file)
 
     COLOR_HEADER = "9DC3E6"   # Blue header
@@ -687,26 +551,456 @@ def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
 
     wb.save(output_file)
     print(f"🎨 Excel Styling Applied Successfully for {output_file}")
+    end_stage()
+
+    return output_file
+
+
+def generate_pharma_report(aid, pharma_name, json_file, prescription_key,
+                           conn, bucket, start_date, end_date, sql_df=None,
+                           rx_rollup="oid", rx_parse="server",
+                           metrics_cache_dir=None, recheck_days=DEFAULT_RECHECK_DAYS,
+                           master_cache_dir=None, doctor_layout=DEFAULT_DOCTOR_LAYOUT):
+    """
+    Generates the full Excel report for a single pharma:
+    - Reads employee master from given json_file in GCS
+      (local copy reused while the blob generation is unchanged
+       when master_cache_dir is set)
+    - Runs SQL for given aId + prescription_key
+      (skipped when sql_df is passed in from the batch query,
+       incremental when metrics_cache_dir is set)
+    - Builds all sheets + styling (employee-doctor sheet in
+      doctor_layout: "long" or "wide")
+    """
+    print_pharma_header(aid, pharma_name, json_file, prescription_key)
+
+    with stage_context(tenant=pharma_name, aid=clean_aid(aid)):
+        emp_df = load_master_stage(bucket, json_file, master_cache_dir)
+        sql_df = load_doctor_metrics(
+            aid, prescription_key, conn, start_date, end_date, sql_df=sql_df,
+            rx_rollup=rx_rollup, rx_parse=rx_parse,
+            metrics_cache_dir=metrics_cache_dir, recheck_days=recheck_days
+        )
+        return build_pharma_report(pharma_name, emp_df, sql_df, doctor_layout)
 
 
 # ------------------------------------------------------------
-# 3️⃣ LOOP THROUGH ALL PHARMAS IN THE LIST
+# 3️⃣ RUN ONE PHARMA (never raises → status dict)
 # ------------------------------------------------------------
-for _, row in pharma_df.iterrows():
-    aid = row["aid"]
-    pharma_name = row["pharma_name"]
-    json_file = row["json_file"]
-    prescription_key = row.get("prescription_key", "")
-
-    generate_pharma_report(
-        aid=aid,
-        pharma_name=pharma_name,
-        json_file=json_file,
-        prescription_key=prescription_key,
-        conn=conn,
-        bucket=bucket,
-        start_date=START_DATE,
-        end_date=END_DATE
+def _job_status(job, status, error, seconds):
+    return {
+        "pharma_name": job["pharma_name"],
+        "aid": job["aid"],
+        "status": status,
+        "seconds": None if seconds is None else round(seconds, 1),
+        "error": error,
+        "pid": os.getpid(),
+    }
+
+
+def _job_context(job):
+    """Fields added to the stage records of one pharma."""
+    return {"tenant": job["pharma_name"], "aid": clean_aid(job["aid"])}
+
+
+def _check_rx_rollup(job, conn, start_date, end_date, options):
+    if options["check_rx_rollup"] and clean_prescription_key(job["prescription_key"]):
+        ok, _ = compare_rx_rollups(conn, job["aid"], job["prescription_key"], start_date, end_date)
+        if not ok:
+            print(f"⚠️ Rx rollup mismatch for {job['pharma_name']}")
+
+
+def _load_job_metrics(job, conn, start_date, end_date, options):
+    _check_rx_rollup(job, conn, start_date, end_date, options)
+    return load_doctor_metrics(
+        job["aid"], job["prescription_key"], conn, start_date, end_date,
+        sql_df=job.get("sql_df"),
+        rx_rollup=options["rx_rollup"],
+        rx_parse=options["rx_parse"],
+        metrics_cache_dir=options["metrics_cache_dir"],
+        recheck_days=options["recheck_days"]
     )
 
-print("\n✅✅ All pharma reports generated.")
+
+def run_pharma(job, conn, bucket, start_date, end_date, options):
+    """
+    Runs generate_pharma_report for one Pharma_list row.
+    A failing / timed-out pharma is recorded and the batch moves on.
+    """
+    started = time.perf_counter()
+
+    try:
+        _check_rx_rollup(job, conn, start_date, end_date, options)
+
+        generate_pharma_report(
+            aid=job["aid"],
+            pharma_name=job["pharma_name"],
+            json_file=job["json_file"],
+            prescription_key=job["prescription_key"],
+            conn=conn,
+            bucket=bucket,
+            start_date=start_date,
+            end_date=end_date,
+            sql_df=job.get("sql_df"),
+            rx_rollup=options["rx_rollup"],
+            rx_parse=options["rx_parse"],
+            metrics_cache_dir=options["metrics_cache_dir"],
+            recheck_days=options["recheck_days"],
+            master_cache_dir=options["master_cache_dir"],
+            doctor_layout=options["doctor_layout"]
+        )
+        status, error = "ok", ""
+
+    except Exception as exc:
+        end_stage()
+        traceback.print_exc()
+        print(f"❌ {job['pharma_name']} failed, continuing with the next pharma")
+        status, error = "failed", str(exc)
+
+    return _job_status(job, status, error, time.perf_counter() - started)
+
+
+# ------------------------------------------------------------
+# 4️⃣ PIPELINED RUN — PREFETCH NEXT PHARMAS WHILE THIS ONE BUILDS
+# ------------------------------------------------------------
+_PIPELINE_DONE = object()
+
+
+def _prefetch_inputs(jobs, conn, bucket, start_date, end_date, options, ready, stop):
+    """
+    Producer thread: loads (emp_df, sql_df) for each job in order and
+    puts them on the bounded `ready` queue. The GCS download and the SQL
+    query of one pharma run side by side on two threads.
+    """
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch") as io_pool:
+        for job in jobs:
+            if stop.is_set():
+                break
+
+            started = time.perf_counter()
+            context = _job_context(job)
+            master = io_pool.submit(with_context, context, load_master_stage, bucket,
+                                    job["json_file"], options["master_cache_dir"])
+            metrics = io_pool.submit(with_context, context, _load_job_metrics,
+                                     job, conn, start_date, end_date, options)
+            try:
+                item = (job, master.result(), metrics.result(), None)
+            except Exception as exc:
+                item = (job, None, None, exc)
+
+            # Blocks while `prefetch` pharmas are already waiting → memory stays capped
+            ready.put((item, time.perf_counter() - started))
+
+    ready.put((_PIPELINE_DONE, 0))
+
+
+def run_pipelined(jobs, conn, bucket, start_date, end_date, options, prefetch=2):
+    """
+    Same result as calling run_pharma() for every job, but the GCS / SQL
+    loads of the next pharmas overlap with the pandas + openpyxl build of
+    the current one. At most `prefetch` loaded pharmas wait in memory.
+    """
+    ready = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_prefetch_inputs,
+        args=(jobs, conn, bucket, start_date, end_date, options, ready, stop),
+        name="prefetch-producer",
+        daemon=True
+    )
+    producer.start()
+
+    run_status = []
+    try:
+        while True:
+            item, load_seconds = ready.get()
+            if item is _PIPELINE_DONE:
+                break
+
+            job, emp_df, sql_df, load_error = item
+            started = time.perf_counter()
+
+            print_pharma_header(job["aid"], job["pharma_name"], job["json_file"], job["prescription_key"])
+            try:
+                if load_error is not None:
+                    raise load_error
+                with stage_context(**_job_context(job)):
+                    build_pharma_report(job["pharma_name"], emp_df, sql_df, options["doctor_layout"])
+                status, error = "ok", ""
+
+            except Exception as exc:
+                end_stage()
+                traceback.print_exception(type(exc), exc, exc.__traceback__)
+                print(f"❌ {job['pharma_name']} failed, continuing with the next pharma")
+                status, error = "failed", str(exc)
+
+            del emp_df, sql_df, item
+            run_status.append(
+                _job_status(job, status, error, load_seconds + time.perf_counter() - started)
+            )
+
+    finally:
+        # Unblock the producer if the consumer stops early (e.g. Ctrl+C)
+        stop.set()
+        while producer.is_alive():
+            try:
+                ready.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
+
+    return run_status
+
+
+# ------------------------------------------------------------
+# 5️⃣ SCHEDULING — LARGEST PHARMAS FIRST
+# ------------------------------------------------------------
+def load_run_history(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_run_history(path, history, run_status):
+    """Keeps the last successful run time per pharma."""
+    if not path:
+        return
+    for r in run_status:
+        if r["status"] == "ok":
+            history[r["pharma_name"]] = r["seconds"]
+    with open(path, "w") as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+
+
+def order_largest_first(jobs, bucket, history):
+    """
+    Sorts jobs by expected cost, biggest first, so the slowest pharma
+    starts immediately instead of being picked up last.
+
+    - past run time (seconds) when the pharma is in history
+    - otherwise the employee master size (bytes, cheap metadata request),
+      converted to seconds with the median seconds/byte of known pharmas
+    """
+    sizes = {}
+    for job in jobs:
+        try:
+            blob = bucket.get_blob(clean_json_file(job["json_file"]))
+            sizes[job["pharma_name"]] = (blob.size or 0) if blob is not None else 0
+        except Exception:
+            sizes[job["pharma_name"]] = 0
+
+    ratios = sorted(
+        history[name] / sizes[name]
+        for name in sizes
+        if name in history and sizes[name] > 0
+    )
+    sec_per_byte = ratios[len(ratios) // 2] if ratios else 1.0
+
+    def expected_cost(job):
+        name = job["pharma_name"]
+        if name in history:
+            return history[name]
+        return sizes[name] * sec_per_byte
+
+    return sorted(jobs, key=expected_cost, reverse=True)
+
+
+# ------------------------------------------------------------
+# 6️⃣ PROCESS-POOL WORKERS (one SQL manager + GCS client each)
+# ------------------------------------------------------------
+_worker = {}
+
+
+def _init_worker(query_timeout, telemetry_run_id=None, profile_dir=None, query_log_config=None):
+    warnings.filterwarnings('ignore')
+    if query_log_config is not None:
+        query_log.configure(**query_log_config)
+    _worker["conn"] = connect_sql(query_timeout, pool_size=1)
+    _worker["bucket"] = connect_bucket()
+
+    # Stage lines are logged by the worker; records go back with the result
+    clear_sinks()
+    _worker["telemetry"] = telemetry_run_id is not None
+    if _worker["telemetry"]:
+        add_sink(json_line_sink(telemetry_run_id))
+        start_memory_tracing()
+
+    # Profiles are written by the worker; hot functions go back with the result
+    _worker["profiler"] = None
+    if profile_dir is not None:
+        _worker["profiler"] = StageProfiler(profile_dir)
+        add_stage_hook(_worker["profiler"])
+
+
+def _run_pharma_in_worker(job, start_date, end_date, options):
+    if not _worker["telemetry"]:
+        result = run_pharma(job, _worker["conn"], _worker["bucket"], start_date, end_date, options)
+    else:
+        with record_stages() as records:
+            result = run_pharma(job, _worker["conn"], _worker["bucket"], start_date, end_date, options)
+        result["stages"] = records
+
+    if _worker["profiler"] is not None:
+        result["profile"] = _worker["profiler"].dump()
+    return result
+
+
+# ------------------------------------------------------------
+# 7️⃣ BATCH SQL + RUN LOOP
+# ------------------------------------------------------------
+def load_batch_metrics(jobs, conn, start_date, end_date, args):
+    """(OPTIONAL) ONE SQL QUERY FOR ALL PHARMAS → job["sql_df"]."""
+    mark("sql_batch")
+    tenants = [(job["aid"], job["prescription_key"]) for job in jobs]
+    try:
+        batch_metrics = fetch_batch_doctor_metrics(conn, tenants, start_date, end_date,
+                                                   rx_rollup=args.rx_rollup,
+                                                   rx_parse=args.rx_parse)
+        for job in jobs:
+            job["sql_df"] = batch_metrics[clean_aid(job["aid"])]
+        rows_out(sum(len(df) for df in batch_metrics.values()))
+        print(f"✅ Batch Doctor Metrics Loaded for {len(batch_metrics)} pharmas")
+    except Exception as exc:
+        # Fall back to one query per pharma
+        print(f"⚠️ Batch SQL failed, querying pharmas one by one: {exc}")
+    end_stage()
+
+
+def run_jobs(jobs, conn, bucket, start_date, end_date, options, args, history,
+             telemetry=None, profiler=None):
+    """
+    LOOP THROUGH ALL PHARMAS (pipelined, serial or process pool) → run_status.
+    Closes conn (workers open their own).
+    """
+    run_status = []
+
+    if args.jobs <= 1 and args.prefetch > 0:
+        print(f"🚀 Pipelined run: prefetching up to {args.prefetch} pharmas ahead")
+        run_status = run_pipelined(jobs, conn, bucket, start_date, end_date, options,
+                                   prefetch=args.prefetch)
+        conn.close()
+
+    elif args.jobs <= 1:
+        for job in jobs:
+            run_status.append(run_pharma(job, conn, bucket, start_date, end_date, options))
+        conn.close()
+
+    else:
+        jobs = order_largest_first(jobs, bucket, history)
+        conn.close()
+
+        print(f"🚀 Running {len(jobs)} pharmas on {args.jobs} worker processes "
+              f"(order: {', '.join(job['pharma_name'] for job in jobs)})")
+
+        with ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=_init_worker,
+            initargs=(
+                args.query_timeout,
+                telemetry.run_id if telemetry is not None else None,
+                profiler.out_dir if profiler is not None else None,
+                query_log.config(),
+            )
+        ) as pool:
+            futures = {
+                pool.submit(_run_pharma_in_worker, job, start_date, end_date, options): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    # Worker process died (e.g. OOM-killed)
+                    result = {
+                        "pharma_name": job["pharma_name"], "aid": job["aid"],
+                        "status": "failed", "seconds": None, "error": repr(exc), "pid": None,
+                    }
+                stages = result.pop("stages", [])
+                if telemetry is not None:
+                    telemetry.add_records(stages)
+                profile = result.pop("profile", {})
+                if profiler is not None:
+                    profiler.add_summary(profile)
+                print(f"▶ {result['pharma_name']}: {result['status']} ({result['seconds']}s)")
+                run_status.append(result)
+
+    return run_status
+
+
+# ------------------------------------------------------------
+# 8️⃣ MAIN
+# ------------------------------------------------------------
+def main(argv=None):
+    args = parse_args(argv)
+    query_log.configure(
+        log_path=args.slow_query_log,
+        slow_seconds=args.slow_query_seconds,
+        capture_statistics=args.sql_statistics or None
+    )
+
+    pharma_df = pd.read_excel(PHARMA_LIST_FILE)
+
+    bucket = connect_bucket()
+    conn = connect_sql(args.query_timeout)
+    print("✅ Connected to SQL Server")
+
+    START_DATE, END_DATE = current_month_range()
+    print("SQL Range (Current Month):", START_DATE, "to", END_DATE)
+
+    options = {
+        "check_rx_rollup": args.check_rx_rollup,
+        "rx_rollup": args.rx_rollup,
+        "rx_parse": args.rx_parse,
+        "metrics_cache_dir": args.metrics_cache_dir,
+        "recheck_days": args.recheck_days,
+        "master_cache_dir": args.master_cache_dir,
+        "doctor_layout": args.doctor_layout,
+    }
+
+    jobs = [
+        {
+            "aid": row["aid"],
+            "pharma_name": row["pharma_name"],
+            "json_file": row["json_file"],
+            "prescription_key": row.get("prescription_key", ""),
+        }
+        for _, row in pharma_df.iterrows()
+    ]
+
+    history = load_run_history(args.history_file)
+
+    profile_dir = os.path.join(args.profile_dir, f"{datetime.now():%Y%m%d-%H%M%S}")
+
+    with run_telemetry("code", out_dir=args.telemetry_dir, enabled=bool(args.telemetry_dir)) as telemetry:
+        with profile_stages(profile_dir, enabled=args.profile) as profiler:
+            if args.batch_sql:
+                load_batch_metrics(jobs, conn, START_DATE, END_DATE, args)
+
+            run_status = run_jobs(jobs, conn, bucket, START_DATE, END_DATE, options, args, history,
+                                  telemetry, profiler)
+
+        if telemetry is not None:
+            telemetry.extra["pharmas"] = run_status
+            if profiler is not None:
+                telemetry.extra["hot_functions"] = profiler.hot_summary()
+
+    save_run_history(args.history_file, history, run_status)
+
+    # --------------------------------------------------------
+    # RUN SUMMARY
+    # --------------------------------------------------------
+    status_df = pd.DataFrame(run_status)
+    print("\n" + status_df.drop(columns=["pid"]).to_string(index=False))
+
+    failed = status_df[status_df["status"] != "ok"]
+    if failed.empty:
+        print("\n✅✅ All pharma reports generated.")
+        return 0
+
+    print(f"\n⚠️ {len(failed)} of {len(status_df)} pharma reports failed.")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,148 @@
-from google.cloud import storage
+"""
+Prefetch every org_access_codes/*.json employee master into the local
+master cache (employee_master.py) before the report batch starts.
 
-st = storage.Client("neodocs-8d6cd")
-bucket = st.bucket("neodocs-8d6cd-utils")
+- one prefix listing (the listing already carries generation / md5)
+- masters that are new or changed are downloaded on a thread pool
+- each master is parsed + validated before it is cached
 
-# List all JSON files
-json_files = [blob.name for blob in bucket.list_blobs() if blob.name.endswith(".json")]
+Afterwards the batch (TEST/code.py --master-cache-dir <same dir>) only
+does a metadata check per pharma and never waits on a download.
 
-print(json_files)
+    python alljson.py --cache-dir .master_cache
+    python alljson.py --list-only
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import pandas as pd
 
-#['org_access_codes/ajanta-hb.json', 
-# 'org_access_codes/akumentis-hb.json', 
-# 'org_access_codes/alembic-uacr.json', 
-# 'org_access_codes/benitowa-uacr.json', 
-# 'org_access_codes/bi-pharma.json', 
+from backends import get_bucket
+from employee_master import (
+    blob_version,
+    download_master,
+    is_cached,
+    save_master_cache,
+    validate_master,
+)
+
+MASTER_PREFIX = "org_access_codes/"
+DEFAULT_CACHE_DIR = ".master_cache"
+DEFAULT_WORKERS = 8
+
+STATUS_COLUMNS = ["json_file", "status", "employees", "seconds", "error"]
+
+
+def list_masters(bucket, prefix=MASTER_PREFIX):
+    """All *.json blobs under prefix (Blob objects with metadata)."""
+    return [blob for blob in bucket.list_blobs(prefix=prefix) if blob.name.endswith(".json")]
+
+
+def prefetch_master(blob, cache_dir, force=False):
+    """Downloads, validates and caches one master → status dict."""
+    started = time.perf_counter()
+    version = blob_version(blob)
+
+    if not force and is_cached(cache_dir, blob.name, version):
+        return {"json_file": blob.name, "status": "fresh", "employees": None,
+                "seconds": 0.0, "error": ""}
+
+    try:
+        emp_df = download_master(blob)
+        problems = validate_master(emp_df)
+        if problems:
+            status, error = "invalid", "; ".join(problems)
+        else:
+            save_master_cache(cache_dir, blob.name, emp_df, version)
+            status, error = "downloaded", ""
+        employees = len(emp_df)
+
+    except Exception as exc:
+        status, error, employees = "failed", str(exc), None
+
+    return {"json_file": blob.name, "status": status, "employees": employees,
+            "seconds": round(time.perf_counter() - started, 2), "error": error}
+
+
+def prefetch_all(bucket, cache_dir=DEFAULT_CACHE_DIR, prefix=MASTER_PREFIX,
+                 workers=DEFAULT_WORKERS, force=False):
+    """Warms the master cache for every master under prefix → status DataFrame."""
+    blobs = list_masters(bucket, prefix)
+    print(f"Found {len(blobs)} masters under {prefix}")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(prefetch_master, blob, cache_dir, force) for blob in blobs]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    # Explicit columns → an empty listing gives an empty table
+    return pd.DataFrame(results, columns=STATUS_COLUMNS).sort_values("json_file").reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prefetch all employee masters into the local cache")
+    parser.add_argument("--prefix", default=MASTER_PREFIX)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--force", action="store_true", help="Re-download even if the cached generation matches")
+    parser.add_argument("--list-only", action="store_true", help="Only print the master file names")
+    args = parser.parse_args(argv)
+
+    bucket = get_bucket()
+
+    if args.list_only:
+        json_files = [blob.name for blob in list_masters(bucket, args.prefix)]
+        print(json_files)
+        return 0
+
+    started = time.perf_counter()
+    status_df = prefetch_all(bucket, args.cache_dir, args.prefix, args.workers, args.force)
+
+    if status_df.empty:
+        print(f"❌ No *.json masters under {args.prefix}")
+        return 1
+
+    print(status_df.to_string(index=False))
+    print(f"\nPrefetched into {args.cache_dir} in {time.perf_counter() - started:.1f}s: "
+          + ", ".join(f"{k}={v}" for k, v in status_df["status"].value_counts().items()))
+
+    # "invalid" is only reported: the bucket also holds non-master JSON
+    # (e.g. lupin-hb-dr-details.json), which are never cached
+    return 1 if (status_df["status"] == "failed").any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+#['org_access_codes/ajanta-hb.json',
+# 'org_access_codes/akumentis-hb.json',
+# 'org_access_codes/alembic-uacr.json',
+# 'org_access_codes/benitowa-uacr.json',
+# 'org_access_codes/bi-pharma.json',
 # 'org_access_codes/bluecross-uacr.json',
-#  'org_access_codes/cachet-iup-hb.json', 
+#  'org_access_codes/cachet-iup-hb.json',
 # 'org_access_codes/coronaremedies-solis-hb.json',
-#  'org_access_codes/emcure-gennova.json', 
-# 'org_access_codes/emcure-hb.json', 
-# 'org_access_codes/fourrts-uti.json', 
-# 'org_access_codes/indchemie-hb.json', 
-# 'org_access_codes/intas-psa.json', 
-# 'org_access_codes/ipca-uacr.json', 
-# 'org_access_codes/jb.json', 
-# 'org_access_codes/linadapa-uacr.json', 
-# 'org_access_codes/lupin-hb-dr-details.json', 
-# 'org_access_codes/lupin-hb.json', 
-# 'org_access_codes/mankind-hb.json', 
-# 'org_access_codes/mankind-zesteva-hb.json', 
-# 'org_access_codes/microlabs-ferisome-hb.json', 
-# 'org_access_codes/mmc.json', 
-# 'org_access_codes/nutricharge-hb.json', 
-# 'org_access_codes/reach52-hb.json', 
-# 'org_access_codes/sunpharma.json', 
+#  'org_access_codes/emcure-gennova.json',
+# 'org_access_codes/emcure-hb.json',
+# 'org_access_codes/fourrts-uti.json',
+# 'org_access_codes/indchemie-hb.json',
+# 'org_access_codes/intas-psa.json',
+# 'org_access_codes/ipca-uacr.json',
+# 'org_access_codes/jb.json',
+# 'org_access_codes/linadapa-uacr.json',
+# 'org_access_codes/lupin-hb-dr-details.json',
+# 'org_access_codes/lupin-hb.json',
+# 'org_access_codes/mankind-hb.json',
+# 'org_access_codes/mankind-zesteva-hb.json',
+# 'org_access_codes/microlabs-ferisome-hb.json',
+# 'org_access_codes/mmc.json',
+# 'org_access_codes/nutricharge-hb.json',
+# 'org_access_codes/reach52-hb.json',
+# 'org_access_codes/sunpharma.json',
 # 'org_access_codes/systopic-hb-pilot.json',
-#  'org_access_codes/usv.json', 
+#  'org_access_codes/usv.json',
 # 'org_access_codes/vitamystic-hb.json']
@@ -0,0 +1,308 @@
+"""
+Pluggable data backends for the report scripts.
+
+    azure (default) → Azure SQL through pyodbc + the GCS utils bucket
+    local           → SQLite store with the dbo schema + a directory bucket
+
+The backend is picked from the environment, so the scripts run
+unchanged offline:
+
+    REPORT_BACKEND=local REPORT_LOCAL_DIR=.local_backend python ipca.py
+
+Local layout:
+
+    <dir>/dbo.sqlite                          dbo.user_tests, dbo.rx, dbo.aId
+    <dir>/bucket/org_access_codes/*.json      employee masters
+
+SQLite has no dbo schema, LEFT(), JSON_VALUE() etc.: dbo.sqlite is
+ATTACHed as "dbo", the missing T-SQL functions are registered on every
+connection, and the query builders emit dialect="sqlite" SQL for the
+rest (see sql_queries.SQL_DIALECTS).
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+from sql_conn import SqlConnectionManager
+
+BACKEND_ENV = "REPORT_BACKEND"
+LOCAL_DIR_ENV = "REPORT_LOCAL_DIR"
+BACKENDS = ["azure", "local"]
+DEFAULT_LOCAL_DIR = ".local_backend"
+
+GCS_PROJECT = "neodocs-8d6cd"
+GCS_BUCKET = "neodocs-8d6cd-utils"
+
+
+# ------------------------------------------------------------
+# SELECTION
+# ------------------------------------------------------------
+def backend_name():
+    name = os.environ.get(BACKEND_ENV, "azure").strip().lower() or "azure"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown {BACKEND_ENV}={name!r} (expected one of {BACKENDS})")
+    return name
+
+
+def local_dir():
+    return os.environ.get(LOCAL_DIR_ENV, DEFAULT_LOCAL_DIR)
+
+
+def local_paths(root=None):
+    root = root or local_dir()
+    return {
+        "root": root,
+        "sqlite": os.path.join(root, "dbo.sqlite"),
+        "bucket": os.path.join(root, "bucket"),
+    }
+
+
+def get_bucket():
+    """GCS bucket, or the local directory bucket with REPORT_BACKEND=local."""
+    if backend_name() == "local":
+        return LocalBucket(local_paths()["bucket"])
+
+    from google.cloud import storage
+
+    st = storage.Client(GCS_PROJECT)
+    return st.bucket(GCS_BUCKET)
+
+
+def get_sql_manager(conn_str, **kwargs):
+    """SqlConnectionManager for Azure SQL, or for the local SQLite store."""
+    if backend_name() == "local":
+        return local_sql_manager(local_paths()["sqlite"], **kwargs)
+    return SqlConnectionManager(conn_str, **kwargs)
+
+
+# ------------------------------------------------------------
+# LOCAL BUCKET (subset of google.cloud.storage.Bucket / Blob)
+# ------------------------------------------------------------
+class LocalBlob:
+    """A file under the bucket root, with GCS-like metadata."""
+
+    def __init__(self, bucket, name, load_metadata=False):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, *name.split("/"))
+        self.generation = None
+        self.size = None
+        self._md5_hash = None
+        if load_metadata:
+            self.reload()
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        stat = os.stat(self.path)
+        self.generation = stat.st_mtime_ns
+        self.size = stat.st_size
+        self._md5_hash = None
+
+    @property
+    def md5_hash(self):
+        """Base64 md5 of the content, like GCS (computed on first use)."""
+        if self._md5_hash is None and self.generation is not None:
+            with open(self.path, "rb") as f:
+                digest = hashlib.md5(f.read()).digest()
+            self._md5_hash = base64.b64encode(digest).decode()
+        return self._md5_hash
+
+    def download_as_bytes(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def download_as_text(self, encoding="utf-8"):
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_string(self, data, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self.reload()
+
+
+class LocalBucket:
+    """Directory stand-in for the GCS bucket (blob / get_blob / list_blobs)."""
+
+    def __init__(self, root):
+        self.root = root
+        self.name = os.path.basename(os.path.abspath(root))
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        blob = LocalBlob(self, name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix=None):
+        names = []
+        for folder, _, files in os.walk(self.root):
+            rel = os.path.relpath(folder, self.root)
+            for file_name in files:
+                name = file_name if rel == "." else "/".join(rel.split(os.sep) + [file_name])
+                if prefix is None or name.startswith(prefix):
+                    names.append(name)
+
+        return [LocalBlob(self, name, load_metadata=True) for name in sorted(names)]
+
+
+# ------------------------------------------------------------
+# LOCAL SQL STORE (SQLite, dbo schema)
+# ------------------------------------------------------------
+# Same columns the report queries read. aId columns are NOCASE like the
+# case-insensitive collation on Azure SQL; campDate is ISO text
+# ("YYYY-MM-DD HH:MM:SS") so BETWEEN behaves like datetime compares.
+DBO_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dbo.aId (
+    aId TEXT PRIMARY KEY COLLATE NOCASE
+);
+
+CREATE TABLE IF NOT EXISTS dbo.user_tests (
+    testId TEXT,
+    aId TEXT COLLATE NOCASE,
+    empId TEXT,
+    docId TEXT,
+    drName TEXT,
+    oId TEXT,
+    campDate TEXT,
+    statusCode INTEGER,
+    isDeleted INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS dbo.rx (
+    aId TEXT COLLATE NOCASE,
+    oId TEXT,
+    campDate TEXT,
+    isDeleted INTEGER DEFAULT 0,
+    prescriptions TEXT
+);
+
+CREATE INDEX IF NOT EXISTS dbo.ix_user_tests_aid_date ON user_tests (aId, campDate);
+CREATE INDEX IF NOT EXISTS dbo.ix_rx_aid_date ON rx (aId, campDate);
+"""
+
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+_INT_TEXT = re.compile(r"[+-]?\d+")
+_JSON_PATH_STEP = re.compile(r'\.(?:"((?:[^"\\]|\\.)*)"|([^.\[]+))|\[(\d+)\]')
+
+
+def _try_cast_int(value):
+    """TRY_CAST(value AS INT): NULL for anything that is not an INT."""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        number = value
+    else:
+        text = str(value).strip()
+        if not _INT_TEXT.fullmatch(text):
+            return None
+        number = int(text)
+    return number if _INT32_MIN <= number <= _INT32_MAX else None
+
+
+def _json_value(document, path):
+    """JSON_VALUE (lax): scalar at path as text, NULL for objects / missing / bad JSON."""
+    if document is None or path is None or not path.startswith("$"):
+        return None
+    try:
+        value = json.loads(document)
+    except ValueError:
+        return None
+
+    rest = path[1:]
+    position = 0
+    while position < len(rest):
+        step = _JSON_PATH_STEP.match(rest, position)
+        if step is None:
+            return None
+        quoted, plain, index = step.groups()
+        if index is not None:
+            if not isinstance(value, list) or int(index) >= len(value):
+                return None
+            value = value[int(index)]
+        else:
+            key = json.loads(f'"{quoted}"') if quoted is not None else plain
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        position = step.end()
+
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _concat(*values):
+    return "".join("" if v is None else str(v) for v in values)
+
+
+def connect_local_sql(sqlite_path):
+    """
+    sqlite3 connection with dbo.sqlite attached as "dbo" and the T-SQL
+    functions the report queries use (JSON_VALUE, CONCAT, TRY_CAST_INT). Safe to hand between threads one at a time (pool).
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS dbo", (sqlite_path,))
+
+    conn.create_function("JSON_VALUE", 2, _json_value, deterministic=True)
+    conn.create_function("CONCAT", -1, _concat, deterministic=True)
+    conn.create_function("TRY_CAST_INT", 1, _try_cast_int, deterministic=True)
+
+    return conn
+
+
+def create_local_store(root=None):
+    """Creates <root>/dbo.sqlite (tables + indexes) and <root>/bucket/."""
+    paths = local_paths(root)
+    os.makedirs(paths["bucket"], exist_ok=True)
+
+    conn = connect_local_sql(paths["sqlite"])
+    try:
+        conn.executescript(DBO_SCHEMA)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return paths
+
+
+def write_table(sqlite_path, table, df, replace=False):
+    """Appends df rows to dbo.<table> (column names must match the schema)."""
+    conn = connect_local_sql(sqlite_path)
+    try:
+        if replace:
+            conn.execute(f"DELETE FROM dbo.{table}")
+
+        columns = list(df.columns)
+        placeholders = ", ".join(["?"] * len(columns))
+        conn.executemany(
+            f"INSERT INTO dbo.{table} ({', '.join(columns)}) VALUES ({placeholders})",
+            df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def local_sql_manager(sqlite_path, **kwargs):
+    """SqlConnectionManager over the local store (dialect="sqlite")."""
+    if not os.path.exists(sqlite_path):
+        raise FileNotFoundError(
+            f"Local SQL store not found: {sqlite_path} (create it with backends.create_local_store)"
+        )
+    return SqlConnectionManager(
+        connect=lambda: connect_local_sql(sqlite_path), dialect="sqlite", **kwargs
+    )
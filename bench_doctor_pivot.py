@@ -0,0 +1,191 @@
+"""
+Benchmark: doctor metrics → wide employee-doctor layout.
+
+    legacy = pivot_table(aggfunc="first") + column-name parsing (old scripts)
+    fast   = doctor_pivot.pivot_doctors
+
+Runs on synthetic doctor metrics (no SQL needed), checks both give the
+same frame (values, dtypes, column order) and prints best-of-N timings.
+Also checks that the per-employee totals used with the long layout
+match the wide Total Camps / Total Tests columns, and with --excel times
+writing the sheet in both layouts.
+
+    python bench_doctor_pivot.py --mrs 200 --doctors 500 --repeat 3
+    python bench_doctor_pivot.py --mrs 1000 --doctors 300 --median 8 --excel
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from doctor_pivot import DOCTOR_FIELDS, doctor_index, doctor_sheet, employee_totals, pivot_doctors
+
+
+def synthetic_metrics(mrs, doctors, seed=7, median=None):
+    """
+    sql_df shaped like fetch_doctor_metrics(): up to `doctors` rows per MR
+    (uniform over doctors/2..doctors, or long-tailed around `median`).
+    """
+    rng = np.random.default_rng(seed)
+    if median:
+        per_mr = np.clip(rng.lognormal(np.log(median), 1.0, size=mrs).astype(int), 1, doctors)
+    else:
+        per_mr = rng.integers(max(1, doctors // 2), doctors + 1, size=mrs)
+    per_mr[0] = doctors                       # at least one MR with the full count
+    emp = np.repeat(np.arange(mrs), per_mr)
+    n = len(emp)
+
+    camps = rng.integers(1, 6, size=n)
+    return pd.DataFrame({
+        "empId": pd.array([f"EMP{e:05d}" for e in emp], dtype="str"),
+        "Doctor": pd.array([f"Dr {i}" for i in range(n)], dtype="str"),
+        "Doctor ID": pd.array([f"D{i:07d}" for i in range(n)], dtype="str"),
+        "Doc Total Camps": camps,
+        "Total Rx": rng.integers(0, 10, size=n),
+        "Total Strips": rng.integers(0, 20, size=n),
+        "Total Tests": camps + rng.integers(0, 10, size=n),
+    }).sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def legacy_pivot(sql_df):
+    pivoted = sql_df.pivot_table(
+        index=['empId'],
+        columns='Doctor Index',
+        values=['Doctor', 'Doctor ID', 'Doc Total Camps', 'Total Rx', 'Total Strips', 'Total Tests'],
+        aggfunc='first'
+    )
+    pivoted.columns = [f"{col[0]} {int(col[1])}" for col in pivoted.columns]
+    pivoted = pivoted.reset_index()
+
+    doc_camp_cols = [col for col in pivoted.columns if col.startswith("Doc Total Camps")]
+    pivoted["Total Camps"] = pivoted[doc_camp_cols].sum(axis=1)
+
+    doctor_indices = sorted(
+        list({
+            int(col.split()[-1])
+            for col in pivoted.columns
+            if col not in ["empId", "Total Camps"]
+        })
+    )
+    ordered_columns = ["empId", "Total Camps"]
+    for idx in doctor_indices:
+        for field in DOCTOR_FIELDS:
+            col_name = f"{field} {idx}"
+            if col_name in pivoted.columns:
+                ordered_columns.append(col_name)
+
+    return pivoted.reindex(columns=ordered_columns)
+
+
+def same_frame(a, b):
+    try:
+        pd.testing.assert_frame_equal(a, b, check_index_type=False)
+        return True
+    except AssertionError as exc:
+        print(exc)
+        return False
+
+
+def edge_cases():
+    """Small frames with the cases pivot_table treats specially."""
+    base = synthetic_metrics(6, 4, seed=3)
+    dense = base.groupby("empId").head(2).reset_index(drop=True)
+
+    holes = base.copy()
+    holes.loc[holes.index[::3], ["Doctor", "Doctor ID"]] = np.nan
+    holes.loc[holes.index[1], "empId"] = np.nan
+    holes.loc[holes.index[2], DOCTOR_FIELDS] = np.nan
+    holes[["Total Rx", "Total Strips", "Total Tests", "Doc Total Camps"]] = (
+        holes[["Total Rx", "Total Strips", "Total Tests", "Doc Total Camps"]].astype("float64")
+    )
+
+    return {"ragged": base, "dense": dense, "holes": holes, "empty": base.iloc[:0].copy()}
+
+
+def wide_totals(pivoted):
+    """Total Camps + summed Total Tests <n> columns of the wide frame."""
+    test_cols = [col for col in pivoted.columns if col.startswith("Total Tests")]
+    out = pivoted[["empId", "Total Camps"]].copy()
+    out["Total Tests"] = pivoted[test_cols].fillna(0).sum(axis=1) if test_cols else 0.0
+    return out
+
+
+def synthetic_employees(sql_df, extra=3):
+    """emp_df for the metrics: every empId + a few employees without doctors."""
+    ids = sorted(sql_df["empId"].dropna().unique().tolist()) + [f"NODOC{i}" for i in range(extra)]
+    return pd.DataFrame({
+        "empId": pd.array(ids, dtype="str"),
+        "mr_name": [f"MR {e}" for e in ids],
+        "mr_designation": "mr",
+        "region_list": None,
+    })
+
+
+def time_excel(emp_df, sql_df, repeat):
+    """{layout: (best write seconds, sheet shape)} for to_excel of the sheet."""
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout in ["wide", "long"]:
+            sheet_df, _ = doctor_sheet(emp_df, sql_df, layout)
+            path = os.path.join(tmp, f"{layout}.xlsx")
+            seconds, _ = best_of(lambda df: df.to_excel(path, index=False), sheet_df, repeat)
+            out[layout] = (seconds, sheet_df.shape, os.path.getsize(path))
+    return out
+
+
+def best_of(fn, sql_df, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn(sql_df)
+        times.append(time.perf_counter() - started)
+    return min(times), out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mrs", type=int, default=200)
+    parser.add_argument("--doctors", type=int, default=500, help="Max doctors per MR")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--median", type=int, default=None,
+                        help="Long-tailed doctors per MR around this median (a few busy MRs)")
+    parser.add_argument("--excel", action="store_true", help="Also time to_excel of the long vs wide sheet")
+    args = parser.parse_args(argv)
+
+    ok = True
+    for name, df in edge_cases().items():
+        df["Doctor Index"] = doctor_index(df)
+        if not same_frame(legacy_pivot(df), pivot_doctors(df)):
+            print(f"❌ Edge case '{name}' differs")
+            ok = False
+        if not same_frame(wide_totals(pivot_doctors(df)), employee_totals(df)):
+            print(f"❌ Edge case '{name}': long-layout totals differ from the wide sheet")
+            ok = False
+
+    sql_df = synthetic_metrics(args.mrs, args.doctors, median=args.median)
+    sql_df["Doctor Index"] = doctor_index(sql_df)
+    print(f"Doctor metrics: {len(sql_df)} rows, {args.mrs} MRs, up to {args.doctors} doctors per MR")
+
+    legacy_s, legacy_df = best_of(legacy_pivot, sql_df, args.repeat)
+    fast_s, fast_df = best_of(pivot_doctors, sql_df, args.repeat)
+
+    print(f"legacy : {legacy_s:.3f}s  ({legacy_df.shape[1]} columns)")
+    print(f"fast   : {fast_s:.3f}s")
+    print(f"speedup: {legacy_s / fast_s:.1f}x")
+
+    if args.excel:
+        for layout, (seconds, shape, size) in time_excel(synthetic_employees(sql_df), sql_df, args.repeat).items():
+            print(f"to_excel {layout:<4}: {seconds:.3f}s  ({shape[0]} rows × {shape[1]} columns, {size / 1e6:.1f} MB)")
+
+    if not ok or not same_frame(legacy_df, fast_df):
+        print("❌ Outputs differ")
+        return 1
+    print("✅ Outputs match")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
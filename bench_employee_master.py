@@ -0,0 +1,107 @@
+"""
+Benchmark: employee master JSON → emp_df.
+
+    legacy = json.loads + DataFrame(dict).transpose() + region_list apply
+    fast   = employee_master.parse_master_json + employee_master_frame
+
+Runs on a synthetic master (no GCS needed), checks both paths give the
+same rows and values, and prints best-of-N timings.
+
+    python bench_employee_master.py --employees 50000 --repeat 3
+"""
+import argparse
+import json
+import random
+import time
+
+import pandas as pd
+
+from employee_master import employee_master_frame, orjson, parse_master_json
+
+
+def synthetic_master(employees, seed=7):
+    """{empId: {...}} shaped like org_access_codes/*.json."""
+    rng = random.Random(seed)
+    states = ["Maharashtra", "Gujarat", "Karnataka", "Tamil Nadu", "Delhi", "West Bengal"]
+    designations = ["mr"] * 8 + ["abm", "rbm", "sm"]
+
+    master = {}
+    for i in range(employees):
+        state = rng.choice(states)
+        master[f"EMP{i:06d}"] = {
+            "mr_name": "Training" if rng.random() < 0.01 else f"Employee {i}",
+            "mr_designation": rng.choice(designations),
+            "abm_name": f"ABM {i // 8}",
+            "rbm_name": f"RBM {i // 64}",
+            "sm_name": f"SM {i // 512}",
+            "state": state,
+            "city": f"{state} City {rng.randint(1, 20)}",
+            "mr_region": f"HQ {rng.randint(1, 300)}",
+            "region_list": [f"R{rng.randint(1, 50)}" for _ in range(rng.randint(0, 3))],
+            "phone": f"9{rng.randint(100000000, 999999999)}",
+        }
+    return master
+
+
+def legacy_frame(raw):
+    employee_dict = json.loads(raw)
+
+    emp_df = pd.DataFrame(employee_dict).transpose().reset_index()
+    emp_df.rename(columns={"index": "empId", "mr_region": "hq"}, inplace=True)
+    emp_df = emp_df[emp_df['mr_name'] != "Training"]
+    if "region_list" in emp_df.columns:
+        emp_df["region_list"] = emp_df["region_list"].apply(
+            lambda x: ", ".join(x) if isinstance(x, list) else x
+        )
+    emp_df["empId"] = emp_df["empId"].astype(str)
+    return emp_df
+
+
+def fast_frame(raw):
+    return employee_master_frame(parse_master_json(raw))
+
+
+def best_of(fn, raw, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn(raw)
+        times.append(time.perf_counter() - started)
+    return min(times), out
+
+
+def same_frame(a, b):
+    """Same columns, rows and values (dtypes may differ: legacy is all object)."""
+    a = a.reset_index(drop=True).astype(object)
+    b = b.reset_index(drop=True).astype(object)
+    if list(a.columns) != list(b.columns):
+        return False
+    return a.where(a.notna(), None).equals(b.where(b.notna(), None))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--employees", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    raw = json.dumps(synthetic_master(args.employees)).encode()
+    print(f"Master: {args.employees} employees, {len(raw) / 1e6:.1f} MB, "
+          f"parser: {'orjson' if orjson is not None else 'json'}")
+
+    legacy_s, legacy_df = best_of(legacy_frame, raw, args.repeat)
+    fast_s, fast_df = best_of(fast_frame, raw, args.repeat)
+
+    print(f"legacy : {legacy_s:.3f}s  {legacy_df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+    print(f"fast   : {fast_s:.3f}s  {fast_df.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+    print(f"speedup: {legacy_s / fast_s:.1f}x")
+
+    if not same_frame(legacy_df, fast_df):
+        print("❌ Outputs differ")
+        return 1
+    print("✅ Outputs match")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
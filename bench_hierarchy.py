@@ -0,0 +1,357 @@
+"""
+Benchmark: hierarchy steps of the summary sheets (hierarchy.py).
+
+    relabel   legacy = per-ABM / per-RBM loops with a full-frame mask per block
+                       (FIX ABM NAMES PER RBM BLOCK / FIX RBM NAMES PER SM BLOCK)
+              fast   = relabel_vacant_abms / relabel_vacant_rbms
+    rollup    legacy = groupby().sum().to_dict() + map() per level and metric
+                       (ipca chained, lupin / TEST/code.py per MR, lupin's
+                       row-wise apply_totals, benitowa per ABM)
+              fast   = OrgTree(...).rollup()
+    missing   legacy = full-frame existence check per SM / RBM / ABM name
+                       and a list of dicts (lupin.py)
+              fast   = missing_manager_rows (one anti-join per level)
+
+Runs on a synthetic field force (synth_org.generate_master, no GCS / SQL
+needed) with extra awkward rows — missing and empty manager names, RBMs
+split over two SMs, names that already look like "Vacant (...)" — checks
+both give the same frame and prints best-of-N timings.
+
+    python bench_hierarchy.py --mrs 20000 --repeat 3
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from employee_master import employee_master_frame
+from hierarchy import OrgTree, missing_manager_rows, relabel_vacant_abms, relabel_vacant_rbms
+from synth_org import generate_master
+
+SUMMARY_COLUMNS = [
+    "empId", "name", "abm_name", "rbm_name", "sm_name",
+    "state", "city", "designation", "hq",
+    "total_camps", "expected_camps",
+]
+
+
+def summary_frame(emp_df, seed=7):
+    """summary_df as built by the scripts before the vacancy fixes."""
+    rng = np.random.default_rng(seed)
+    mr = emp_df[emp_df["mr_designation"].str.lower() == "mr"]
+    mr_rows = mr.rename(columns={"mr_name": "name"}).assign(
+        designation="mr",
+        total_camps=rng.integers(0, 8, size=len(mr)).astype(float),
+        expected_camps=0.0,
+    )[SUMMARY_COLUMNS]
+
+    manager_rows = []
+    for role in ["abm", "rbm", "sm"]:
+        subset = emp_df[emp_df["mr_designation"].str.lower() == role]
+        subset = subset.rename(columns={"mr_name": "name"}).assign(
+            designation=role, total_camps=0.0, expected_camps=2.0 if role == "abm" else 0.0
+        )[SUMMARY_COLUMNS]
+        manager_rows.append(subset)
+
+    summary_df = pd.concat([mr_rows] + manager_rows, ignore_index=True)
+    summary_df["rank"] = summary_df["designation"].map({"sm": 4, "rbm": 3, "abm": 2, "mr": 1})
+    return summary_df.sort_values("rank", ascending=False).drop_duplicates(subset=["empId"], keep="first")
+
+
+def synthetic_summary(mrs, seed=7):
+    """Synthetic summary_df with the awkward cases of real masters mixed in."""
+    master, _ = generate_master(random.Random(seed), mrs, cross_rbm_rate=0.1)
+    emp_df = employee_master_frame(master)
+    df = summary_frame(emp_df, seed).reset_index(drop=True)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.permutation(len(df))
+    picks = np.array_split(rows[: max(8, len(df) // 20)], 4)
+
+    df.loc[picks[0], "rbm_name"] = np.nan                 # missing managers
+    df.loc[picks[1], "sm_name"] = ""                      # empty manager names
+    rbm_rows = df.index[df["designation"] == "rbm"]
+    if len(rbm_rows) > 1:
+        # An RBM whose team is split over two SMs
+        rbm = df.at[rbm_rows[0], "rbm_name"]
+        other_sm = df.at[rbm_rows[1], "sm_name"]
+        team = df.index[df["rbm_name"] == rbm]
+        df.loc[team[::2], "sm_name"] = other_sm
+    abm_rows = df.index[df["designation"] == "abm"]
+    if len(abm_rows) and len(rbm_rows):
+        # Two ABM records with the same name under different RBMs
+        twin = df.loc[abm_rows[:1]].assign(empId="TWIN-ABM", rbm_name=df.at[rbm_rows[-1], "rbm_name"])
+        df = pd.concat([df, twin], ignore_index=True)
+    # A master that already uses vacant labels as ABM names
+    df.loc[picks[2], "abm_name"] = "Vacant (" + df.loc[picks[2], "rbm_name"].astype(object).astype(str) + ")"
+    return df
+
+
+# ------------------------------------------------------------
+# LEGACY (as in ipca.py / lupin.py / TEST/code.py)
+# ------------------------------------------------------------
+def legacy_relabel_abms(summary_df):
+    df = summary_df.copy()
+
+    for abm, abm_group in df.groupby("abm_name", dropna=False):
+        true_block = abm_group[abm_group["name"] == abm]
+        if true_block.empty:
+            continue
+        true_rbm = true_block.iloc[0]["rbm_name"]
+        rbm_list = abm_group["rbm_name"].fillna("").unique().tolist()
+        for rbm in rbm_list:
+            if rbm == true_rbm:
+                continue
+            vacant_abm = f"Vacant ({rbm})"
+            mask = (df["abm_name"] == abm) & (df["rbm_name"] == rbm)
+            df.loc[mask, "abm_name"] = vacant_abm
+            df.loc[mask & (df["designation"] == "abm"), "name"] = vacant_abm
+
+    return df.copy()
+
+
+def legacy_relabel_rbms(summary_df):
+    df = summary_df.copy()
+
+    for rbm, rbm_group in df.groupby("rbm_name", dropna=False):
+        rbm_row = rbm_group[(rbm_group["designation"] == "rbm") &
+                            (rbm_group["name"] == rbm)]
+        if rbm_row.empty:
+            continue
+        true_sm = rbm_row.iloc[0]["sm_name"]
+        all_sms = rbm_group["sm_name"].fillna("").unique().tolist()
+        for sm in all_sms:
+            if sm != true_sm:
+                vacant_name = f"Vacant ({sm})"
+                mask = (df["rbm_name"] == rbm) & (df["sm_name"] == sm)
+                df.loc[mask, "rbm_name"] = vacant_name
+
+    return df.copy()
+
+
+def legacy_relabel(summary_df):
+    return legacy_relabel_rbms(legacy_relabel_abms(summary_df))
+
+
+def fast_relabel(summary_df):
+    return relabel_vacant_rbms(relabel_vacant_abms(summary_df))
+
+
+# ------------------------------------------------------------
+# ROLLUPS: legacy versions from the scripts vs OrgTree
+# ------------------------------------------------------------
+def _map_level(df, role, key_col, totals):
+    mask = df["designation"] == role
+    df.loc[mask, key_col[1]] = df.loc[mask, key_col[0]].map(totals).fillna(0)
+
+
+def legacy_rollup_chained(summary_df):
+    """ipca: ABM ← MR, RBM ← ABM, SM ← RBM by abm/rbm/sm_name; expected from ABM = 2."""
+    df = summary_df.copy()
+    for child, role, col in [("mr", "abm", "abm_name"), ("abm", "rbm", "rbm_name"), ("rbm", "sm", "sm_name")]:
+        totals = df[df["designation"] == child].groupby(col, dropna=False)["total_camps"].sum().to_dict()
+        _map_level(df, role, (col, "total_camps"), totals)
+
+    df.loc[df["designation"] == "abm", "expected_camps"] = 2.0
+    for child, role, col in [("abm", "rbm", "rbm_name"), ("rbm", "sm", "sm_name")]:
+        totals = df[df["designation"] == child].groupby(col, dropna=False)["expected_camps"].sum().to_dict()
+        _map_level(df, role, (col, "expected_camps"), totals)
+    return df
+
+
+def fast_rollup_chained(summary_df):
+    df = summary_df.copy()
+    tree = OrgTree(df)
+    df["total_camps"] = tree.rollup(df["total_camps"])
+    df.loc[df["designation"] == "abm", "expected_camps"] = 2.0
+    df["expected_camps"] = tree.rollup(df["expected_camps"], start="abm")
+    return df
+
+
+def legacy_rollup_per_mr(summary_df, per_mr=2):
+    """lupin / TEST/code.py: manager rows (by name) = sum / count × per_mr over their MRs."""
+    df = summary_df.copy()
+    df.loc[df["designation"] == "mr", "expected_camps"] = float(per_mr)
+    mrs = df[df["designation"] == "mr"]
+    for role, col in [("abm", "abm_name"), ("rbm", "rbm_name"), ("sm", "sm_name")]:
+        g = mrs.groupby(col)["total_camps"].agg(["sum", "count"]).reset_index()
+        mask = df["designation"] == role
+        df.loc[mask, "total_camps"] = df.loc[mask, "name"].map(dict(zip(g[col], g["sum"]))).fillna(0)
+        df.loc[mask, "expected_camps"] = df.loc[mask, "name"].map(dict(zip(g[col], g["count"] * per_mr))).fillna(0)
+    return df
+
+
+def fast_rollup_per_mr(summary_df, per_mr=2):
+    df = summary_df.copy()
+    df.loc[df["designation"] == "mr", "expected_camps"] = float(per_mr)
+    tree = OrgTree(df, key="name", dropna=True)
+    for col in ["total_camps", "expected_camps"]:
+        df[col] = tree.rollup(df[col], chained=False)
+    return df
+
+
+def legacy_apply_totals(wf):
+    """lupin waterfall: row-wise apply, rows without MRs keep their values."""
+    mr_only = wf[wf["designation"] == "mr"]
+    totals = {
+        role: mr_only.groupby(col)[["total_camps", "expected_camps"]].sum()
+        for role, col in [("abm", "abm_name"), ("rbm", "rbm_name"), ("sm", "sm_name")]
+    }
+
+    def apply_totals(row):
+        t = totals.get(row["designation"])
+        if t is not None and row["name"] in t.index:
+            row["total_camps"] = t.loc[row["name"], "total_camps"]
+            row["expected_camps"] = t.loc[row["name"], "expected_camps"]
+        return row
+
+    return wf.apply(apply_totals, axis=1)
+
+
+def fast_apply_totals(wf):
+    wf = wf.copy()
+    tree = OrgTree(wf, key="name", dropna=True)
+    for col in ["total_camps", "expected_camps"]:
+        wf[col] = tree.rollup(wf[col], chained=False, fill=None)
+    return wf
+
+
+def legacy_rollup_per_abm(summary_df):
+    """benitowa: RBM / SM rows = sum over ABM rows by rbm_name / sm_name."""
+    df = summary_df.copy()
+    worker = df[df["designation"] == "abm"]
+    for role, col in [("rbm", "rbm_name"), ("sm", "sm_name")]:
+        g = worker.groupby(col, dropna=False)[["total_camps", "expected_camps"]].sum().reset_index()
+        for metric in ["total_camps", "expected_camps"]:
+            _map_level(df, role, (col, metric), dict(zip(g[col], g[metric])))
+    return df
+
+
+def fast_rollup_per_abm(summary_df):
+    df = summary_df.copy()
+    tree = OrgTree(df, levels=["abm", "rbm", "sm"])
+    for col in ["total_camps", "expected_camps"]:
+        df[col] = tree.rollup(df[col], chained=False)
+    return df
+
+
+ROLLUPS = {
+    "chained (ipca)": (legacy_rollup_chained, fast_rollup_chained),
+    "per MR (lupin)": (legacy_rollup_per_mr, fast_rollup_per_mr),
+    "apply_totals (lupin)": (legacy_apply_totals, fast_apply_totals),
+    "per ABM (benitowa)": (legacy_rollup_per_abm, fast_rollup_per_abm),
+}
+
+
+# ------------------------------------------------------------
+# MISSING MANAGER PLACEHOLDERS (lupin.py)
+# ------------------------------------------------------------
+def synthetic_master(mrs, seed=7, drop=0.1):
+    """(emp_df, summary_df) with `drop` of the manager rows missing from the summary."""
+    master, _ = generate_master(random.Random(seed), mrs, cross_rbm_rate=0.1)
+    emp_df = employee_master_frame(master)
+    summary_df = summary_frame(emp_df, seed).reset_index(drop=True)
+    managers = np.flatnonzero(summary_df["designation"].isin(["abm", "rbm", "sm"]).to_numpy())
+    rng = np.random.default_rng(seed)
+    return emp_df, summary_df.drop(index=rng.choice(managers, int(len(managers) * drop), replace=False))
+
+
+def legacy_missing_rows(emp_df, summary_df):
+    new_rows = []
+    for level in ["sm", "rbm", "abm"]:
+        for name in emp_df[f"{level}_name"].dropna().unique().tolist():
+            exists = ((summary_df["designation"] == level) & (summary_df["name"] == name)).any()
+            if not exists:
+                new_rows.append({
+                    "empId": "", "name": name, "designation": level, "mr_name": name,
+                    "abm_name": name, "rbm_name": name, "sm_name": name,
+                    "state": "", "city": "", "hq": "", "total_camps": 0.0, "expected_camps": 0.0,
+                })
+    return pd.DataFrame(new_rows)
+
+
+def same_values(a, b):
+    """Same rows / values; the row-wise apply re-infers dtypes, so those may differ."""
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False)
+        return True
+    except AssertionError as exc:
+        print(exc)
+        return False
+
+
+def same_frame(a, b):
+    try:
+        pd.testing.assert_frame_equal(a, b)
+        return True
+    except AssertionError as exc:
+        print(exc)
+        return False
+
+
+def best_of(fn, df, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn(df)
+        times.append(time.perf_counter() - started)
+    return min(times), out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mrs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    ok = True
+    for seed in range(5):
+        small = synthetic_summary(60, seed=seed)
+        if not same_frame(legacy_relabel(small), fast_relabel(small)):
+            print(f"❌ Small field force (seed {seed}) differs")
+            ok = False
+        for name, (legacy, fast) in ROLLUPS.items():
+            for df in [small, fast_relabel(small)]:
+                if not same_values(legacy(df), fast(df)):
+                    print(f"❌ Rollup '{name}' differs (seed {seed})")
+                    ok = False
+        emp_df, summary_df = synthetic_master(60, seed=seed)
+        if not same_frame(legacy_missing_rows(emp_df, summary_df), missing_manager_rows(emp_df, summary_df)):
+            print(f"❌ Missing manager rows (seed {seed}) differ")
+            ok = False
+
+    df = synthetic_summary(args.mrs, seed=args.seed)
+    print(f"Summary rows: {len(df)} ({args.mrs} MRs, "
+          f"{df['abm_name'].nunique()} ABMs, {df['rbm_name'].nunique()} RBMs)")
+
+    legacy_s, legacy_df = best_of(legacy_relabel, df, args.repeat)
+    fast_s, fast_df = best_of(fast_relabel, df, args.repeat)
+
+    print(f"relabel                legacy {legacy_s:8.3f}s  fast {fast_s:8.3f}s  ({legacy_s / fast_s:.1f}x)")
+    ok = same_frame(legacy_df, fast_df) and ok
+
+    for name, (legacy, fast) in ROLLUPS.items():
+        legacy_s, legacy_out = best_of(legacy, fast_df, args.repeat)
+        fast_s, fast_out = best_of(fast, fast_df, args.repeat)
+        print(f"{name:<22} legacy {legacy_s:8.3f}s  fast {fast_s:8.3f}s  ({legacy_s / fast_s:.1f}x)")
+        ok = same_values(legacy_out, fast_out) and ok
+
+    emp_df, summary_df = synthetic_master(args.mrs, seed=args.seed)
+    legacy_s, legacy_out = best_of(lambda df: legacy_missing_rows(emp_df, df), summary_df, args.repeat)
+    fast_s, fast_out = best_of(lambda df: missing_manager_rows(emp_df, df), summary_df, args.repeat)
+    print(f"{'missing managers':<22} legacy {legacy_s:8.3f}s  fast {fast_s:8.3f}s  "
+          f"({legacy_s / fast_s:.1f}x, {len(fast_out)} rows)")
+    ok = same_frame(legacy_out, fast_out) and ok
+
+    if not ok:
+        print("❌ Outputs differ")
+        return 1
+    print("✅ Outputs match")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,249 @@
+"""
+End-to-end benchmark of the report flow (TEST/code.py) on synthetic
+tenants of increasing size, run against the offline backend.
+
+    size   employees   tests
+    1k        ~1k       ~10k
+    10k      ~10k      ~500k
+    100k    ~100k        ~5M
+
+For every size it records wall time, CPU time and peak RSS per stage
+(master_load, sql_fetch, doctor_pivot, hierarchy, waterfall,
+excel_write, styling — see stages.py), writes them as JSON and compares
+against a stored baseline:
+
+    python bench_reports.py --sizes 1k,10k --save-baseline
+    python bench_reports.py --sizes 1k,10k --baseline bench_baseline.json
+
+A stage is a regression when it is more than --threshold slower than the
+baseline (and more than --min-delta seconds, to ignore noise); the exit
+code is then 1. Generated data is kept under --work-dir and reused.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from backends import LocalBucket, local_paths, local_sql_manager
+from stages import record_stages, stage_totals
+from synth_org import generate
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPORT_SCRIPT = os.path.join(ROOT, "TEST", "code.py")
+
+# synth_org options per size (1 tenant, doctors_per_mr=8)
+SIZES = {
+    "1k": {"mrs": 830, "tests_per_doctor": 1.5},
+    "10k": {"mrs": 8_300, "tests_per_doctor": 7.5},
+    "100k": {"mrs": 83_000, "tests_per_doctor": 7.5},
+}
+DEFAULT_SIZES = "1k,10k"
+
+# Fixed month so results do not move with the calendar
+BENCH_START = date(2025, 1, 1)
+BENCH_END = date(2025, 1, 28)
+
+DEFAULT_WORK_DIR = ".bench"
+DEFAULT_BASELINE = "bench_baseline.json"
+DEFAULT_THRESHOLD = 0.20        # 20% slower than baseline
+DEFAULT_MIN_DELTA = 0.05        # seconds
+
+
+def _load_report_module():
+    """TEST/code.py as a module (its name clashes with the stdlib 'code')."""
+    spec = importlib.util.spec_from_file_location("report_code", REPORT_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_size(work_dir, size, seed):
+    """
+    Generates (once) the local backend for one size.
+    Returns (data_dir, pharma row, {"employees": n, "tests": n}).
+    """
+    data_dir = os.path.join(work_dir, f"{size}-seed{seed}")
+    pharma_file = os.path.join(data_dir, "Pharma_list.xlsx")
+    counts_file = os.path.join(data_dir, "counts.json")
+
+    if not os.path.exists(counts_file):
+        print(f"Generating {size} tenant into {data_dir} ...")
+        generate(data_dir, tenants=1, seed=seed, start=BENCH_START, end=BENCH_END, **SIZES[size])
+
+        paths = local_paths(data_dir)
+        row = pd.read_excel(pharma_file).iloc[0]
+        with open(os.path.join(paths["bucket"], *row["json_file"].split("/"))) as f:
+            employees = len(json.load(f))
+        with sqlite3.connect(paths["sqlite"]) as db:
+            tests = db.execute("SELECT COUNT(*) FROM user_tests").fetchone()[0]
+
+        # Written last: marks the generated data as complete
+        with open(counts_file, "w") as f:
+            json.dump({"employees": employees, "tests": tests}, f)
+
+    with open(counts_file) as f:
+        counts = json.load(f)
+
+    return data_dir, pd.read_excel(pharma_file).iloc[0], counts
+
+
+def run_size(report, work_dir, size, seed, repeat=1):
+    """Runs one tenant through generate_pharma_report → result dict."""
+    data_dir, row, counts = prepare_size(work_dir, size, seed)
+    paths = local_paths(data_dir)
+
+    bucket = LocalBucket(paths["bucket"])
+    conn = local_sql_manager(paths["sqlite"])
+    runs = []
+
+    cwd = os.getcwd()
+    os.chdir(data_dir)   # report writes <pharma>_employee_doctor_report.xlsx into cwd
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with record_stages() as records:
+                report.generate_pharma_report(
+                    aid=row["aid"],
+                    pharma_name=row["pharma_name"],
+                    json_file=row["json_file"],
+                    prescription_key=row["prescription_key"],
+                    conn=conn,
+                    bucket=bucket,
+                    start_date=BENCH_START.strftime("%Y-%m-%d"),
+                    # BETWEEN start AND <midnight after the last day>
+                    end_date=(BENCH_END + timedelta(days=1)).strftime("%Y-%m-%d"),
+                )
+            runs.append((time.perf_counter() - started, stage_totals(records)))
+    finally:
+        os.chdir(cwd)
+        conn.close()
+
+    # Best of `repeat` per stage
+    stages = {}
+    for _, totals in runs:
+        for name, t in totals.items():
+            best = stages.get(name)
+            if best is None or t["wall_s"] < best["wall_s"]:
+                stages[name] = {k: round(v, 4) if isinstance(v, float) else v for k, v in t.items()}
+
+    return {
+        **counts,
+        "total_wall_s": round(min(total for total, _ in runs), 4),
+        "peak_rss_mb": round(max(t["peak_rss_mb"] for t in stages.values()), 1),
+        "stages": stages,
+    }
+
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD, min_delta=DEFAULT_MIN_DELTA):
+    """List of regressions: (size, stage, baseline_s, now_s, ratio)."""
+    regressions = []
+    for size, result in results["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if base is None:
+            continue
+
+        pairs = [("total", base["total_wall_s"], result["total_wall_s"])]
+        for stage, t in result["stages"].items():
+            if stage in base["stages"]:
+                pairs.append((stage, base["stages"][stage]["wall_s"], t["wall_s"]))
+
+        for stage, before, now in pairs:
+            if now - before > min_delta and now > before * (1 + threshold):
+                regressions.append((size, stage, before, now, now / before if before else float("inf")))
+
+    return regressions
+
+
+def print_results(results):
+    rows = []
+    for size, result in results["sizes"].items():
+        for stage, t in result["stages"].items():
+            rows.append({"size": size, "stage": stage, **t})
+        rows.append({"size": size, "stage": "TOTAL", "wall_s": result["total_wall_s"],
+                     "peak_rss_mb": result["peak_rss_mb"]})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end report benchmark with per-stage budgets")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma list of {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size (best per stage is kept)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR)
+    parser.add_argument("--output", default=None, help="Results JSON (default: <work-dir>/results-<timestamp>.json)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA)
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    report = _load_report_module()
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git": _git_revision(),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "sizes": {},
+    }
+    for size in sizes:
+        results["sizes"][size] = run_size(report, work_dir, size, args.seed, args.repeat)
+
+    print_results(results)
+
+    output = args.output or os.path.join(work_dir, f"results-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} (run with --save-baseline)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare_to_baseline(results, baseline, args.threshold, args.min_delta)
+    if not regressions:
+        print(f"✅ No stage more than {args.threshold:.0%} slower than {args.baseline}")
+        return 0
+
+    print(f"❌ {len(regressions)} regressions vs {args.baseline}:")
+    for size, stage, before, now, ratio in regressions:
+        print(f"   {size:>5} {stage:<14} {before:8.3f}s → {now:8.3f}s  ({ratio:.2f}x)")
+    return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,225 @@
+"""
+Benchmark: Waterfall Summary sheet (waterfall.py).
+
+    build   legacy = nested sm / rbm / abm groupbys appending rows with
+                     iterrows() and pd.Series, then pd.DataFrame(final_rows)
+            fast   = build_waterfall / build_abm_waterfall
+    insert  legacy = INSERT MISSING MANAGER ROWS loops, rescanning the rows
+                     placed so far (ipca) or the whole sheet (benitowa)
+                     for every RBM / SM (kept in tests/test_waterfall.py)
+            fast   = insert_missing_managers / insert_missing_abm_managers
+
+Runs on the synthetic summary sheet of bench_hierarchy.py (relabelled,
+totals rolled up, some manager rows dropped so rows get inserted), checks
+both give the same sheet and prints best-of-N timings.
+
+    python bench_waterfall.py --mrs 20000 --repeat 3
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from bench_hierarchy import fast_relabel, fast_rollup_chained, synthetic_summary
+from tests.test_waterfall import legacy_insert_missing, legacy_insert_missing_abm
+from waterfall import (
+    build_abm_waterfall, build_waterfall, insert_missing_abm_managers, insert_missing_managers,
+)
+
+
+def summary_sheet(mrs, seed=7, drop=0.05):
+    """summary_df as it reaches the waterfall stage, without `drop` of the manager rows."""
+    df = synthetic_summary(mrs, seed=seed)
+    managers = np.flatnonzero(df["designation"].isin(["abm", "rbm", "sm"]).to_numpy())
+    rng = np.random.default_rng(seed)
+    df = df.drop(index=df.index[rng.choice(managers, int(len(managers) * drop), replace=False)])
+    df = fast_rollup_chained(fast_relabel(df.reset_index(drop=True)))
+    df["execution_percent"] = np.where(
+        df["expected_camps"] > 0,
+        np.round(df["total_camps"] / df["expected_camps"].where(df["expected_camps"] > 0, 1) * 100),
+        0,
+    ).astype(int)
+    return df
+
+
+# ------------------------------------------------------------
+# LEGACY (as in ipca.py / lupin.py / TEST/code.py / benitowa.py)
+# ------------------------------------------------------------
+def legacy_waterfall(summary_df, vacant_abm_expected=None, dedupe_mrs=False):
+    final_rows = []
+    assigned_mr_indices = set()
+
+    for sm, sm_group in summary_df.groupby("sm_name", dropna=False):
+        for rbm, rbm_group in sm_group.groupby("rbm_name", dropna=False):
+            rbm_str = str(rbm) if not pd.isna(rbm) else ""
+            is_vacant_rbm = rbm_str.startswith("Vacant (")
+
+            real_abm_groups = {}
+            for abm, abm_group in rbm_group.groupby("abm_name", dropna=False):
+                if isinstance(abm, str) and abm.startswith("Vacant ("):
+                    continue
+                if abm_group[abm_group["designation"] == "abm"].shape[0] == 0:
+                    continue
+                real_abm_groups[abm] = abm_group
+
+            mrs_assigned = set()
+            for abm, abm_group in real_abm_groups.items():
+                mrs = abm_group[abm_group["designation"] == "mr"]
+                for _, row in mrs.iterrows():
+                    if not dedupe_mrs or row.name not in assigned_mr_indices:
+                        final_rows.append(row)
+                        assigned_mr_indices.add(row.name)
+                        mrs_assigned.add(row.name)
+                abm_row = abm_group[abm_group["designation"] == "abm"]
+                if not abm_row.empty:
+                    final_rows.append(abm_row.iloc[0])
+
+            all_mrs = rbm_group[rbm_group["designation"] == "mr"]
+            leftover_mrs = all_mrs[~all_mrs.index.isin(mrs_assigned)]
+            if dedupe_mrs:
+                leftover_mrs = leftover_mrs[~leftover_mrs.index.isin(assigned_mr_indices)]
+            for _, row in leftover_mrs.iterrows():
+                final_rows.append(row)
+                assigned_mr_indices.add(row.name)
+
+            if not leftover_mrs.empty:
+                total_camps = leftover_mrs["total_camps"].sum()
+                expected_camps = leftover_mrs["expected_camps"].sum()
+                exec_percent = round((total_camps / expected_camps) * 100) if expected_camps > 0 else 0
+                final_rows.append(pd.Series({
+                    "empId": "", "name": f"Vacant ({rbm})", "abm_name": f"Vacant ({rbm})",
+                    "rbm_name": rbm, "sm_name": sm, "state": "", "city": "",
+                    "designation": "abm", "hq": "", "total_camps": total_camps,
+                    "expected_camps": expected_camps if vacant_abm_expected is None else vacant_abm_expected,
+                    "execution_percent": exec_percent,
+                }))
+
+            rbm_row = rbm_group[rbm_group["designation"] == "rbm"]
+            if not is_vacant_rbm:
+                if not rbm_row.empty:
+                    final_rows.append(rbm_row.iloc[0])
+            else:
+                abm_rows = rbm_group[rbm_group["designation"] == "abm"]
+                total_camps = abm_rows["total_camps"].sum()
+                expected_camps = abm_rows["expected_camps"].sum()
+                exec_percent = round((total_camps / expected_camps) * 100) if expected_camps > 0 else 0
+                final_rows.append(pd.Series({
+                    "empId": "", "name": rbm, "abm_name": rbm, "rbm_name": rbm, "sm_name": sm,
+                    "state": "", "city": "", "designation": "rbm", "hq": "",
+                    "total_camps": total_camps, "expected_camps": expected_camps,
+                    "execution_percent": exec_percent,
+                }))
+
+        sm_row = sm_group[sm_group["designation"] == "sm"]
+        if not sm_row.empty:
+            final_rows.append(sm_row.iloc[0])
+
+    return pd.DataFrame(final_rows).reset_index(drop=True)
+
+
+def legacy_abm_waterfall(summary_df):
+    final_rows = []
+    for sm, sm_group in summary_df.groupby("sm_name", dropna=False):
+        rbm_list = sm_group["rbm_name"].fillna("").unique().tolist()
+        for rbm in rbm_list:
+            raw_rbm = rbm if isinstance(rbm, str) else ""
+            rbm_block = summary_df[
+                (summary_df["sm_name"] == sm) &
+                (summary_df["rbm_name"].fillna("") == raw_rbm)
+            ].copy()
+            if rbm_block.empty:
+                continue
+            abm_block = rbm_block[rbm_block["designation"] == "abm"].copy()
+            # Stable sort: quicksort left equal names in an arbitrary order
+            for _, row in abm_block.sort_values("name", kind="stable").iterrows():
+                final_rows.append(row)
+            rbm_row = rbm_block[rbm_block["designation"] == "rbm"]
+            if not rbm_row.empty:
+                final_rows.append(rbm_row.iloc[0])
+        sm_row = sm_group[sm_group["designation"] == "sm"]
+        if not sm_row.empty:
+            final_rows.append(sm_row.iloc[0])
+    return pd.DataFrame(final_rows).reset_index(drop=True)
+
+
+VARIANTS = {
+    "ipca": (lambda df: legacy_waterfall(df, vacant_abm_expected=2.0),
+             lambda df: build_waterfall(df, vacant_abm_expected=2.0)),
+    "lupin": (lambda df: legacy_waterfall(df, dedupe_mrs=True), build_waterfall),
+    "TEST/code.py": (legacy_waterfall, build_waterfall),
+    "benitowa": (legacy_abm_waterfall, build_abm_waterfall),
+}
+
+# Input: the sheet build_waterfall / build_abm_waterfall give
+INSERTS = {
+    "ipca insert": (lambda df: build_waterfall(df, vacant_abm_expected=2.0),
+                    legacy_insert_missing, insert_missing_managers),
+    "benitowa insert": (build_abm_waterfall, legacy_insert_missing_abm, insert_missing_abm_managers),
+}
+
+
+def same_frame(a, b):
+    try:
+        pd.testing.assert_frame_equal(a, b)
+        return True
+    except AssertionError as exc:
+        print(exc)
+        return False
+
+
+def best_of(fn, df, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn(df)
+        times.append(time.perf_counter() - started)
+    return min(times), out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mrs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    ok = True
+    for seed in range(5):
+        small = summary_sheet(60, seed=seed)
+        for name, (legacy, fast) in VARIANTS.items():
+            if not same_frame(legacy(small), fast(small)):
+                print(f"❌ {name} (seed {seed}) differs")
+                ok = False
+        for name, (build, legacy, fast) in INSERTS.items():
+            sheet = build(small)
+            if not same_frame(legacy(sheet), fast(sheet)):
+                print(f"❌ {name} (seed {seed}) differs")
+                ok = False
+
+    df = summary_sheet(args.mrs, seed=args.seed)
+    print(f"Summary rows: {len(df)} ({args.mrs} MRs)")
+    for name, (legacy, fast) in VARIANTS.items():
+        legacy_s, legacy_out = best_of(legacy, df, args.repeat)
+        fast_s, fast_out = best_of(fast, df, args.repeat)
+        print(f"{name:<16} legacy {legacy_s:8.3f}s  fast {fast_s:8.3f}s  ({legacy_s / fast_s:.1f}x)")
+        ok = same_frame(legacy_out, fast_out) and ok
+
+    for name, (build, legacy, fast) in INSERTS.items():
+        sheet = build(df)
+        legacy_s, legacy_out = best_of(legacy, sheet, args.repeat)
+        fast_s, fast_out = best_of(fast, sheet, args.repeat)
+        inserted = (fast_out["empId"] == "").sum() - (sheet["empId"] == "").sum()
+        print(f"{name:<16} legacy {legacy_s:8.3f}s  fast {fast_s:8.3f}s  "
+              f"({legacy_s / fast_s:.1f}x, {inserted} rows inserted)")
+        ok = same_frame(legacy_out, fast_out) and ok
+
+    if not ok:
+        print("❌ Outputs differ")
+        return 1
+    print("✅ Outputs match")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
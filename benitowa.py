@@ -1,44 +1,40 @@
-import pyodbc
 import pandas as pd
-from google.cloud import firestore, storage
 from datetime import datetime, date, timedelta
-import json
 import re
 import warnings
 warnings.filterwarnings('ignore')
 
+from metrics_cache import fetch_month_to_date
+from backends import get_bucket, get_sql_manager
+from employee_master import load_employee_master
+from doctor_pivot import doctor_index, doctor_sheet
+from hierarchy import OrgTree
+from waterfall import build_abm_waterfall, insert_missing_abm_managers
+from stages import begin_run, finish_run, mark, rows_out, telemetry_dir_from_env
+
+# One JSON line per stage + a run summary when REPORT_TELEMETRY_DIR is set (see stages.py)
+TELEMETRY_DIR = telemetry_dir_from_env()
+telemetry = begin_run("benitowa", TELEMETRY_DIR, enabled=bool(TELEMETRY_DIR), tenant="benitowa")
+
 # ------------------------------------------------------------
 # 1️⃣ LOAD EMPLOYEE MASTER FROM FIREBASE
 # ------------------------------------------------------------
-st = storage.Client("neodocs-8d6cd")
-bucket = st.bucket("neodocs-8d6cd-utils")
-
-# ⚠️ Update this blob path if Benitowa uses a different file
-blob = bucket.blob("org_access_codes/benitowa-uacr.json")
-json_data = blob.download_as_text()
-employee_dict = json.loads(json_data)
+mark("master_load")
+# GCS bucket (or a local directory with REPORT_BACKEND=local, see backends.py)
+bucket = get_bucket()
 
-# Convert to DataFrame
-emp_df = pd.DataFrame(employee_dict).transpose().reset_index()
-emp_df.rename(columns={"index": "empId", "mr_region": "hq"}, inplace=True)
+# None = download every run; a folder keeps the parsed master until the blob changes
+MASTER_CACHE_DIR = None
 
-# Remove Training rows
-emp_df = emp_df[emp_df['mr_name'] != "Training"]
-
-# Convert region_list to comma-separated text
-if "region_list" in emp_df.columns:
-    emp_df["region_list"] = emp_df["region_list"].apply(
-        lambda x: ", ".join(x) if isinstance(x, list) else x
-    )
-
-# Ensure empId is string
-emp_df["empId"] = emp_df["empId"].astype(str)
+# ⚠️ Update this blob path if Benitowa uses a different file
+emp_df = load_employee_master(bucket, "org_access_codes/benitowa-uacr.json", cache_dir=MASTER_CACHE_DIR)
 
-print("Employee Master Loaded:", emp_df.shape)
+rows_out(len(emp_df))
 
 # ------------------------------------------------------------
 # 2️⃣ SQL SERVER — LOAD DOCTOR METRICS
 # ------------------------------------------------------------
+mark("sql_fetch")
 server = 'neodocs-sql-server.database.windows.net'
 database = 'neodocs-sql-db'
 username = 'ndDashboard'
@@ -56,7 +52,9 @@ TrustServerCertificate=no;
 Connection Timeout=30;
 """
 
-conn = pyodbc.connect(conn_str)
+# Pooled + retrying connection (transient Azure SQL errors are retried;
+# the local SQLite store with REPORT_BACKEND=local)
+conn = get_sql_manager(conn_str)
 print("Connected to SQL Server")
 
 # ------------------------------------------------------------
@@ -77,138 +75,54 @@ print("SQL Range (Current Month):", START_DATE, "to", END_DATE)
 
 # ------------------------------------------------------------
 # 3️⃣ CLEAN SQL QUERY (Same structure, different brand if needed)
-#    ⚠️ Update a.aId for Benitowa if required
-# ------------------------------------------------------------
-query = """
-WITH test_summary AS (
-    SELECT 
-        u.empId,
-        u.docId AS [Doctor ID],
-        u.drName AS Doctor,
-        u.oId,
-        COUNT(DISTINCT u.testId) AS [Total Tests],
-        COUNT(DISTINCT CONVERT(date, u.campDate)) AS [Total Camps]
-    FROM dbo.user_tests u
-    LEFT JOIN dbo.aId a ON u.aId = a.aId
-    WHERE 
-        a.aId = '4d2cce3a-58be-4143-9674-f78f3f1c32e2'
-        AND u.statusCode = 200
-        AND u.isDeleted = 0
-        AND u.campDate BETWEEN ? AND ?
-    GROUP BY u.empId, u.docId, u.drName, u.oId
-),
-
-rx_summary AS (
-    SELECT 
-        r.aId,
-        r.oId,
-        r.campDate,
-        SUM(TRY_CAST(LEFT(JSON_VALUE(r.prescriptions, '$.benitowa'), 
-            CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.benitowa')) - 1) AS INT)) AS [Total Rx],
-        SUM(TRY_CAST(LTRIM(RIGHT(JSON_VALUE(r.prescriptions, '$.benitowa'), 
-            LEN(JSON_VALUE(r.prescriptions, '$.benitowa')) - 
-            CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.benitowa')))) AS INT)) AS [Total Strips]
-    FROM dbo.rx r
-    LEFT JOIN dbo.aId a ON r.aId = a.aId
-    WHERE 
-        a.aId = '4d2cce3a-58be-4143-9674-f78f3f1c32e2'
-        AND r.isDeleted = 0
-        AND r.campDate BETWEEN ? AND ?
-    GROUP BY r.aId, r.oId, r.campDate
-)
+#    ⚠️ Update AID for Benitowa if required
+# ------------------------------------------------------------
+AID = "4d2cce3a-58be-4143-9674-f78f3f1c32e2"
+PRESCRIPTION_KEY = "benitowa"
 
-SELECT 
-    t.empId AS [empId],
-    t.Doctor,
-    t.[Doctor ID],
-    t.[Total Camps] AS [Doc Total Camps],
-    ISNULL(SUM(rx.[Total Rx]), 0) AS [Total Rx],
-    ISNULL(SUM(rx.[Total Strips]), 0) AS [Total Strips],
-    t.[Total Tests]
-FROM test_summary t
-LEFT JOIN rx_summary rx
-    ON t.oId = rx.oId
-GROUP BY 
-    t.empId, t.Doctor, t.[Doctor ID], t.[Total Camps], t.[Total Tests]
-ORDER BY t.empId;
-"""
+# Month-to-date cache of per-day aggregates (None = query the full month)
+METRICS_CACHE_DIR = None          # e.g. ".metrics_cache"
+RECHECK_DAYS = 2                  # re-query this many days before the watermark
 
-params = [START_DATE, END_DATE, START_DATE, END_DATE]
-sql_df = pd.read_sql(query, conn, params=params)
+# aId + prescription key are bound as parameters (shared query builder)
+sql_df = fetch_month_to_date(
+    conn, AID, PRESCRIPTION_KEY, START_DATE, END_DATE,
+    cache_dir=METRICS_CACHE_DIR, recheck_days=RECHECK_DAYS
+)
+conn.close()
 
 print("Doctor Metrics Loaded:", sql_df.shape)
 
-# ------------------------------------------------------------
-# 4️⃣ ASSIGN DOCTOR INDEX PER empId
-# ------------------------------------------------------------
-sql_df['Doctor Index'] = sql_df.groupby(['empId']).cumcount() + 1
-
-# ------------------------------------------------------------
-# 5️⃣ PIVOT DOCTOR METRICS — Wide format
-# ------------------------------------------------------------
-pivoted = sql_df.pivot_table(
-    index=['empId'],
-    columns='Doctor Index',
-    values=['Doctor', 'Doctor ID', 'Doc Total Camps', 'Total Rx', 'Total Strips', 'Total Tests'],
-    aggfunc='first'
-)
-
-# Flatten columns
-pivoted.columns = [f"{col[0]} {int(col[1])}" for col in pivoted.columns]
-pivoted = pivoted.reset_index()
+rows_out(len(sql_df))
 
 # ------------------------------------------------------------
-# ADD TOTAL CAMPS COLUMN (SUM OF ALL DOC TOTAL CAMPS)
+# 4️⃣ ASSIGN DOCTOR INDEX PER empId
 # ------------------------------------------------------------
-doc_camp_cols = [col for col in pivoted.columns if col.startswith("Doc Total Camps")]
-pivoted["Total Camps"] = pivoted[doc_camp_cols].sum(axis=1)
+mark("doctor_pivot", rows_in=len(sql_df))
+sql_df['Doctor Index'] = doctor_index(sql_df)
 
 # ------------------------------------------------------------
-# REORDER COLUMNS WITH TOTAL CAMPS FIRST, THEN DOCTORS
+# 5️⃣ DOCTOR SHEET LAYOUT
 # ------------------------------------------------------------
-doctor_indices = sorted(
-    list({
-        int(col.split()[-1]) 
-        for col in pivoted.columns 
-        if col not in ["empId", "Total Camps"]
-    })
-)
-
-order_template = [
-    "Doctor",
-    "Doctor ID",
-    "Doc Total Camps",
-    "Total Tests",
-    "Total Rx",
-    "Total Strips"
-]
-
-ordered_columns = ["empId", "Total Camps"]
-for idx in doctor_indices:
-    for field in order_template:
-        col_name = f"{field} {idx}"
-        if col_name in pivoted.columns:
-            ordered_columns.append(col_name)
-
-pivoted = pivoted.reindex(columns=ordered_columns)
+# long = one row per employee × doctor (default)
+# wide = one row per employee, six columns per doctor (doctor_pivot.py)
+DOCTOR_SHEET_LAYOUT = "long"
 
 # ------------------------------------------------------------
 # 6️⃣ JOIN WITH EMPLOYEE MASTER → FINAL EMPLOYEE-DOCTOR TABLE
 # ------------------------------------------------------------
-final_df = emp_df.merge(pivoted, on="empId", how="left")
+# sheet_df → first sheet; final_df → one row per employee
+# (Total Camps / Total Tests) for the summary sheets
+sheet_df, final_df = doctor_sheet(emp_df, sql_df, DOCTOR_SHEET_LAYOUT)
 
-# Move empId first
-cols = final_df.columns.tolist()
-cols = ['empId'] + [c for c in cols if c != "empId"]
-final_df = final_df[cols]
-
-final_df = final_df.drop(columns=["region_list"], errors="ignore")
+rows_out(len(sheet_df))
 
 # ------------------------------------------------------------
 # 7️⃣ EXPORT BASE REPORT (EMPLOYEE + DOCTORS)
 # ------------------------------------------------------------
+mark("excel_write", rows_in=len(sheet_df))
 output_file = "benitowa_employee_doctor_report.xlsx"
-final_df.to_excel(output_file, index=False)
+sheet_df.to_excel(output_file, index=False)
 print("✅ Base Report Generated:", output_file)
 
 # ============================================================
@@ -221,6 +135,7 @@ print("✅ Base Report Generated:", output_file)
 # ------------------------------------------------------------
 # 8️⃣ Build ABM-level activity (worker layer)
 # ------------------------------------------------------------
+mark("hierarchy", rows_in=len(final_df))
 # Extract Total Camps from final_df and attach hierarchy info
 abm_camps = final_df[["empId", "Total Camps"]].copy()
 abm_camps = abm_camps.merge(
@@ -290,43 +205,12 @@ summary_df = summary_df.sort_values("rank", ascending=False).drop_duplicates(
 # ------------------------------------------------------------
 # 1️⃣1️⃣ Compute roll-ups for RBM & SM from ABMs
 # ------------------------------------------------------------
-worker = abm_rows.copy()
-worker["total_camps"] = worker["total_camps"].fillna(0)
-worker["expected_camps"] = worker["expected_camps"].fillna(0)
-
-group_maps = {}
-
-# RBM aggregation
-g_rbm = worker.groupby("rbm_name", dropna=False)[["total_camps", "expected_camps"]].sum().reset_index()
-group_maps["rbm"] = {
-    "total": dict(zip(g_rbm["rbm_name"], g_rbm["total_camps"])),
-    "expected": dict(zip(g_rbm["rbm_name"], g_rbm["expected_camps"]))
-}
+# RBM / SM rows = sum over the ABM workers with that rbm_name / sm_name
+# (hierarchy.py; ABM → RBM and ABM → SM, not chained through the RBMs)
+org_tree = OrgTree(summary_df, levels=["abm", "rbm", "sm"])
 
-# SM aggregation
-g_sm = worker.groupby("sm_name", dropna=False)[["total_camps", "expected_camps"]].sum().reset_index()
-group_maps["sm"] = {
-    "total": dict(zip(g_sm["sm_name"], g_sm["total_camps"])),
-    "expected": dict(zip(g_sm["sm_name"], g_sm["expected_camps"]))
-}
-
-# Apply to summary_df manager rows
-for role in manager_roles:
-    if role == "rbm":
-        key_col = "rbm_name"
-    elif role == "sm":
-        key_col = "sm_name"
-    else:
-        continue
-
-    mask = summary_df["designation"] == role
-    summary_df.loc[mask, "total_camps"] = summary_df.loc[mask, key_col].map(
-        group_maps[role]["total"]
-    ).fillna(0)
-
-    summary_df.loc[mask, "expected_camps"] = summary_df.loc[mask, key_col].map(
-        group_maps[role]["expected"]
-    ).fillna(0)
+for col in ["total_camps", "expected_camps"]:
+    summary_df[col] = org_tree.rollup(summary_df[col], chained=False)
 
 # ------------------------------------------------------------
 # 1️⃣2️⃣ Execution % (safe division)
@@ -337,170 +221,32 @@ summary_df["execution_percent"] = summary_df.apply(
     axis=1
 ).round(0).astype(int)
 
+rows_out(len(summary_df))
+
 # ------------------------------------------------------------
 # 1️⃣3️⃣ BUILD WATERFALL SUMMARY (ABM → RBM → SM)
 # ------------------------------------------------------------
-final_rows = []
-
-# Group by SM
-for sm, sm_group in summary_df.groupby("sm_name", dropna=False):
-
-    # All RBMs under this SM
-    rbm_list = sm_group["rbm_name"].fillna("").unique().tolist()
-
-    for rbm in rbm_list:
-        raw_rbm = rbm if isinstance(rbm, str) else ""
-
-        rbm_block = summary_df[
-            (summary_df["sm_name"] == sm) &
-            (summary_df["rbm_name"].fillna("") == raw_rbm)
-        ].copy()
-
-        if rbm_block.empty:
-            continue
-
-        # 1) ABMs under this RBM
-        abm_block = rbm_block[rbm_block["designation"] == "abm"].copy()
-
-        for _, row in abm_block.sort_values("name").iterrows():
-            final_rows.append(row)
-
-        # 2) RBM row
-        rbm_row = rbm_block[rbm_block["designation"] == "rbm"]
-        if not rbm_row.empty:
-            final_rows.append(rbm_row.iloc[0])
-
-    # 3) SM row (one per SM)
-    sm_row = sm_group[sm_group["designation"] == "sm"]
-    if not sm_row.empty:
-        final_rows.append(sm_row.iloc[0])
-
-waterfall_df = pd.DataFrame(final_rows).reset_index(drop=True)
+mark("waterfall", rows_in=len(summary_df))
+# Per SM: ABMs by name under each RBM, then the RBM row; SM row last (waterfall.py)
+waterfall_df = build_abm_waterfall(summary_df)
 
 # =====================================================================
 #   BENITOWA: INSERT MISSING RBM/SM ROWS WITH HIERARCHY RULES
 #   Worker Level = ABM (expected = 4)
 # =====================================================================
 
-df = waterfall_df.copy()
-out_rows = []
-
-def make_row(desig, name, sm, rbm, abm, total=0.0, expected=0.0):
-    """Creates a synthetic ABM/RBM/SM row"""
-    return pd.Series({
-        "empId": "",
-        "name": name,
-        "designation": desig,
-        "sm_name": sm,
-        "rbm_name": rbm,
-        "abm_name": abm,
-        "state": "",
-        "city": "",
-        "hq": "",
-        "total_camps": float(total),
-        "expected_camps": float(expected),
-        "execution_percent": 0
-    })
-
-
-# --------------------------------------------------------------
-# GROUP BY SM
-# --------------------------------------------------------------
-for sm, sm_group in df.groupby("sm_name", dropna=False):
-
-    sm_present = (sm_group["designation"].str.lower() == "sm").any()
-
-    # ----------------------------------------------------------
-    # GROUP BY RBM inside this SM
-    # ----------------------------------------------------------
-    for rbm, rbm_group in sm_group.groupby("rbm_name", dropna=False):
-
-        rbm_present = (rbm_group["designation"].str.lower() == "rbm").any()
-
-        # ------------------------------------------------------
-        # GROUP BY ABM inside this RBM (worker layer)
-        # ------------------------------------------------------
-        for abm, abm_group in rbm_group.groupby("abm_name", dropna=False):
-
-            abm_present = (abm_group["designation"].str.lower() == "abm").any()
-
-            # 1️⃣ Add ABM worker rows first
-            abm_workers = abm_group[abm_group["designation"].str.lower() == "abm"]
-            for _, r in abm_workers.iterrows():
-                out_rows.append(r)
-
-            # 2️⃣ Insert missing ABM only if:
-            #     • ABM exists as name (not blank)
-            #     • ABM row NOT present
-            #     • RBM row for that person does NOT exist
-            #     • SM row for that person does NOT exist
-            if abm and (not abm_present) and (not rbm_present) and (not sm_present):
-                total = abm_workers["total_camps"].sum()
-                out_rows.append(
-                    make_row("abm", abm, sm, rbm, abm, total=total, expected=4.0)
-                )
-
-        # ------------------------------------------------------
-        # RBM INSERTION
-        # ------------------------------------------------------
-        if rbm and (not rbm_present) and (not sm_present):
-
-            worker_under_rbm = df[
-                (df["rbm_name"] == rbm) &
-                (df["designation"].str.lower() == "abm")
-            ]
-
-            total = worker_under_rbm["total_camps"].sum()
-
-            expected = 4.0 * len(worker_under_rbm)
-
-            out_rows.append(
-                make_row("rbm", rbm, sm, rbm, "", total=total, expected=expected)
-            )
-
-        elif rbm_present:
-            rbm_row = rbm_group[rbm_group["designation"].str.lower() == "rbm"]
-            out_rows.append(rbm_row.iloc[0])
-
-    # ------------------------------------------------------
-    # SM INSERTION
-    # ------------------------------------------------------
-    if sm and (not sm_present):
-
-        rbm_under_sm = df[
-            (df["sm_name"] == sm) &
-            (df["designation"].str.lower() == "rbm")
-        ]
-
-        abm_under_sm = df[
-            (df["sm_name"] == sm) &
-            (df["designation"].str.lower() == "abm")
-        ]
-
-        if not rbm_under_sm.empty:
-            total = rbm_under_sm["total_camps"].sum()
-            expected = rbm_under_sm["expected_camps"].sum()
-        else:
-            total = abm_under_sm["total_camps"].sum()
-            expected = abm_under_sm["expected_camps"].sum()
-
-        out_rows.append(
-            make_row("sm", sm, sm, "", "", total=total, expected=expected)
-        )
-
-    else:
-        sm_row = sm_group[sm_group["designation"].str.lower() == "sm"]
-        if not sm_row.empty:
-            out_rows.append(sm_row.iloc[0])
-
-# Build updated waterfall
-waterfall_df = pd.DataFrame(out_rows).reset_index(drop=True)
+# Per SM / RBM block, add the RBM and SM rows that are named but missing —
+# only when no manager row above them exists (waterfall.py)
+waterfall_df = insert_missing_abm_managers(waterfall_df, abm_expected=4.0)
 
 waterfall_df = waterfall_df.drop(columns=["rank"], errors="ignore")
 
+rows_out(len(waterfall_df))
+
 # ------------------------------------------------------------
 # 1️⃣4️⃣ EXPORT WATERFALL SUMMARY
 # ------------------------------------------------------------
+mark("excel_write", rows_in=len(waterfall_df))
 with pd.ExcelWriter(
     output_file,
     engine="openpyxl",
@@ -624,6 +370,7 @@ with pd.ExcelWriter(output_file, engine="openpyxl", mode="a") as writer:
 # ------------------------------------------------------------
 # 1️⃣8️⃣ APPLY PROFESSIONAL EXCEL STYLING (CUSTOM COLORS)
 # ------------------------------------------------------------
+mark("styling")
 from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
 
 wb = load_workbook(output_file)
@@ -699,3 +446,5 @@ for sheet_name in wb.sheetnames:
 wb.save(output_file)
 print("🎨 Excel Styling Applied Successfully!")
 print("✅ Benitowa Report Complete:", output_file)
+
+finish_run(telemetry)
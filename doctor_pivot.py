@@ -0,0 +1,173 @@
+"""
+Layouts of the employee-doctor sheet (the first sheet of every report).
+
+long (default) — one row per employee × doctor, employees without
+doctors keep one row with empty doctor columns:
+
+    empId | <emp_df columns> | Doctor Index | Doctor | Doctor ID | Doc Total Camps | ... | Total Strips
+
+wide — one row per empId, six columns per doctor:
+
+    empId | Total Camps | Doctor 1 | Doctor ID 1 | Doc Total Camps 1 | ... | Total Strips 1 | Doctor 2 | ...
+
+Busy MRs make the wide sheet hundreds of mostly empty columns, which
+openpyxl writes and styles cell by cell; the long sheet has the same
+values in a fixed number of columns.
+
+The scripts used pivot_table(aggfunc="first") on the mixed str / int
+columns, then parsed "Doctor 12" back to 12 to put the columns in order.
+Every (empId, Doctor Index) pair is a single row, so nothing has to be
+aggregated: the Doctor Index is used as a column position, each field is
+scattered into a pre-allocated (employees × doctors) array with one fancy
+index assignment and the interleaved column order is built in one pass.
+
+pivot_doctors() gives the same frame as the pivot_table version
+(bench_doctor_pivot.py checks it): rows sorted by empId, rows without
+an empId or without any value dropped, all-empty doctor columns dropped,
+int columns turned into float when some cells are empty.
+"""
+import numpy as np
+import pandas as pd
+
+# Column order within one doctor
+DOCTOR_FIELDS = [
+    "Doctor",
+    "Doctor ID",
+    "Doc Total Camps",
+    "Total Tests",
+    "Total Rx",
+    "Total Strips",
+]
+TOTAL_FIELD = "Doc Total Camps"
+TESTS_FIELD = "Total Tests"
+
+DOCTOR_LAYOUTS = ["long", "wide"]
+DEFAULT_DOCTOR_LAYOUT = "long"
+
+
+def doctor_index(sql_df):
+    """1, 2, 3 ... per empId in row order (the "Doctor Index" column)."""
+    return sql_df.groupby(["empId"]).cumcount() + 1
+
+
+def _missing_dtype(dtype):
+    """dtype of a field once empty cells are added (as unstack does)."""
+    if dtype.kind in "iu":
+        return np.dtype("float64")
+    if dtype.kind == "b":
+        return np.dtype("object")
+    return dtype
+
+
+def _scatter(values, flat, size, dtype):
+    """values placed at flat positions of a new array, NaN elsewhere."""
+    numpy_dtype = dtype if isinstance(dtype, np.dtype) and dtype.kind in "iuf" else np.dtype(object)
+    if numpy_dtype.kind == "f" or numpy_dtype == object:
+        out = np.full(size, np.nan, dtype=numpy_dtype)
+    else:
+        out = np.empty(size, dtype=numpy_dtype)     # dense grid: every cell is set
+    out[flat] = values
+    return out
+
+
+def _doctor_rows(sql_df, index_col, fields):
+    """Rows the wide layout keeps: an empId, a doctor index and some value."""
+    has_value = sql_df[fields].notna().any(axis=1)
+    keep = sql_df["empId"].notna() & sql_df[index_col].notna() & has_value
+    return sql_df if keep.all() else sql_df.loc[keep]
+
+
+def pivot_doctors(sql_df, index_col="Doctor Index", fields=DOCTOR_FIELDS, total_field=TOTAL_FIELD):
+    """
+    sql_df (one row per empId × doctor, with index_col) → wide frame:
+    empId, "Total Camps", then "<field> <index>" for every doctor index.
+    """
+    df = _doctor_rows(sql_df, index_col, fields)
+
+    emp_codes, emp_ids = pd.factorize(df["empId"], sort=True)
+    idx_codes, idx_values = pd.factorize(df[index_col].to_numpy(), sort=True)
+    n_emp, n_idx = len(emp_ids), len(idx_values)
+
+    # Position of every row in the (doctor × employee) grid
+    flat = idx_codes * n_emp + emp_codes
+    filled = np.zeros(n_emp * n_idx, dtype=bool)
+    filled[flat] = True
+    dense = n_emp * n_idx > 0 and bool(filled.all())
+
+    # Doctor-major grids: the column of doctor j is the contiguous slice j
+    grids = {}
+    present = {}
+    for field in fields:
+        column = df[field]
+        dtype = column.dtype if dense else _missing_dtype(column.dtype)
+        grid = _scatter(column.to_numpy(), flat, n_emp * n_idx, dtype)
+        if grid.dtype == object:
+            # One conversion per field (e.g. to Arrow strings), sliced per doctor below
+            grid = pd.array(grid, dtype=dtype)
+        grids[field] = grid
+
+        notna = np.zeros(n_emp * n_idx, dtype=bool)
+        notna[flat] = column.notna().to_numpy()
+        present[field] = notna.reshape(n_idx, n_emp).any(axis=1)
+
+    totals = np.asarray(grids[total_field]).reshape(n_idx, n_emp)
+    if dense and totals.dtype.kind in "iu":
+        total_camps = totals.sum(axis=0)
+    else:
+        total_camps = np.nansum(totals.astype("float64"), axis=0)
+
+    columns = {"empId": emp_ids, "Total Camps": total_camps}
+    for j, index in enumerate(idx_values):
+        start = j * n_emp
+        for field in fields:
+            if present[field][j]:
+                columns[f"{field} {int(index)}"] = grids[field][start:start + n_emp]
+
+    return pd.DataFrame(columns)
+
+
+def employee_totals(sql_df, index_col="Doctor Index", fields=DOCTOR_FIELDS):
+    """
+    One row per empId: "Total Camps" and "Total Tests" summed over the
+    doctors, with the dtypes the wide columns would have (float unless
+    every employee has every doctor index).
+    """
+    df = _doctor_rows(sql_df, index_col, fields)
+    n_emp = df["empId"].nunique()
+    n_idx = df[index_col].nunique()
+    dense = n_emp * n_idx > 0 and len(df) == n_emp * n_idx
+
+    totals = (
+        df.groupby("empId", sort=True)[[TOTAL_FIELD, TESTS_FIELD]].sum()
+        .rename(columns={TOTAL_FIELD: "Total Camps"})
+        .reset_index()
+    )
+    if not dense:
+        totals = totals.astype({"Total Camps": "float64", TESTS_FIELD: "float64"})
+    return totals
+
+
+def _employee_first(df):
+    cols = df.columns.tolist()
+    cols = ['empId'] + [c for c in cols if c != "empId"]
+    return df[cols].drop(columns=["region_list"], errors="ignore")
+
+
+def doctor_sheet(emp_df, sql_df, layout=DEFAULT_DOCTOR_LAYOUT, index_col="Doctor Index", fields=DOCTOR_FIELDS):
+    """
+    (sheet_df, final_df) for one report: sheet_df is written as the
+    employee-doctor sheet, final_df (one row per employee with
+    "Total Camps" and the "Total Tests" column(s)) feeds the summary
+    sheets. With layout="wide" both are the same frame.
+    """
+    if layout not in DOCTOR_LAYOUTS:
+        raise ValueError(f"unknown doctor sheet layout {layout!r} (expected one of {DOCTOR_LAYOUTS})")
+
+    if layout == "wide":
+        final_df = _employee_first(emp_df.merge(pivot_doctors(sql_df, index_col, fields), on="empId", how="left"))
+        return final_df, final_df
+
+    doctors = _doctor_rows(sql_df, index_col, fields)[["empId", index_col] + fields]
+    sheet_df = _employee_first(emp_df.merge(doctors, on="empId", how="left"))
+    final_df = _employee_first(emp_df.merge(employee_totals(sql_df, index_col, fields), on="empId", how="left"))
+    return sheet_df, final_df
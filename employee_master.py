@@ -0,0 +1,265 @@
+"""
+Employee master (org_access_codes/*.json in GCS) → emp_df, with a
+versioned local cache.
+
+Masters change rarely, but every run used to download and parse the
+whole JSON for every pharma. With a cache_dir, only the blob metadata
+is fetched (one small request); the parsed emp_df is kept on disk as
+Parquet and re-downloaded only when the blob generation changes:
+
+    <cache_dir>/<json_file>.parquet     (emp_df; generation, md5, format
+                                         in the file's key-value metadata)
+
+The version travels in the same file as the frame, so a frame can never
+be paired with another master's version, and checking it only reads the
+Parquet footer.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = pq = None
+
+# Bump when employee_master_frame() changes, so old cache files are rebuilt
+MASTER_FORMAT_VERSION = 4
+
+# Parquet metadata keys: blob version, columns stored as JSON text
+VERSION_KEY = b"employee_master.version"
+JSON_COLUMNS_KEY = b"employee_master.json_columns"
+
+# Columns the hierarchy / summary stages read from emp_df
+REQUIRED_MASTER_COLUMNS = [
+    "empId", "mr_name", "mr_designation", "abm_name", "rbm_name", "sm_name",
+    "state", "city", "hq",
+]
+
+# Text with NaN for missing values (pandas 3's "str"), spelled out: on
+# pandas 2, astype("str") writes missing names as "nan", and pd.NA
+# ("string") breaks the boolean masks of the hierarchy stages
+try:
+    TEXT_DTYPE = pd.StringDtype(na_value=np.nan)
+except TypeError:  # pragma: no cover - pandas < 2.3: values kept as they are, NaN stays NaN
+    TEXT_DTYPE = object
+
+# emp_df columns and dtypes, whatever fields / values a master has (other
+# fields follow, as parsed)
+MASTER_SCHEMA = {
+    **{col: TEXT_DTYPE for col in REQUIRED_MASTER_COLUMNS},
+    "region_list": TEXT_DTYPE,
+}
+
+
+# ------------------------------------------------------------
+# JSON → emp_df
+# ------------------------------------------------------------
+def parse_master_json(raw):
+    """bytes / str → {empId: {...}} (orjson when installed)."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def employee_master_frame(employee_dict):
+    """
+    {empId: {...}} → emp_df (hq, region_list text, no Training rows).
+
+    Built row-oriented from the record list, without the wide
+    intermediate frame of the old DataFrame(dict).transpose() path.
+    Training rows are dropped before the frame is built. The
+    MASTER_SCHEMA columns come first with their declared dtype (all
+    missing when no record has the field), then the other fields in
+    order of first appearance.
+    """
+    emp_ids = []
+    records = []
+
+    for emp_id, record in employee_dict.items():
+        if record.get("mr_name") != "Training":
+            emp_ids.append(str(emp_id))
+            records.append(record)
+
+    # object until cast: a field mixing numbers and gaps must not pass through float
+    emp_df = pd.DataFrame(records, dtype=object)
+    emp_df.insert(0, "empId", emp_ids)
+    emp_df.rename(columns={"mr_region": "hq"}, inplace=True)
+
+    # Convert region_list to comma-separated text
+    if "region_list" in emp_df.columns:
+        emp_df["region_list"] = [
+            ", ".join(x) if isinstance(x, list) else x for x in emp_df["region_list"]
+        ]
+
+    columns = list(MASTER_SCHEMA) + [c for c in emp_df.columns if c not in MASTER_SCHEMA]
+    return emp_df.reindex(columns=columns).astype(MASTER_SCHEMA).infer_objects()
+
+
+def validate_master(emp_df):
+    """List of problems that would break a report (empty list = OK)."""
+    problems = []
+
+    missing = [c for c in REQUIRED_MASTER_COLUMNS if c not in emp_df.columns]
+    if missing:
+        problems.append(f"missing columns: {', '.join(missing)}")
+
+    if emp_df.empty:
+        problems.append("no employees (after removing Training rows)")
+
+    return problems
+
+
+# ------------------------------------------------------------
+# CACHE FILES
+# ------------------------------------------------------------
+def _cache_paths(cache_dir, json_file):
+    base = os.path.join(cache_dir, *json_file.split("/"))
+    return {
+        "folder": os.path.dirname(base),
+        "frame": base + ".parquet",
+    }
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("pyarrow is required for the employee master cache")
+
+
+def blob_version(blob):
+    """Generation (changes on every overwrite), md5 as a fallback."""
+    return {
+        "generation": str(blob.generation) if blob.generation is not None else None,
+        "md5": blob.md5_hash,
+        "format": MASTER_FORMAT_VERSION,
+    }
+
+
+def _cached_version(path):
+    """Version stored with the cached frame (footer only), None if unreadable."""
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        return json.loads(metadata[VERSION_KEY])
+    except (OSError, KeyError, ValueError, pa.ArrowInvalid):
+        return None
+
+
+def _cache_matches(paths, version):
+    _require_pyarrow()
+    if not os.path.exists(paths["frame"]):
+        return False
+
+    meta = _cached_version(paths["frame"])
+    if meta is None:
+        return False
+
+    if meta.get("format") != version["format"]:
+        return False
+    if version["generation"] is not None:
+        return meta.get("generation") == version["generation"]
+    return version["md5"] is not None and meta.get("md5") == version["md5"]
+
+
+def _json_columns(emp_df):
+    """Object columns Arrow can't store as-is (numbers mixed with text, nested records)."""
+    return [
+        col for col in emp_df.columns
+        if emp_df[col].dtype == object
+        and pd.api.types.infer_dtype(emp_df[col], skipna=True) not in ("string", "empty")
+    ]
+
+
+def save_master_cache(cache_dir, json_file, emp_df, version):
+    _require_pyarrow()
+    paths = _cache_paths(cache_dir, json_file)
+    os.makedirs(paths["folder"], exist_ok=True)
+
+    json_columns = _json_columns(emp_df)
+    frame = emp_df.assign(**{col: [json.dumps(v) for v in emp_df[col]] for col in json_columns})
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        VERSION_KEY: json.dumps(version),
+        JSON_COLUMNS_KEY: json.dumps(json_columns),
+    })
+
+    # Written aside and renamed → readers see the old file or the new one
+    tmp = paths["frame"] + ".tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, paths["frame"])
+
+
+def is_cached(cache_dir, json_file, version):
+    """True when the local copy is for this blob version (Parquet footer only)."""
+    return _cache_matches(_cache_paths(cache_dir, json_file), version)
+
+
+def cached_master(cache_dir, json_file, version):
+    """emp_df from the cache if it matches version, else None."""
+    paths = _cache_paths(cache_dir, json_file)
+    if not _cache_matches(paths, version):
+        return None
+
+    table = pq.read_table(paths["frame"])
+    emp_df = table.to_pandas()
+    for col in json.loads(table.schema.metadata.get(JSON_COLUMNS_KEY, b"[]")):
+        emp_df[col] = pd.Series([json.loads(v) for v in emp_df[col]], index=emp_df.index, dtype=object)
+    return emp_df
+
+
+# ------------------------------------------------------------
+# LOAD
+# ------------------------------------------------------------
+def download_master(blob):
+    """Downloads + parses one master blob → emp_df."""
+    return employee_master_frame(parse_master_json(blob.download_as_bytes()))
+
+
+def _checked(emp_df, json_file):
+    problems = validate_master(emp_df)
+    if problems:
+        raise ValueError(f"Employee master {json_file} is unusable: {'; '.join(problems)}")
+    return emp_df
+
+
+def load_employee_master(bucket, json_file, cache_dir=None):
+    """
+    emp_df for the master at json_file (e.g. "org_access_codes/ipca-uacr.json").
+
+    - cache_dir=None → download + parse every time
+    - otherwise a metadata request decides between the local copy and a
+      fresh download (pinned to the generation that was checked)
+
+    Downloads are checked with validate_master() (ValueError) before
+    they are used or cached.
+    """
+    if not cache_dir:
+        emp_df = _checked(download_master(bucket.blob(json_file)), json_file)
+        print("Employee Master Loaded:", emp_df.shape)
+        return emp_df
+
+    blob = bucket.get_blob(json_file)
+    if blob is None:
+        raise FileNotFoundError(f"Employee master not found in bucket: {json_file}")
+
+    version = blob_version(blob)
+    emp_df = cached_master(cache_dir, json_file, version)
+
+    if emp_df is not None:
+        print(f"Employee Master Loaded (cache, generation {version['generation']}):", emp_df.shape)
+        return emp_df
+
+    emp_df = _checked(download_master(blob), json_file)
+    save_master_cache(cache_dir, json_file, emp_df, version)
+
+    print(f"Employee Master Loaded (downloaded, generation {version['generation']}):", emp_df.shape)
+    return emp_df
@@ -0,0 +1,234 @@
+"""
+Org hierarchy helpers for the summary sheets (MR → ABM → RBM → SM).
+
+OrgTree — the rows of a summary / waterfall frame as a layered tree in
+integer arrays (level, group node, parent node per level). rollup()
+sums any metric bottom-up with one bincount per level, instead of a
+groupby().sum().to_dict() + map() per level and metric.
+
+Vacancy relabelling — an ABM (or RBM) whose reports sit under more than
+one manager keeps their name only under the manager they really report
+to; the other blocks become "Vacant (<manager>)":
+
+    relabel_vacant_abms   ABM per RBM block  (FIX ABM NAMES PER RBM BLOCK)
+    relabel_vacant_rbms   RBM per SM block   (FIX RBM NAMES PER SM BLOCK)
+
+The scripts used to loop over every ABM / RBM group and, inside it, over
+every RBM / SM, with a full-frame mask per block. Here the "true" manager
+of every ABM / RBM is looked up once and each column is rewritten with
+one vectorized pass. The result is the same: the vacant label of a row
+only depends on that row's own manager, so the order the old loops ran
+in did not matter, and rows without a manager were never relabelled.
+"""
+import numpy as np
+import pandas as pd
+
+
+def vacant_label(names):
+    """"Vacant (<name>)" for every name of a Series."""
+    return "Vacant (" + names.astype(object).astype(str) + ")"
+
+
+def _true_parent(df, key_col, parent_col, is_true):
+    """
+    Per row: whether its key_col value has a "true" row (is_true) and
+    the parent_col of the first such row (in frame order).
+    """
+    first = df.loc[is_true, [key_col, parent_col]].drop_duplicates(subset=[key_col], keep="first")
+    true_parent = pd.Series(first[parent_col].to_numpy(dtype=object), index=first[key_col].to_numpy(dtype=object))
+
+    keys = df[key_col].astype(object)
+    return keys.isin(true_parent.index) & df[key_col].notna(), keys.map(true_parent)
+
+
+def _vacant_rows(df, key_col, parent_col, is_true):
+    """Rows under a known key whose parent is set and is not the true parent."""
+    has_true, true_parent = _true_parent(df, key_col, parent_col, is_true)
+    parent = df[parent_col].astype(object)
+    same = (parent == true_parent) & true_parent.notna()
+    return has_true & df[parent_col].notna() & ~same
+
+
+def relabel_vacant_abms(df):
+    """
+    ABM names per RBM block. The true RBM of an ABM is the rbm_name of
+    the first row named after the ABM; rows of that ABM under any other
+    RBM get abm_name (and name, on the ABM's own row) "Vacant (<rbm>)".
+    """
+    df = df.copy()
+    rename = _vacant_rows(df, "abm_name", "rbm_name", df["name"] == df["abm_name"])
+    if not rename.any():
+        return df
+
+    vacant = vacant_label(df["rbm_name"])
+    df["abm_name"] = df["abm_name"].mask(rename, vacant)
+    df["name"] = df["name"].mask(rename & (df["designation"] == "abm"), vacant)
+    return df
+
+
+def relabel_vacant_rbms(df):
+    """
+    RBM names per SM block. The true SM of an RBM is the sm_name of its
+    first "rbm" row; rows of that RBM under any other SM get rbm_name
+    "Vacant (<sm>)".
+    """
+    df = df.copy()
+    is_true = (df["designation"] == "rbm") & (df["name"] == df["rbm_name"])
+    rename = _vacant_rows(df, "rbm_name", "sm_name", is_true)
+    if not rename.any():
+        return df
+
+    df["rbm_name"] = df["rbm_name"].mask(rename, vacant_label(df["sm_name"]))
+    return df
+
+
+# ------------------------------------------------------------
+# ORG TREE + ROLLUPS
+# ------------------------------------------------------------
+LEVELS = ["mr", "abm", "rbm", "sm"]
+LEVEL_COLUMNS = {"mr": "name", "abm": "abm_name", "rbm": "rbm_name", "sm": "sm_name"}
+
+
+class OrgTree:
+    """
+    Rows of a hierarchy frame (summary / waterfall sheet) as a layered
+    tree held in integer arrays, built once per frame:
+
+        level[i]          index in levels of row i's designation (-1: not in levels)
+        parent[lvl][i]    group node of row i at level lvl (its <lvl>_name), -1 for none
+        node[i]           group node of row i at its own level
+
+    A group node is one name at one level: the scripts match managers
+    by name, so every row named "RBM 1" is the node "RBM 1" and gets its
+    total. key="level" reads a manager's own node from its level column
+    (abm_name for ABM rows), key="name" from the name column. With
+    dropna=True rows without a name belong to no node (groupby's default).
+    """
+
+    def __init__(self, df, levels=LEVELS, key="level", dropna=False):
+        self.levels = list(levels)
+        designation = df["designation"].to_numpy(dtype=object)
+        self.level = np.full(len(df), -1, dtype=np.int64)
+        for i, lvl in enumerate(self.levels):
+            self.level[designation == lvl] = i
+
+        self.names = {}
+        self.parent = {}
+        self.node = np.full(len(df), -1, dtype=np.int64)
+        for i, lvl in enumerate(self.levels[1:], start=1):
+            column = LEVEL_COLUMNS[lvl]
+            if column not in df.columns:
+                continue
+            own = self.level == i
+            keys = df[column if key == "level" else "name"].to_numpy(dtype=object)[own]
+
+            # One code space per level for the children's column and the managers' own key
+            codes, names = pd.factorize(
+                np.concatenate([df[column].to_numpy(dtype=object), keys]), use_na_sentinel=dropna
+            )
+            self.parent[lvl] = codes[:len(df)]
+            self.node[own] = codes[len(df):]
+            self.names[lvl] = names
+
+    def rollup(self, values, start=None, chained=True, fill=0.0):
+        """
+        Bottom-up sum of values: the rows of every level above start get
+        the sum over the rows below that point to their node.
+
+        chained=True   level sums the rows one level down (ABM ← MR,
+                       RBM ← ABM, SM ← RBM), so each level reuses the
+                       totals just computed for the one below
+        chained=False  every level sums the start rows directly
+        fill           value of manager rows without children
+                       (None keeps their current value)
+
+        One bincount per level: O(rows) for the whole tree.
+        """
+        values = np.array(values, dtype="float64")
+        first = self.levels.index(start or self.levels[0])
+        children = self.level == first
+
+        for i in range(first + 1, len(self.levels)):
+            lvl = self.levels[i]
+            if lvl not in self.parent:
+                continue
+            parent = self.parent[lvl]
+            n_nodes = len(self.names[lvl])
+
+            src = children & (parent >= 0)
+            totals = np.bincount(parent[src], weights=values[src], minlength=n_nodes)
+            has_children = np.bincount(parent[src], minlength=n_nodes) > 0
+
+            rows = self.level == i
+            matched = rows & (self.node >= 0)
+            if fill is None:
+                matched[matched] = has_children[self.node[matched]]
+            else:
+                values[rows] = fill
+            values[matched] = totals[self.node[matched]]
+
+            if chained:
+                children = rows
+
+        return values
+
+    def missing(self, level, below=None):
+        """
+        Names at level that rows further down point to but that have no
+        row of their own (vacant positions).
+        """
+        i = self.levels.index(level)
+        if below is None:
+            below = (self.level >= 0) & (self.level < i)
+        else:
+            below = np.isin(self.level, [self.levels.index(b) for b in below])
+        parent = self.parent[level]
+        referenced = np.zeros(len(self.names[level]), dtype=bool)
+        referenced[parent[below & (parent >= 0)]] = True
+        present = np.zeros(len(self.names[level]), dtype=bool)
+        own = self.node[self.level == i]
+        present[own[own >= 0]] = True
+        return self.names[level][referenced & ~present]
+
+
+# ------------------------------------------------------------
+# PLACEHOLDER ROWS FOR MISSING MANAGERS
+# ------------------------------------------------------------
+PLACEHOLDER_COLUMNS = [
+    "empId", "name", "designation", "mr_name", "abm_name", "rbm_name", "sm_name",
+    "state", "city", "hq", "total_camps", "expected_camps",
+]
+
+
+def missing_manager_rows(emp_df, summary_df, levels=("sm", "rbm", "abm")):
+    """
+    Placeholder rows (zero camps) for the managers named in emp_df's
+    sm_name / rbm_name / abm_name that have no row of that designation
+    in summary_df, per level in order of first appearance. All name
+    columns of a placeholder hold the manager's own name until the
+    later fixes.
+
+    One anti-join (isin) per level instead of a full-frame
+    `(designation == level) & (name == manager)` check per name.
+    """
+    missing = []
+    for level in levels:
+        names = pd.Series(emp_df[LEVEL_COLUMNS[level]].dropna().unique())
+        own = summary_df.loc[summary_df["designation"] == level, "name"]
+        missing.append((level, names[~names.isin(own)]))
+
+    names = pd.concat([n for _, n in missing], ignore_index=True)
+    n = len(names)
+    rows = pd.DataFrame({
+        "empId": [""] * n,
+        "name": names,
+        "designation": np.repeat([level for level, _ in missing], [len(m) for _, m in missing]),
+        "state": [""] * n,
+        "city": [""] * n,
+        "hq": [""] * n,
+        "total_camps": np.zeros(n),
+        "expected_camps": np.zeros(n),
+    })
+    for column in ["mr_name", "abm_name", "rbm_name", "sm_name"]:
+        rows[column] = names
+    return rows[PLACEHOLDER_COLUMNS]
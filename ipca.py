@@ -2,46 +2,42 @@
 
 
 
-import pyodbc
 import pandas as pd
-from google.cloud import firestore, storage
 from datetime import datetime, date, timedelta
-import json
 import re
 import warnings
 warnings.filterwarnings('ignore')
 
+from metrics_cache import fetch_month_to_date
+from backends import get_bucket, get_sql_manager
+from employee_master import load_employee_master
+from doctor_pivot import doctor_index, doctor_sheet
+from hierarchy import OrgTree, relabel_vacant_abms, relabel_vacant_rbms
+from waterfall import build_waterfall, insert_missing_managers
+from stages import begin_run, finish_run, mark, rows_out, telemetry_dir_from_env
+
+# One JSON line per stage + a run summary when REPORT_TELEMETRY_DIR is set (see stages.py)
+TELEMETRY_DIR = telemetry_dir_from_env()
+telemetry = begin_run("ipca", TELEMETRY_DIR, enabled=bool(TELEMETRY_DIR), tenant="ipca")
+
 # ------------------------------------------------------------
 # 1️⃣ LOAD EMPLOYEE MASTER FROM FIREBASE
 # ------------------------------------------------------------
-st = storage.Client("neodocs-8d6cd")
-bucket = st.bucket("neodocs-8d6cd-utils")
-
-blob = bucket.blob("org_access_codes/ipca-uacr.json")
-json_data = blob.download_as_text()
-employee_dict = json.loads(json_data)
-
-# Convert to DataFrame
-emp_df = pd.DataFrame(employee_dict).transpose().reset_index()
-emp_df.rename(columns={"index": "empId", "mr_region": "hq"}, inplace=True)
+mark("master_load")
+# GCS bucket (or a local directory with REPORT_BACKEND=local, see backends.py)
+bucket = get_bucket()
 
-# Remove Training rows
-emp_df = emp_df[emp_df['mr_name'] != "Training"]
+# None = download every run; a folder keeps the parsed master until the blob changes
+MASTER_CACHE_DIR = None
 
-# Convert region_list to comma-separated text
-if "region_list" in emp_df.columns:
-    emp_df["region_list"] = emp_df["region_list"].apply(
-        lambda x: ", ".join(x) if isinstance(x, list) else x
-    )
+emp_df = load_employee_master(bucket, "org_access_codes/ipca-uacr.json", cache_dir=MASTER_CACHE_DIR)
 
-# Ensure empId is string
-emp_df["empId"] = emp_df["empId"].astype(str)
-
-print("Employee Master Loaded:", emp_df.shape)
+rows_out(len(emp_df))
 
 # ------------------------------------------------------------
 # 2️⃣ SQL SERVER — LOAD DOCTOR METRICS
 # ------------------------------------------------------------
+mark("sql_fetch")
 server = 'neodocs-sql-server.database.windows.net'
 database = 'neodocs-sql-db'
 username = 'ndDashboard'
@@ -59,7 +55,9 @@ TrustServerCertificate=no;
 Connection Timeout=30;
 """
 
-conn = pyodbc.connect(conn_str)
+# Pooled + retrying connection (transient Azure SQL errors are retried;
+# the local SQLite store with REPORT_BACKEND=local)
+conn = get_sql_manager(conn_str)
 print("Connected to SQL Server")
 
 # ------------------------------------------------------------
@@ -82,148 +80,52 @@ print("SQL Range (Current Month):", START_DATE, "to", END_DATE)
 # ------------------------------------------------------------
 # CLEAN SQL QUERY (hemaday + ipca HB)
 # ------------------------------------------------------------
-query = """
-WITH test_summary AS (
-    SELECT 
-        u.empId,
-        u.docId AS [Doctor ID],
-        u.drName AS Doctor,
-        u.oId,
-        COUNT(DISTINCT u.testId) AS [Total Tests],
-        COUNT(DISTINCT CONVERT(date, u.campDate)) AS [Total Camps]
-    FROM dbo.user_tests u
-    LEFT JOIN dbo.aId a ON u.aId = a.aId
-    WHERE 
-        a.aId = '2150397e-a6f4-4a0e-8108-3977a2f5d279'
-        AND u.statusCode = 200
-        AND u.isDeleted = 0
-        AND u.campDate BETWEEN ? AND ?
-    GROUP BY u.empId, u.docId, u.drName, u.oId
-),
-
-rx_summary AS (
-    SELECT 
-        r.aId,
-        r.oId,
-        r.campDate,
-        SUM(TRY_CAST(LEFT(JSON_VALUE(r.prescriptions, '$.ipca'), 
-            CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.ipca')) - 1) AS INT)) AS [Total Rx],
-        SUM(TRY_CAST(LTRIM(RIGHT(JSON_VALUE(r.prescriptions, '$.ipca'), 
-            LEN(JSON_VALUE(r.prescriptions, '$.ipca')) - 
-            CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.ipca')))) AS INT)) AS [Total Strips]
-    FROM dbo.rx r
-    LEFT JOIN dbo.aId a ON r.aId = a.aId
-    WHERE 
-        a.aId = '2150397e-a6f4-4a0e-8108-3977a2f5d279'
-        AND r.isDeleted = 0
-        AND r.campDate BETWEEN ? AND ?
-    GROUP BY r.aId, r.oId, r.campDate
-)
+AID = "2150397e-a6f4-4a0e-8108-3977a2f5d279"
+PRESCRIPTION_KEY = "ipca"
 
-SELECT 
-    t.empId AS [empId],
-    t.Doctor,
-    t.[Doctor ID],
-    t.[Total Camps] AS [Doc Total Camps],
-    ISNULL(SUM(rx.[Total Rx]), 0) AS [Total Rx],
-    ISNULL(SUM(rx.[Total Strips]), 0) AS [Total Strips],
-    t.[Total Tests]
-FROM test_summary t
-LEFT JOIN rx_summary rx
-    ON t.oId = rx.oId
-GROUP BY 
-    t.empId, t.Doctor, t.[Doctor ID], t.[Total Camps], t.[Total Tests]
-ORDER BY t.empId;
-"""
+# Month-to-date cache of per-day aggregates (None = query the full month)
+METRICS_CACHE_DIR = None          # e.g. ".metrics_cache"
+RECHECK_DAYS = 2                  # re-query this many days before the watermark
 
-params = [START_DATE, END_DATE, START_DATE, END_DATE]
-sql_df = pd.read_sql(query, conn, params=params)
+# aId + prescription key are bound as parameters (shared query builder)
+sql_df = fetch_month_to_date(
+    conn, AID, PRESCRIPTION_KEY, START_DATE, END_DATE,
+    cache_dir=METRICS_CACHE_DIR, recheck_days=RECHECK_DAYS
+)
+conn.close()
 
 print("Doctor Metrics Loaded:", sql_df.shape)
 
-# ------------------------------------------------------------
-# 3️⃣ ASSIGN DOCTOR INDEX PER empId
-# ------------------------------------------------------------
-sql_df['Doctor Index'] = sql_df.groupby(['empId']).cumcount() + 1
-
-# ------------------------------------------------------------
-# 4️⃣ PIVOT DOCTOR METRICS — Wide format
-# ------------------------------------------------------------
-pivoted = sql_df.pivot_table(
-    index=['empId'],
-    columns='Doctor Index',
-    values=['Doctor', 'Doctor ID', 'Doc Total Camps', 'Total Rx', 'Total Strips', 'Total Tests'],
-    aggfunc='first'
-)
-
-# Flatten columns
-pivoted.columns = [f"{col[0]} {int(col[1])}" for col in pivoted.columns]
-pivoted = pivoted.reset_index()
+rows_out(len(sql_df))
 
 # ------------------------------------------------------------
-# ADD TOTAL CAMPS COLUMN (SUM OF ALL DOC TOTAL CAMPS)
+# 3️⃣ ASSIGN DOCTOR INDEX PER empId
 # ------------------------------------------------------------
-
-# Identify all Doc Total Camps columns
-doc_camp_cols = [col for col in pivoted.columns if col.startswith("Doc Total Camps")]
-
-# Create Total Camps column
-pivoted["Total Camps"] = pivoted[doc_camp_cols].sum(axis=1)
-
+mark("doctor_pivot", rows_in=len(sql_df))
+sql_df['Doctor Index'] = doctor_index(sql_df)
 
 # ------------------------------------------------------------
-# REORDER COLUMNS WITH TOTAL CAMPS FIRST, THEN DOCTORS
+# 4️⃣ DOCTOR SHEET LAYOUT
 # ------------------------------------------------------------
-
-# Identify all doctor indices
-doctor_indices = sorted(
-    list({
-        int(col.split()[-1]) 
-        for col in pivoted.columns 
-        if col not in ["empId", "Total Camps"]
-    })
-)
-
-# Order template
-order_template = [
-    "Doctor",
-    "Doctor ID",
-    "Doc Total Camps",
-    "Total Tests",
-    "Total Rx",
-    "Total Strips"
-]
-
-# Start ordering
-ordered_columns = ["empId", "Total Camps"]
-
-# Append each doctor's metrics
-for idx in doctor_indices:
-    for field in order_template:
-        col_name = f"{field} {idx}"
-        if col_name in pivoted.columns:
-            ordered_columns.append(col_name)
-
-pivoted = pivoted.reindex(columns=ordered_columns)
-
+# long = one row per employee × doctor (default)
+# wide = one row per employee, six columns per doctor (doctor_pivot.py)
+DOCTOR_SHEET_LAYOUT = "long"
 
 # ------------------------------------------------------------
 # 5️⃣ JOIN WITH EMPLOYEE MASTER
 # ------------------------------------------------------------
-final_df = emp_df.merge(pivoted, on="empId", how="left")
+# sheet_df → first sheet; final_df → one row per employee
+# (Total Camps / Total Tests) for the summary sheets
+sheet_df, final_df = doctor_sheet(emp_df, sql_df, DOCTOR_SHEET_LAYOUT)
 
-# Move empId first
-cols = final_df.columns.tolist()
-cols = ['empId'] + [c for c in cols if c != "empId"]
-final_df = final_df[cols]
-
-final_df = final_df.drop(columns=["region_list"], errors="ignore")
+rows_out(len(sheet_df))
 
 # ------------------------------------------------------------
 # 6️⃣ EXPORT TO EXCEL
 # ------------------------------------------------------------
+mark("excel_write", rows_in=len(sheet_df))
 output_file = "ipca_employee_doctor_report.xlsx"
-final_df.to_excel(output_file, index=False)
+sheet_df.to_excel(output_file, index=False)
 
 print("✅ Final Report Generated:", output_file)
 
@@ -239,6 +141,7 @@ print("✅ Final Report Generated:", output_file)
 # 7️⃣ CREATE SUMMARY SHEET (MR → ABM → RBM → SM)
 # CLEAN + READABLE VERSION
 # ------------------------------------------------------------
+mark("hierarchy", rows_in=len(final_df))
 
 # 1. Extract MR-level total camps
 mr_camps = final_df[["empId", "Total Camps"]].copy()
@@ -307,70 +210,17 @@ summary_df = summary_df.sort_values("rank", ascending=False).drop_duplicates(sub
 # ------------------------------------------------------------
 # ⭐ 0) FIX ABM NAMES PER RBM BLOCK (NEW RULE)
 # ------------------------------------------------------------
-
-df = summary_df.copy()
-
-for abm, abm_group in df.groupby("abm_name", dropna=False):
-
-    # Find TRUE ABM block → where MR name matches ABM name
-    true_block = abm_group[abm_group["name"] == abm]
-
-    if true_block.empty:
-        continue  # no matching MR = skip
-
-    true_rbm = true_block.iloc[0]["rbm_name"]  # the rbm where ABM is true
-
-    # All RBMs under this ABM
-    rbm_list = abm_group["rbm_name"].fillna("").unique().tolist()
-
-    for rbm in rbm_list:
-
-        # TRUE RBM block → do nothing
-        if rbm == true_rbm:
-            continue
-
-        # Other RBM blocks → ABM becomes Vacant(RBM)
-        vacant_abm = f"Vacant ({rbm})"
-
-        mask = (df["abm_name"] == abm) & (df["rbm_name"] == rbm)
-
-        # Update ABM name
-        df.loc[mask, "abm_name"] = vacant_abm
-        
-        # Update "name" only for ABM designation row
-        df.loc[mask & (df["designation"] == "abm"), "name"] = vacant_abm
-
-summary_df = df.copy()
+# TRUE ABM block → the RBM of the first row named after the ABM;
+# other RBM blocks → ABM becomes Vacant(RBM) (hierarchy.py)
+summary_df = relabel_vacant_abms(summary_df)
 
 
 # ------------------------------------------------------------
 # ⭐ 1) FIX RBM NAMES PER SM BLOCK (Opposite Rule)
 # ------------------------------------------------------------
-
-df = summary_df.copy()
-
-for rbm, rbm_group in df.groupby("rbm_name", dropna=False):
-
-    # Identify TRUE RBM block → where the RBM row exists
-    rbm_row = rbm_group[(rbm_group["designation"] == "rbm") & 
-                        (rbm_group["name"] == rbm)]
-    
-    if rbm_row.empty:
-        continue  # No RBM row found (should not happen)
-
-    true_sm = rbm_row.iloc[0]["sm_name"]
-
-    # SMs under this RBM
-    all_sms = rbm_group["sm_name"].fillna("").unique().tolist()
-
-    for sm in all_sms:
-        # All NOT TRUE blocks should become Vacant RBMs
-        if sm != true_sm:
-            vacant_name = f"Vacant ({sm})"
-            mask = (df["rbm_name"] == rbm) & (df["sm_name"] == sm)
-            df.loc[mask, "rbm_name"] = vacant_name
-
-summary_df = df.copy()
+# TRUE RBM block → the SM of the RBM's own row;
+# all NOT TRUE blocks become Vacant(SM)
+summary_df = relabel_vacant_rbms(summary_df)
 
 
 # ------------------------------------------------------------
@@ -379,48 +229,14 @@ summary_df = df.copy()
 
 summary_df["designation"] = summary_df["designation"].str.lower()
 
+# MR → ABM → RBM → SM: every level sums the rows one level down,
+# matched on the manager's own abm_name / rbm_name / sm_name (hierarchy.py)
+org_tree = OrgTree(summary_df)
+
 # ============================================================
 # 1️⃣ TOTAL CAMPS
 # ============================================================
-
-# ABM totals = sum(MR totals)
-abm_total_map = (
-    summary_df[summary_df["designation"] == "mr"]
-    .groupby("abm_name", dropna=False)["total_camps"]
-    .sum()
-    .to_dict()
-)
-
-summary_df.loc[summary_df["designation"] == "abm", "total_camps"] = (
-    summary_df.loc[summary_df["designation"] == "abm", "abm_name"]
-    .map(abm_total_map).fillna(0)
-)
-
-# RBM totals = sum(ABM totals)
-rbm_total_map = (
-    summary_df[summary_df["designation"] == "abm"]
-    .groupby("rbm_name", dropna=False)["total_camps"]
-    .sum()
-    .to_dict()
-)
-
-summary_df.loc[summary_df["designation"] == "rbm", "total_camps"] = (
-    summary_df.loc[summary_df["designation"] == "rbm", "rbm_name"]
-    .map(rbm_total_map).fillna(0)
-)
-
-# SM totals = sum(RBM totals)
-sm_total_map = (
-    summary_df[summary_df["designation"] == "rbm"]
-    .groupby("sm_name", dropna=False)["total_camps"]
-    .sum()
-    .to_dict()
-)
-
-summary_df.loc[summary_df["designation"] == "sm", "total_camps"] = (
-    summary_df.loc[summary_df["designation"] == "sm", "sm_name"]
-    .map(sm_total_map).fillna(0)
-)
+summary_df["total_camps"] = org_tree.rollup(summary_df["total_camps"])
 
 # ============================================================
 # 2️⃣ EXPECTED CAMPS
@@ -429,31 +245,8 @@ summary_df.loc[summary_df["designation"] == "sm", "total_camps"] = (
 # ABM expected = 2
 summary_df.loc[summary_df["designation"] == "abm", "expected_camps"] = 2.0
 
-# RBM expected = sum(expected ABMs)
-rbm_expected_map = (
-    summary_df[summary_df["designation"] == "abm"]
-    .groupby("rbm_name", dropna=False)["expected_camps"]
-    .sum()
-    .to_dict()
-)
-
-summary_df.loc[summary_df["designation"] == "rbm", "expected_camps"] = (
-    summary_df.loc[summary_df["designation"] == "rbm", "rbm_name"]
-    .map(rbm_expected_map).fillna(0)
-)
-
-# SM expected = sum(RBM expected)
-sm_expected_map = (
-    summary_df[summary_df["designation"] == "rbm"]
-    .groupby("sm_name", dropna=False)["expected_camps"]
-    .sum()
-    .to_dict()
-)
-
-summary_df.loc[summary_df["designation"] == "sm", "expected_camps"] = (
-    summary_df.loc[summary_df["designation"] == "sm", "sm_name"]
-    .map(sm_expected_map).fillna(0)
-)
+# RBM expected = sum(expected ABMs), SM expected = sum(RBM expected)
+summary_df["expected_camps"] = org_tree.rollup(summary_df["expected_camps"], start="abm")
 
 
 # ------------------------------------------------------------
@@ -465,252 +258,25 @@ summary_df["execution_percent"] = summary_df.apply(
     axis=1
 ).round(0).astype(int)
 
+rows_out(len(summary_df))
+
 # ------------------------------------------------------------
 # ⭐ 2) BUILD WATERFALL SUMMARY (MR → ABM → RBM → SM)
 # ------------------------------------------------------------
+mark("waterfall", rows_in=len(summary_df))
 
-final_rows = []
-
-for sm, sm_group in summary_df.groupby("sm_name", dropna=False):
-
-    for rbm, rbm_group in sm_group.groupby("rbm_name", dropna=False):
-
-        rbm_str = str(rbm) if not pd.isna(rbm) else ""
-        is_vacant_rbm = rbm_str.startswith("Vacant (")
-
-        # ---------------------------------------------------------
-        # Identify REAL ABMs only (exclude Vacant(...))
-        # ---------------------------------------------------------
-        real_abm_groups = {}
-
-        for abm, abm_group in rbm_group.groupby("abm_name", dropna=False):
-
-            # A real ABM must:
-            # 1. Have a valid name (not Vacant(...))
-            # 2. Have an ABM row in the group
-            if isinstance(abm, str) and abm.startswith("Vacant ("):
-                continue
-
-            if abm_group[abm_group["designation"] == "abm"].shape[0] == 0:
-                continue
-
-            real_abm_groups[abm] = abm_group
-
-        # ---------------------------------------------------------
-        # 1️⃣ Process REAL ABM blocks → MRs + ABM row
-        # ---------------------------------------------------------
-        mrs_assigned = []
-
-        for abm, abm_group in real_abm_groups.items():
-
-            # MRs under this real ABM
-            mrs = abm_group[abm_group["designation"] == "mr"]
-
-            for _, row in mrs.iterrows():
-                final_rows.append(row)
-                mrs_assigned.append(row.name)
-
-            # ABM row (real)
-            abm_row = abm_group[abm_group["designation"] == "abm"]
-            if not abm_row.empty:
-                final_rows.append(abm_row.iloc[0])
-
-        mrs_assigned = set(mrs_assigned)
-
-        # ---------------------------------------------------------
-        # 2️⃣ LEFTOVER MRs (those under rbm but not under real ABMs)
-        # ---------------------------------------------------------
-        all_mrs = rbm_group[rbm_group["designation"] == "mr"]
-        leftover_mrs = all_mrs[~all_mrs.index.isin(mrs_assigned)]
-
-        for _, row in leftover_mrs.iterrows():
-            final_rows.append(row)
-
-        # ---------------------------------------------------------
-        # 3️⃣ If leftover MRs exist → add Vacant ABM block
-        # ---------------------------------------------------------
-        if not leftover_mrs.empty:
-
-            total_camps = leftover_mrs["total_camps"].sum()
-            expected_camps = leftover_mrs["expected_camps"].sum()
-            exec_percent = (
-                round((total_camps / expected_camps) * 100)
-                if expected_camps > 0 else 0
-            )
-
-            vacant_abm = {
-                "empId": "",
-                "name": f"Vacant ({rbm})",
-                "abm_name": f"Vacant ({rbm})",
-                "rbm_name": rbm,
-                "sm_name": sm,
-                "state": "",
-                "city": "",
-                "designation": "abm",
-                "hq": "",
-                "total_camps": total_camps,
-                "expected_camps": 2.0,
-                "execution_percent": exec_percent
-            }
-
-            final_rows.append(pd.Series(vacant_abm))
-
-        # ---------------------------------------------------------
-        # 4️⃣ RBM ROW (real or synthetic)
-        # ---------------------------------------------------------
-        rbm_row = rbm_group[rbm_group["designation"] == "rbm"]
-
-        if not is_vacant_rbm:
-            # Real RBM
-            if not rbm_row.empty:
-                final_rows.append(rbm_row.iloc[0])
-
-        else:
-            # Synthetic RBM for Vacant RBM
-            abm_rows = rbm_group[rbm_group["designation"] == "abm"]
-
-            total_camps = abm_rows["total_camps"].sum()
-            expected_camps = abm_rows["expected_camps"].sum()
-
-            exec_percent = (
-                round((total_camps / expected_camps) * 100)
-                if expected_camps > 0 else 0
-            )
-
-            synthetic_rbm = {
-                "empId": "",
-                "name": rbm,
-                "abm_name": rbm,
-                "rbm_name": rbm,
-                "sm_name": sm,
-                "state": "",
-                "city": "",
-                "designation": "rbm",
-                "hq": "",
-                "total_camps": total_camps,
-                "expected_camps": expected_camps,
-                "execution_percent": exec_percent
-            }
-
-            final_rows.append(pd.Series(synthetic_rbm))
-
-
-    # ---------------------------------------------------------
-    # 5️⃣ SM ROW
-    # ---------------------------------------------------------
-    sm_row = sm_group[sm_group["designation"] == "sm"]
-    if not sm_row.empty:
-        final_rows.append(sm_row.iloc[0])
-
-# Convert final rows into DataFrame
-waterfall_df = pd.DataFrame(final_rows)
+# MRs under their ABM, "Vacant (<rbm>)" ABM rows for MRs without one,
+# synthetic rows for vacant RBMs (waterfall.py)
+waterfall_df = build_waterfall(summary_df, vacant_abm_expected=2.0)
 
 
 # ------------------------------------------------------------------
 # INSERT MISSING MANAGER ROWS — HIERARCHY AWARE
 # ------------------------------------------------------------------
 
-df = waterfall_df.copy()
-final_rows = []
-
-def make_row(desig, name, sm, rbm, abm, total=0.0, exp=0.0):
-    return pd.Series({
-        "empId": "",
-        "name": name,
-        "designation": desig,
-        "sm_name": sm,
-        "rbm_name": rbm,
-        "abm_name": abm,
-        "state": "",
-        "city": "",
-        "hq": "",
-        "total_camps": float(total),
-        "expected_camps": float(exp),
-        "execution_percent": 0
-    })
-
-
-# GROUP BY SM
-for sm, sm_block in df.groupby("sm_name", dropna=False):
-
-    # Check if SM row exists
-    sm_present = len(sm_block[(sm_block["designation"] == "sm") &
-                              (sm_block["name"] == sm)]) > 0
-
-    # GROUP BY RBM inside the SM
-    for rbm, rbm_block in sm_block.groupby("rbm_name", dropna=False):
-
-        # Check if RBM row exists
-        rbm_present = len(rbm_block[(rbm_block["designation"] == "rbm") &
-                                    (rbm_block["name"] == rbm)]) > 0
-
-        # GROUP BY ABM inside the RBM
-        for abm, abm_block in rbm_block.groupby("abm_name", dropna=False):
-
-            # Check if ABM row exists
-            abm_present = len(abm_block[(abm_block["designation"] == "abm") &
-                                        (abm_block["name"] == abm)]) > 0
-
-            # Add MRs first
-            mr_rows = abm_block[abm_block["designation"] == "mr"]
-            for _, r in mr_rows.iterrows():
-                final_rows.append(r)
-
-            # Insert ABM row IF:
-            # • ABM is not empty
-            # • ABM row does NOT exist
-            # • RBM for this person does not exist (respect hierarchy)
-            # • SM for this person does not exist
-            if abm and (not abm_present) and (not rbm_present) and (not sm_present):
-                total = mr_rows["total_camps"].sum()
-                final_rows.append(
-                    make_row("abm", abm, sm, rbm, abm, total=total, exp=2.0)
-                )
-            elif abm_present:
-                final_rows.append(abm_block[abm_block["designation"] == "abm"].iloc[0])
-
-        # ---------------- RBM INSERTION ----------------
-        # Insert RBM ONLY IF:
-        # • RBM exists as name
-        # • RBM row missing
-        # • SM row for person doesn't exist
-        if rbm and (not rbm_present) and (not sm_present):
-
-            # Compute total camps from ABMs under this RBM *after* inserts
-            abm_part = [r for r in final_rows
-                        if r["rbm_name"] == rbm and r["designation"] == "abm"]
-
-            total = sum(r["total_camps"] for r in abm_part)
-
-            final_rows.append(
-                make_row("rbm", rbm, sm, rbm, "", total=total, exp=0.0)
-            )
-
-        elif rbm_present:
-            final_rows.append(rbm_block[rbm_block["designation"] == "rbm"].iloc[0])
-
-    # ---------------- SM INSERTION ----------------
-    # Insert SM ONLY IF:
-    # • SM exists as name
-    # • SM row missing
-    if sm and (not sm_present):
-
-        # Compute total from RBMs under this SM
-        rbm_part = [r for r in final_rows
-                    if r["sm_name"] == sm and r["designation"] == "rbm"]
-
-        total = sum(r["total_camps"] for r in rbm_part)
-
-        final_rows.append(
-            make_row("sm", sm, sm, "", "", total=total, exp=0.0)
-        )
-
-    elif sm_present:
-        final_rows.append(sm_block[sm_block["designation"] == "sm"].iloc[0])
-
-
-# Final updated waterfall
-waterfall_df = pd.DataFrame(final_rows).reset_index(drop=True)
+# Per SM / RBM / ABM block, add the ABM, RBM and SM rows that are named but
+# missing — only when no manager row above them exists (waterfall.py)
+waterfall_df = insert_missing_managers(waterfall_df, abm_expected=2.0)
 
 
 waterfall_df = waterfall_df.drop(columns=["abm_name","rank"], errors="ignore")
@@ -725,29 +291,9 @@ waterfall_df["designation"] = waterfall_df["designation"].str.lower()
 waterfall_df.loc[waterfall_df["designation"] == "abm", "expected_camps"] = 2.0
 
 # 2️⃣ RBM expected = sum of ABM expected
-rbm_expected_map = (
-    waterfall_df[waterfall_df["designation"] == "abm"]
-    .groupby("rbm_name", dropna=False)["expected_camps"]
-    .sum()
-    .to_dict()
-)
-
-waterfall_df.loc[waterfall_df["designation"] == "rbm", "expected_camps"] = (
-    waterfall_df.loc[waterfall_df["designation"] == "rbm", "rbm_name"]
-    .map(rbm_expected_map).fillna(0)
-)
-
 # 3️⃣ SM expected = sum of RBM expected
-sm_expected_map = (
-    waterfall_df[waterfall_df["designation"] == "rbm"]
-    .groupby("sm_name", dropna=False)["expected_camps"]
-    .sum()
-    .to_dict()
-)
-
-waterfall_df.loc[waterfall_df["designation"] == "sm", "expected_camps"] = (
-    waterfall_df.loc[waterfall_df["designation"] == "sm", "sm_name"]
-    .map(sm_expected_map).fillna(0)
+waterfall_df["expected_camps"] = (
+    OrgTree(waterfall_df).rollup(waterfall_df["expected_camps"], start="abm")
 )
 
 # 4️⃣ Execution %
@@ -757,9 +303,12 @@ waterfall_df["execution_percent"] = waterfall_df.apply(
     axis=1
 ).round(0).astype(int)
 
+rows_out(len(waterfall_df))
+
 # ------------------------------------------------------------
 # ⭐ 3) EXPORT WATERFALL SUMMARY
 # ------------------------------------------------------------
+mark("excel_write", rows_in=len(waterfall_df))
 with pd.ExcelWriter(
     "ipca_employee_doctor_report.xlsx",
     engine="openpyxl",
@@ -907,6 +456,7 @@ with pd.ExcelWriter("ipca_employee_doctor_report.xlsx", engine="openpyxl", mode=
 # ------------------------------------------------------------
 # 🔟 APPLY PROFESSIONAL EXCEL STYLING (CUSTOM COLORS)
 # ------------------------------------------------------------
+mark("styling")
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
 
@@ -989,3 +539,5 @@ for sheet_name in wb.sheetnames:
 wb.save("ipca_employee_doctor_report.xlsx")
 
 print("🎨 Excel Styling Applied Successfully!")
+
+finish_run(telemetry)
@@ -1,43 +1,39 @@
-import pyodbc
 import pandas as pd
-from google.cloud import firestore, storage
 from datetime import datetime, date, timedelta
-import json
 import re
 import warnings
 warnings.filterwarnings('ignore')
 
+from metrics_cache import fetch_month_to_date
+from backends import get_bucket, get_sql_manager
+from employee_master import load_employee_master
+from doctor_pivot import doctor_index, doctor_sheet
+from hierarchy import OrgTree, missing_manager_rows, relabel_vacant_abms, relabel_vacant_rbms
+from waterfall import build_waterfall
+from stages import begin_run, finish_run, mark, rows_out, telemetry_dir_from_env
+
+# One JSON line per stage + a run summary when REPORT_TELEMETRY_DIR is set (see stages.py)
+TELEMETRY_DIR = telemetry_dir_from_env()
+telemetry = begin_run("lupin", TELEMETRY_DIR, enabled=bool(TELEMETRY_DIR), tenant="lupin")
+
 # ------------------------------------------------------------
 # 1️⃣ LOAD EMPLOYEE MASTER FROM FIREBASE
 # ------------------------------------------------------------
-st = storage.Client("neodocs-8d6cd")
-bucket = st.bucket("neodocs-8d6cd-utils")
-
-blob = bucket.blob("org_access_codes/lupin-hb.json")
-json_data = blob.download_as_text()
-employee_dict = json.loads(json_data)
-
-# Convert to DataFrame
-emp_df = pd.DataFrame(employee_dict).transpose().reset_index()
-emp_df.rename(columns={"index": "empId", "mr_region": "hq"}, inplace=True)
+mark("master_load")
+# GCS bucket (or a local directory with REPORT_BACKEND=local, see backends.py)
+bucket = get_bucket()
 
-# Remove Training rows
-emp_df = emp_df[emp_df['mr_name'] != "Training"]
+# None = download every run; a folder keeps the parsed master until the blob changes
+MASTER_CACHE_DIR = None
 
-# Convert region_list to comma-separated text
-if "region_list" in emp_df.columns:
-    emp_df["region_list"] = emp_df["region_list"].apply(
-        lambda x: ", ".join(x) if isinstance(x, list) else x
-    )
+emp_df = load_employee_master(bucket, "org_access_codes/lupin-hb.json", cache_dir=MASTER_CACHE_DIR)
 
-# Ensure empId is string
-emp_df["empId"] = emp_df["empId"].astype(str)
-
-print("Employee Master Loaded:", emp_df.shape)
+rows_out(len(emp_df))
 
 # ------------------------------------------------------------
 # 2️⃣ SQL SERVER — LOAD DOCTOR METRICS
 # ------------------------------------------------------------
+mark("sql_fetch")
 server = 'neodocs-sql-server.database.windows.net'
 database = 'neodocs-sql-db'
 username = 'ndDashboard'
@@ -55,7 +51,9 @@ TrustServerCertificate=no;
 Connection Timeout=30;
 """
 
-conn = pyodbc.connect(conn_str)
+# Pooled + retrying connection (transient Azure SQL errors are retried;
+# the local SQLite store with REPORT_BACKEND=local)
+conn = get_sql_manager(conn_str)
 print("Connected to SQL Server")
 
 # ------------------------------------------------------------
@@ -78,148 +76,52 @@ print("SQL Range (Current Month):", START_DATE, "to", END_DATE)
 # ------------------------------------------------------------
 # CLEAN SQL QUERY (hemaday + lupin_hb HB)
 # ------------------------------------------------------------
-query = """
-WITH test_summary AS (
-    SELECT 
-        u.empId,
-        u.docId AS [Doctor ID],
-        u.drName AS Doctor,
-        u.oId,
-        COUNT(DISTINCT u.testId) AS [Total Tests],
-        COUNT(DISTINCT CONVERT(date, u.campDate)) AS [Total Camps]
-    FROM dbo.user_tests u
-    LEFT JOIN dbo.aId a ON u.aId = a.aId
-    WHERE 
-        a.aId = '02c6bc8e-9395-4cff-80cc-af0df4f951af'
-        AND u.statusCode = 200
-        AND u.isDeleted = 0
-        AND u.campDate BETWEEN ? AND ?
-    GROUP BY u.empId, u.docId, u.drName, u.oId
-),
-
-rx_summary AS (
-    SELECT 
-        r.aId,
-        r.oId,
-        r.campDate,
-        SUM(TRY_CAST(LEFT(JSON_VALUE(r.prescriptions, '$.lupiheme'), 
-            CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.lupiheme')) - 1) AS INT)) AS [Total Rx],
-        SUM(TRY_CAST(LTRIM(RIGHT(JSON_VALUE(r.prescriptions, '$.lupiheme'), 
-            LEN(JSON_VALUE(r.prescriptions, '$.lupiheme')) - 
-            CHARINDEX('|', JSON_VALUE(r.prescriptions, '$.lupiheme')))) AS INT)) AS [Total Strips]
-    FROM dbo.rx r
-    LEFT JOIN dbo.aId a ON r.aId = a.aId
-    WHERE 
-        a.aId = '02c6bc8e-9395-4cff-80cc-af0df4f951af'
-        AND r.isDeleted = 0
-        AND r.campDate BETWEEN ? AND ?
-    GROUP BY r.aId, r.oId, r.campDate
-)
+AID = "02c6bc8e-9395-4cff-80cc-af0df4f951af"
+PRESCRIPTION_KEY = "lupiheme"
 
-SELECT 
-    t.empId AS [empId],
-    t.Doctor,
-    t.[Doctor ID],
-    t.[Total Camps] AS [Doc Total Camps],
-    ISNULL(SUM(rx.[Total Rx]), 0) AS [Total Rx],
-    ISNULL(SUM(rx.[Total Strips]), 0) AS [Total Strips],
-    t.[Total Tests]
-FROM test_summary t
-LEFT JOIN rx_summary rx
-    ON t.oId = rx.oId
-GROUP BY 
-    t.empId, t.Doctor, t.[Doctor ID], t.[Total Camps], t.[Total Tests]
-ORDER BY t.empId;
-"""
+# Month-to-date cache of per-day aggregates (None = query the full month)
+METRICS_CACHE_DIR = None          # e.g. ".metrics_cache"
+RECHECK_DAYS = 2                  # re-query this many days before the watermark
 
-params = [START_DATE, END_DATE, START_DATE, END_DATE]
-sql_df = pd.read_sql(query, conn, params=params)
+# aId + prescription key are bound as parameters (shared query builder)
+sql_df = fetch_month_to_date(
+    conn, AID, PRESCRIPTION_KEY, START_DATE, END_DATE,
+    cache_dir=METRICS_CACHE_DIR, recheck_days=RECHECK_DAYS
+)
+conn.close()
 
 print("Doctor Metrics Loaded:", sql_df.shape)
 
-# ------------------------------------------------------------
-# 3️⃣ ASSIGN DOCTOR INDEX PER empId
-# ------------------------------------------------------------
-sql_df['Doctor Index'] = sql_df.groupby(['empId']).cumcount() + 1
+rows_out(len(sql_df))
 
 # ------------------------------------------------------------
-# 4️⃣ PIVOT DOCTOR METRICS — Wide format
+# 3️⃣ ASSIGN DOCTOR INDEX PER empId
 # ------------------------------------------------------------
-pivoted = sql_df.pivot_table(
-    index=['empId'],
-    columns='Doctor Index',
-    values=['Doctor', 'Doctor ID', 'Doc Total Camps', 'Total Rx', 'Total Strips', 'Total Tests'],
-    aggfunc='first'
-)
-
-# Flatten columns
-pivoted.columns = [f"{col[0]} {int(col[1])}" for col in pivoted.columns]
-pivoted = pivoted.reset_index()
+mark("doctor_pivot", rows_in=len(sql_df))
+sql_df['Doctor Index'] = doctor_index(sql_df)
 
 # ------------------------------------------------------------
-# ADD TOTAL CAMPS COLUMN (SUM OF ALL DOC TOTAL CAMPS)
+# 4️⃣ DOCTOR SHEET LAYOUT
 # ------------------------------------------------------------
-
-# Identify all Doc Total Camps columns
-doc_camp_cols = [col for col in pivoted.columns if col.startswith("Doc Total Camps")]
-
-# Create Total Camps column
-pivoted["Total Camps"] = pivoted[doc_camp_cols].sum(axis=1)
-
-
-# ------------------------------------------------------------
-# REORDER COLUMNS WITH TOTAL CAMPS FIRST, THEN DOCTORS
-# ------------------------------------------------------------
-
-# Identify all doctor indices
-doctor_indices = sorted(
-    list({
-        int(col.split()[-1]) 
-        for col in pivoted.columns 
-        if col not in ["empId", "Total Camps"]
-    })
-)
-
-# Order template
-order_template = [
-    "Doctor",
-    "Doctor ID",
-    "Doc Total Camps",
-    "Total Tests",
-    "Total Rx",
-    "Total Strips"
-]
-
-# Start ordering
-ordered_columns = ["empId", "Total Camps"]
-
-# Append each doctor's metrics
-for idx in doctor_indices:
-    for field in order_template:
-        col_name = f"{field} {idx}"
-        if col_name in pivoted.columns:
-            ordered_columns.append(col_name)
-
-pivoted = pivoted.reindex(columns=ordered_columns)
-
+# long = one row per employee × doctor (default)
+# wide = one row per employee, six columns per doctor (doctor_pivot.py)
+DOCTOR_SHEET_LAYOUT = "long"
 
 # ------------------------------------------------------------
 # 5️⃣ JOIN WITH EMPLOYEE MASTER
 # ------------------------------------------------------------
-final_df = emp_df.merge(pivoted, on="empId", how="left")
+# sheet_df → first sheet; final_df → one row per employee
+# (Total Camps / Total Tests) for the summary sheets
+sheet_df, final_df = doctor_sheet(emp_df, sql_df, DOCTOR_SHEET_LAYOUT)
 
-# Move empId first
-cols = final_df.columns.tolist()
-cols = ['empId'] + [c for c in cols if c != "empId"]
-final_df = final_df[cols]
-
-final_df = final_df.drop(columns=["region_list"], errors="ignore")
+rows_out(len(sheet_df))
 
 # ------------------------------------------------------------
 # 6️⃣ EXPORT TO EXCEL
 # ------------------------------------------------------------
+mark("excel_write", rows_in=len(sheet_df))
 output_file = "lupin_hb_employee_doctor_report.xlsx"
-final_df.to_excel(output_file, index=False)
+sheet_df.to_excel(output_file, index=False)
 
 print("✅ Final Report Generated:", output_file)
 
@@ -235,6 +137,7 @@ print("✅ Final Report Generated:", output_file)
 # 7️⃣ CREATE SUMMARY SHEET (MR → ABM → RBM → SM)
 # CLEAN + READABLE VERSION
 # ------------------------------------------------------------
+mark("hierarchy", rows_in=len(final_df))
 
 # 1. Extract MR-level total camps
 mr_camps = final_df[["empId", "Total Camps"]].copy()
@@ -284,71 +187,12 @@ manager_df = pd.concat(manager_rows, ignore_index=True)
 summary_df = pd.concat([mr_rows, manager_df], ignore_index=True)
 
 
-all_sms = emp_df["sm_name"].dropna().unique().tolist()
-all_rbms = emp_df["rbm_name"].dropna().unique().tolist()
-all_abms = emp_df["abm_name"].dropna().unique().tolist()
-
-new_rows = []
-
-for sm in all_sms:
-    exists = ((summary_df["designation"] == "sm") & 
-              (summary_df["name"] == sm)).any()
-    if not exists:
-        new_rows.append({
-            "empId": "",
-            "name": sm,
-            "designation": "sm",
-            "mr_name": sm,
-            "abm_name": sm,
-            "rbm_name": sm,
-            "sm_name": sm,
-            "state": "",
-            "city": "",
-            "hq": "",
-            "total_camps": 0.0,
-            "expected_camps": 0.0,
-        })
-
-for rbm in all_rbms:
-    exists = ((summary_df["designation"] == "rbm") & 
-              (summary_df["name"] == rbm)).any()
-    if not exists:
-        new_rows.append({
-            "empId": "",
-            "name": rbm,
-            "designation": "rbm",
-            "mr_name": rbm,
-            "abm_name": rbm,
-            "rbm_name": rbm,
-            "sm_name": rbm,   # temporary, will get corrected later
-            "state": "",
-            "city": "",
-            "hq": "",
-            "total_camps": 0.0,
-            "expected_camps": 0.0,
-        })
-
-for abm in all_abms:
-    exists = ((summary_df["designation"] == "abm") &
-              (summary_df["name"] == abm)).any()
-    if not exists:
-        new_rows.append({
-            "empId": "",
-            "name": abm,
-            "designation": "abm",
-            "mr_name": abm,
-            "abm_name": abm,
-            "rbm_name": abm,   # temporary, corrected later
-            "sm_name": abm,    # temporary
-            "state": "",
-            "city": "",
-            "hq": "",
-            "total_camps": 0.0,
-            "expected_camps": 0.0,
-        })
-
-if new_rows:
-    summary_df = pd.concat([summary_df, pd.DataFrame(new_rows)], ignore_index=True)
+# Placeholder rows for SMs / RBMs / ABMs named in the master without a row
+# of their own (hierarchy.py)
+new_rows = missing_manager_rows(emp_df, summary_df)
+
+if len(new_rows):
+    summary_df = pd.concat([summary_df, new_rows], ignore_index=True)
 
 
 
@@ -382,103 +226,32 @@ true_mr["total_camps"] = true_mr["Total Camps"].fillna(0)
 # ------------------------------------------------------------
 # ⭐ 0) FIX ABM NAMES PER RBM BLOCK (NEW RULE)
 # ------------------------------------------------------------
-
-df = summary_df.copy()
-
-for abm, abm_group in df.groupby("abm_name", dropna=False):
-
-    # Find TRUE ABM block → where MR name matches ABM name
-    true_block = abm_group[abm_group["name"] == abm]
-
-    if true_block.empty:
-        continue  # no matching MR = skip
-
-    true_rbm = true_block.iloc[0]["rbm_name"]  # the rbm where ABM is true
-
-    # All RBMs under this ABM
-    rbm_list = abm_group["rbm_name"].fillna("").unique().tolist()
-
-    for rbm in rbm_list:
-
-        # TRUE RBM block → do nothing
-        if rbm == true_rbm:
-            continue
-
-        # Other RBM blocks → ABM becomes Vacant(RBM)
-        vacant_abm = f"Vacant ({rbm})"
-
-        mask = (df["abm_name"] == abm) & (df["rbm_name"] == rbm)
-
-        # Update ABM name
-        df.loc[mask, "abm_name"] = vacant_abm
-        
-        # Update "name" only for ABM designation row
-        df.loc[mask & (df["designation"] == "abm"), "name"] = vacant_abm
-
-summary_df = df.copy()
+# TRUE ABM block → the RBM of the first row named after the ABM;
+# other RBM blocks → ABM becomes Vacant(RBM) (hierarchy.py)
+summary_df = relabel_vacant_abms(summary_df)
 
 
 # ------------------------------------------------------------
 # ⭐ 1) FIX RBM NAMES PER SM BLOCK (Opposite Rule)
 # ------------------------------------------------------------
-
-df = summary_df.copy()
-
-for rbm, rbm_group in df.groupby("rbm_name", dropna=False):
-
-    # Identify TRUE RBM block → where the RBM row exists
-    rbm_row = rbm_group[(rbm_group["designation"] == "rbm") & 
-                        (rbm_group["name"] == rbm)]
-    
-    if rbm_row.empty:
-        continue  # No RBM row found (should not happen)
-
-    true_sm = rbm_row.iloc[0]["sm_name"]
-
-    # SMs under this RBM
-    all_sms = rbm_group["sm_name"].fillna("").unique().tolist()
-
-    for sm in all_sms:
-        # All NOT TRUE blocks should become Vacant RBMs
-        if sm != true_sm:
-            vacant_name = f"Vacant ({sm})"
-            mask = (df["rbm_name"] == rbm) & (df["sm_name"] == sm)
-            df.loc[mask, "rbm_name"] = vacant_name
-
-summary_df = df.copy()
+# TRUE RBM block → the SM of the RBM's own row;
+# all NOT TRUE blocks become Vacant(SM)
+summary_df = relabel_vacant_rbms(summary_df)
 
 
 # ------------------------------------------------------------
-# 🔄 RECOMPUTE group_maps AFTER renaming (SMALL FIX)
+# 🔄 RECOMPUTE TOTALS AFTER renaming (SMALL FIX)
 # ------------------------------------------------------------
-true_mr_after = summary_df[summary_df["designation"] == "mr"].copy()
-
-group_maps = {}
-
-for role, col in [("abm", "abm_name"), ("rbm", "rbm_name"), ("sm", "sm_name")]:
-    g = true_mr_after.groupby(col)["total_camps"].agg(["sum", "count"]).reset_index()
-    g["expected"] = g["count"] * 2
-
-    group_maps[role] = {
-        "total": dict(zip(g[col], g["sum"])),
-        "expected": dict(zip(g[col], g["expected"]))
-    }
+# ABM / RBM / SM rows (matched by name) = sum over the MRs under them:
+# total = MR camps, expected = 2 per MR (hierarchy.py)
+org_tree = OrgTree(summary_df, key="name", dropna=True)
 
 
 # ------------------------------------------------------------
 # 8️⃣ Apply the aggregated totals to summary_df
 # ------------------------------------------------------------
-for role in manager_roles:
-    mask = summary_df["designation"] == role
-    name_col = "name"
-
-    summary_df.loc[mask, "total_camps"] = (
-        summary_df.loc[mask, name_col].map(group_maps[role]["total"]).fillna(0)
-    )
-
-    summary_df.loc[mask, "expected_camps"] = (
-        summary_df.loc[mask, name_col].map(group_maps[role]["expected"]).fillna(0)
-    )
+for col in ["total_camps", "expected_camps"]:
+    summary_df[col] = org_tree.rollup(summary_df[col], chained=False)
 
 # ------------------------------------------------------------
 # 9️⃣ Execution % (safe division)
@@ -490,143 +263,16 @@ summary_df["execution_percent"] = summary_df.apply(
 ).round(0).astype(int)
 
 
+rows_out(len(summary_df))
+
 # ------------------------------------------------------------
 # ⭐ 2) BUILD WATERFALL SUMMARY (MR → ABM → RBM → SM)
 # ------------------------------------------------------------
+mark("waterfall", rows_in=len(summary_df))
 
-final_rows = []
-assigned_mr_indices = set()   # prevent MRs from being counted twice
-
-for sm, sm_group in summary_df.groupby("sm_name", dropna=False):
-
-    for rbm, rbm_group in sm_group.groupby("rbm_name", dropna=False):
-
-        rbm_str = str(rbm) if not pd.isna(rbm) else ""
-        is_vacant_rbm = rbm_str.startswith("Vacant (")
-
-        # ---------------------------------------------------------
-        # Identify REAL ABMs only (exclude Vacant(...))
-        # ---------------------------------------------------------
-        real_abm_groups = {}
-
-        for abm, abm_group in rbm_group.groupby("abm_name", dropna=False):
-
-            if isinstance(abm, str) and abm.startswith("Vacant ("):
-                continue
-
-            if abm_group[abm_group["designation"] == "abm"].shape[0] == 0:
-                continue
-
-            real_abm_groups[abm] = abm_group
-
-        # ---------------------------------------------------------
-        # 1️⃣ REAL ABM BLOCK → Add MRs + ABM row
-        # ---------------------------------------------------------
-        mrs_assigned_local = set()
-
-        for abm, abm_group in real_abm_groups.items():
-
-            mrs = abm_group[abm_group["designation"] == "mr"]
-
-            for _, row in mrs.iterrows():
-
-                if row.name not in assigned_mr_indices:
-                    final_rows.append(row)
-                    assigned_mr_indices.add(row.name)
-                    mrs_assigned_local.add(row.name)
-
-            abm_row = abm_group[abm_group["designation"] == "abm"]
-            if not abm_row.empty:
-                final_rows.append(abm_row.iloc[0])
-
-        # ---------------------------------------------------------
-        # 2️⃣ LEFTOVER MRs (not under any real ABM)
-        # ---------------------------------------------------------
-        all_mrs = rbm_group[rbm_group["designation"] == "mr"]
-        leftover_mrs = all_mrs[~all_mrs.index.isin(mrs_assigned_local)]
-
-        leftover_mrs_unassigned = leftover_mrs[~leftover_mrs.index.isin(assigned_mr_indices)]
-
-        for _, row in leftover_mrs_unassigned.iterrows():
-            final_rows.append(row)
-            assigned_mr_indices.add(row.name)
-
-        # ---------------------------------------------------------
-        # 3️⃣ VACANT ABM BLOCK
-        # ---------------------------------------------------------
-        if not leftover_mrs_unassigned.empty:
-
-            total_camps = leftover_mrs_unassigned["total_camps"].sum()
-            expected_camps = leftover_mrs_unassigned["expected_camps"].sum()
-
-            exec_percent = (
-                round((total_camps / expected_camps) * 100)
-                if expected_camps else 0
-            )
-
-            vacant_abm = {
-                "empId": "",
-                "name": f"Vacant ({rbm})",
-                "abm_name": f"Vacant ({rbm})",
-                "rbm_name": rbm,
-                "sm_name": sm,
-                "state": "",
-                "city": "",
-                "designation": "abm",
-                "hq": "",
-                "total_camps": total_camps,
-                "expected_camps": expected_camps,
-                "execution_percent": exec_percent
-            }
-
-            final_rows.append(pd.Series(vacant_abm))
-
-        # ---------------------------------------------------------
-        # 4️⃣ RBM ROW (real or synthetic)
-        # ---------------------------------------------------------
-        rbm_row = rbm_group[rbm_group["designation"] == "rbm"]
-
-        if not is_vacant_rbm:
-            if not rbm_row.empty:
-                final_rows.append(rbm_row.iloc[0])
-
-        else:
-            abm_rows = rbm_group[rbm_group["designation"] == "abm"]
-
-            total_camps = abm_rows["total_camps"].sum()
-            expected_camps = abm_rows["expected_camps"].sum()
-
-            exec_percent = (
-                round((total_camps / expected_camps) * 100)
-                if expected_camps else 0
-            )
-
-            synthetic_rbm = {
-                "empId": "",
-                "name": rbm,
-                "abm_name": rbm,
-                "rbm_name": rbm,
-                "sm_name": sm,
-                "state": "",
-                "city": "",
-                "designation": "rbm",
-                "hq": "",
-                "total_camps": total_camps,
-                "expected_camps": expected_camps,
-                "execution_percent": exec_percent
-            }
-
-            final_rows.append(pd.Series(synthetic_rbm))
-
-    # ---------------------------------------------------------
-    # 5️⃣ SM ROW
-    # ---------------------------------------------------------
-    sm_row = sm_group[sm_group["designation"] == "sm"]
-    if not sm_row.empty:
-        final_rows.append(sm_row.iloc[0])
-
-
-waterfall_df = pd.DataFrame(final_rows)
+# MRs under their ABM, "Vacant (<rbm>)" ABM rows for MRs without one,
+# synthetic rows for vacant RBMs (waterfall.py)
+waterfall_df = build_waterfall(summary_df)
 
 # ------------------------------------------------------------
 # ⭐ RECOMPUTE TOTALS AFTER CORRECT GROUPING (IMPORTANT)
@@ -635,36 +281,13 @@ waterfall_df = pd.DataFrame(final_rows)
 wf = waterfall_df.copy()
 wf["designation"] = wf["designation"].str.lower()
 
-# Only MR rows contribute to totals
-mr_only = wf[wf["designation"] == "mr"]
-
-# Recompute ABM totals
-abm_totals = mr_only.groupby("abm_name")[["total_camps", "expected_camps"]].sum()
-
-# Recompute RBM totals
-rbm_totals = mr_only.groupby("rbm_name")[["total_camps", "expected_camps"]].sum()
-
-# Recompute SM totals
-sm_totals = mr_only.groupby("sm_name")[["total_camps", "expected_camps"]].sum()
-
-def apply_totals(row):
-    n = row["name"]
+# Only MR rows contribute to totals: ABM / RBM / SM rows named after a
+# group of MRs get their sums, other rows keep their values
+wf_tree = OrgTree(wf, key="name", dropna=True)
+for col in ["total_camps", "expected_camps"]:
+    wf[col] = wf_tree.rollup(wf[col], chained=False, fill=None)
 
-    if row["designation"] == "abm" and n in abm_totals.index:
-        row["total_camps"] = abm_totals.loc[n, "total_camps"]
-        row["expected_camps"] = abm_totals.loc[n, "expected_camps"]
-
-    elif row["designation"] == "rbm" and n in rbm_totals.index:
-        row["total_camps"] = rbm_totals.loc[n, "total_camps"]
-        row["expected_camps"] = rbm_totals.loc[n, "expected_camps"]
-
-    elif row["designation"] == "sm" and n in sm_totals.index:
-        row["total_camps"] = sm_totals.loc[n, "total_camps"]
-        row["expected_camps"] = sm_totals.loc[n, "expected_camps"]
-
-    return row
-
-waterfall_df = wf.apply(apply_totals, axis=1)
+waterfall_df = wf
 
 # Execution %
 waterfall_df["execution_percent"] = waterfall_df.apply(
@@ -675,9 +298,12 @@ waterfall_df["execution_percent"] = waterfall_df.apply(
 
 
 
+rows_out(len(waterfall_df))
+
 # ------------------------------------------------------------
 # ⭐ 3) EXPORT WATERFALL SUMMARY
 # ------------------------------------------------------------
+mark("excel_write", rows_in=len(waterfall_df))
 with pd.ExcelWriter(
     "lupin_hb_employee_doctor_report.xlsx",
     engine="openpyxl",
@@ -821,6 +447,7 @@ with pd.ExcelWriter("lupin_hb_employee_doctor_report.xlsx", engine="openpyxl", m
 # ------------------------------------------------------------
 # 🔟 APPLY PROFESSIONAL EXCEL STYLING (CUSTOM COLORS)
 # ------------------------------------------------------------
+mark("styling")
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
 
@@ -903,3 +530,5 @@ for sheet_name in wb.sheetnames:
 wb.save("lupin_hb_employee_doctor_report.xlsx")
 
 print("🎨 Excel Styling Applied Successfully!")
+
+finish_run(telemetry)
@@ -0,0 +1,216 @@
+"""
+Month-to-date doctor metrics with a local per-day aggregate cache.
+
+The reports always cover the 1st of the month → today. Instead of
+re-reading the whole month every run, per-day aggregates are kept on
+disk (Parquet) per aId and month:
+
+    <cache_dir>/<aId>/<start_date>/tests.parquet   (aId, empId, doctor, oId, campDay)
+    <cache_dir>/<aId>/<start_date>/rx.parquet      (aId, oId, campDay)
+    <cache_dir>/<aId>/<start_date>/meta.json       (watermark, prescription key)
+
+A rerun only queries days after the cached watermark, plus a re-check
+window (recheck_days) for late edits/deletes, and replaces those days
+in the cache. Month totals are then rebuilt from the daily rows.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from query_log import query_context
+from sql_fetch import read_sql
+from sql_queries import (
+    METRIC_COLUMNS,
+    build_daily_rx_query,
+    build_daily_tests_query,
+    clean_aid,
+    clean_prescription_key,
+    doctor_metrics_params,
+    fetch_doctor_metrics,
+    join_rx_summary,
+    sql_dialect,
+)
+
+DEFAULT_RECHECK_DAYS = 2
+
+TEST_DAY_COLUMNS = ["aId", "empId", "Doctor", "Doctor ID", "oId", "campDay", "Total Tests"]
+RX_DAY_COLUMNS = ["aId", "oId", "campDay", "Total Rx", "Total Strips"]
+
+# The SQL only orders by aId, empId and a rollup follows the cached rows,
+# so month-to-date frames are sorted on the whole row (same frame whatever
+# the cache history, cached or not)
+ORDER_COLUMNS = ["empId", "Doctor ID", "Doctor", "Doc Total Camps", "Total Tests", "Total Rx", "Total Strips"]
+
+
+# ------------------------------------------------------------
+# CACHE FILES
+# ------------------------------------------------------------
+def _cache_paths(cache_dir, aid, start_date):
+    folder = os.path.join(cache_dir, clean_aid(aid), str(start_date))
+    return {
+        "folder": folder,
+        "tests": os.path.join(folder, "tests.parquet"),
+        "rx": os.path.join(folder, "rx.parquet"),
+        "meta": os.path.join(folder, "meta.json"),
+    }
+
+
+def _load_cache(paths, pres_key):
+    """Returns (tests_df, rx_df, watermark) or None when unusable."""
+    if not all(os.path.exists(paths[k]) for k in ("tests", "rx", "meta")):
+        return None
+
+    with open(paths["meta"]) as f:
+        meta = json.load(f)
+
+    # Prescription key changed → Rx/Strips in the cache are for another key
+    if meta.get("prescription_key", "") != pres_key:
+        return None
+
+    tests_df = pd.read_parquet(paths["tests"])
+    rx_df = pd.read_parquet(paths["rx"])
+    watermark = datetime.strptime(meta["watermark"], "%Y-%m-%d").date()
+
+    return tests_df, rx_df, watermark
+
+
+def _save_cache(paths, tests_df, rx_df, watermark, pres_key):
+    os.makedirs(paths["folder"], exist_ok=True)
+
+    tests_df.to_parquet(paths["tests"], index=False)
+    rx_df.to_parquet(paths["rx"], index=False)
+
+    # meta.json written last → a crash mid-save leaves the old watermark
+    with open(paths["meta"], "w") as f:
+        json.dump(
+            {"watermark": watermark.strftime("%Y-%m-%d"), "prescription_key": pres_key},
+            f
+        )
+
+
+# ------------------------------------------------------------
+# DAILY FETCH
+# ------------------------------------------------------------
+def _in_report_order(metrics_df):
+    return metrics_df.sort_values(ORDER_COLUMNS, kind="stable").reset_index(drop=True)
+
+
+def _as_day(values):
+    return pd.to_datetime(values).dt.normalize()
+
+
+def fetch_daily_metrics(conn, aid, prescription_key, start_date, end_date):
+    """
+    Queries per-day aggregates for [start_date, end_date].
+    Returns (tests_df, rx_df) with TEST_DAY_COLUMNS / RX_DAY_COLUMNS.
+    """
+    pres_key = clean_prescription_key(prescription_key)
+    tenants = [(aid, pres_key)]
+    params = doctor_metrics_params(tenants, start_date, end_date, with_rx=False)
+    dialect = sql_dialect(conn)
+
+    with query_context(aids=[clean_aid(aid)], start_date=start_date, end_date=end_date):
+        tests_df = read_sql(conn, build_daily_tests_query(1, dialect), params)
+
+        if pres_key:
+            rx_df = read_sql(conn, build_daily_rx_query(1, dialect), params)
+        else:
+            rx_df = pd.DataFrame(columns=RX_DAY_COLUMNS)
+
+    for frame in (tests_df, rx_df):
+        frame["aId"] = frame["aId"].astype(str).str.strip().str.lower()
+        frame["campDay"] = _as_day(frame["campDay"])
+
+    return tests_df[TEST_DAY_COLUMNS], rx_df[RX_DAY_COLUMNS]
+
+
+def rollup_daily_metrics(tests_df, rx_df):
+    """
+    Rebuilds the report metrics (METRIC_COLUMNS) from per-day rows:
+    - Total Tests = sum of daily distinct tests
+    - Total Camps = number of distinct camp days per doctor/oId
+    - Rx/Strips   = summed per oId and joined like the SQL query
+
+    Rows come out in ORDER_COLUMNS order, not in cache order.
+    """
+    keys = ["aId", "empId", "Doctor", "Doctor ID", "oId"]
+
+    test_summary = (
+        tests_df
+        .groupby(keys, dropna=False, sort=False)
+        .agg(**{
+            "Total Tests": ("Total Tests", "sum"),
+            "Total Camps": ("campDay", "nunique"),
+        })
+        .reset_index()
+    )
+
+    rx_df = rx_df.copy()
+    rx_df[["Total Rx", "Total Strips"]] = (
+        rx_df[["Total Rx", "Total Strips"]].apply(pd.to_numeric).astype("float64")
+    )
+
+    out = join_rx_summary(test_summary, rx_df)
+
+    return _in_report_order(out[METRIC_COLUMNS])
+
+
+# ------------------------------------------------------------
+# MONTH-TO-DATE WITH CACHE
+# ------------------------------------------------------------
+def fetch_month_to_date(conn, aid, prescription_key, start_date, end_date,
+                        cache_dir=None, recheck_days=DEFAULT_RECHECK_DAYS, **query_options):
+    """
+    Doctor metrics for [start_date, end_date] (strings, YYYY-MM-DD).
+
+    - cache_dir=None → plain fetch_doctor_metrics() (no cache)
+    - otherwise only days > watermark - recheck_days are queried and
+      merged into the cached per-day aggregates
+
+    query_options (rx_rollup, rx_parse) only apply to the uncached fetch;
+    the daily queries always roll rx up per (oId, day). Both paths return
+    the rows in ORDER_COLUMNS order.
+    """
+    if not cache_dir:
+        return _in_report_order(
+            fetch_doctor_metrics(conn, aid, prescription_key, start_date, end_date, **query_options)
+        )
+
+    pres_key = clean_prescription_key(prescription_key)
+    paths = _cache_paths(cache_dir, aid, start_date)
+
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+    cached = _load_cache(paths, pres_key)
+
+    if cached is None:
+        fetch_from = start
+        tests_df = pd.DataFrame(columns=TEST_DAY_COLUMNS)
+        rx_df = pd.DataFrame(columns=RX_DAY_COLUMNS)
+    else:
+        tests_df, rx_df, watermark = cached
+        fetch_from = max(start, min(watermark, end) - timedelta(days=recheck_days))
+
+    new_tests, new_rx = fetch_daily_metrics(
+        conn, aid, pres_key, fetch_from.strftime("%Y-%m-%d"), end_date
+    )
+
+    # Replace every day in the re-queried window, keep older days
+    cutoff = pd.Timestamp(fetch_from)
+    tests_df = tests_df[tests_df["campDay"] < cutoff] if not tests_df.empty else tests_df
+    rx_df = rx_df[rx_df["campDay"] < cutoff] if not rx_df.empty else rx_df
+
+    tests_df = pd.concat([tests_df, new_tests], ignore_index=True)
+    rx_df = pd.concat([rx_df, new_rx], ignore_index=True)
+
+    _save_cache(paths, tests_df, rx_df, end, pres_key)
+
+    print(
+        f"Metrics cache [{clean_aid(aid)}]: queried {fetch_from} → {end_date} "
+        f"({(end - fetch_from).days + 1} days), cached days kept: {(fetch_from - start).days}"
+    )
+
+    return rollup_daily_metrics(tests_df, rx_df)
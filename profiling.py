@@ -0,0 +1,257 @@
+"""
+On-demand cProfile of the report stages (TEST/code.py --profile).
+
+A StageProfiler is a stages.py hook: every stage opened with mark()
+runs under its own cProfile.Profile (on the stage's thread), and the
+stats are merged per tenant + stage. dump() writes:
+
+    <out_dir>/<tenant>/<stage>.pstats        python -m pstats / snakeviz
+    <out_dir>/<tenant>/<stage>.collapsed     flamegraph.pl / speedscope
+    <out_dir>/<tenant>/all.pstats            every stage of the tenant
+    <out_dir>/<tenant>/all.collapsed         stage name as the root frame
+
+The .collapsed files use the "frame;frame;frame <count>" format that
+py-spy and flamegraph tools read, with counts in microseconds.
+cProfile keeps caller → callee edges, not full stacks, so the stacks
+are rebuilt by splitting each function's time over its callers
+(exact for call trees, an approximation where functions share callees).
+Time that cannot be placed (recursion, stacks under 10µs) is listed
+under a "[partial stack]" frame so the totals still match the profile.
+
+Stages should run on one thread at a time: from Python 3.12 cProfile
+sits on sys.monitoring, which allows one active profiler per process.
+A stage that opens while another thread's stage is profiled is run
+unprofiled (TEST/code.py turns --prefetch off under --profile).
+
+Nothing is hooked unless profiling is enabled.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+from contextlib import contextmanager
+
+from stages import add_stage_hook, end_stage, remove_stage_hook
+
+DEFAULT_PROFILE_DIR = "profiles"
+DEFAULT_TOP = 15
+NO_TENANT = "run"
+
+_MIN_STACK_S = 1e-5      # stacks below 10µs are dropped from .collapsed
+_MAX_DEPTH = 200
+_PARTIAL_STACK = "[partial stack]"
+
+
+# ------------------------------------------------------------
+# STATS → HOT FUNCTIONS / COLLAPSED STACKS
+# ------------------------------------------------------------
+def _label(func):
+    file_name, line, name = func
+    if file_name == "~":
+        label = name                      # builtins: "<built-in method ...>"
+    else:
+        label = f"{name} ({os.path.basename(file_name)}:{line})"
+    return label.replace(";", ",")
+
+
+def hot_functions(stats, top=DEFAULT_TOP):
+    """Top functions by own time: [{function, calls, tottime_s, cumtime_s}]."""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [
+        {
+            "function": _label(func),
+            "calls": nc,
+            "tottime_s": round(tt, 4),
+            "cumtime_s": round(ct, 4),
+        }
+        for func, (cc, nc, tt, ct, callers) in rows
+    ]
+
+
+def collapsed_stacks(stats, root=None):
+    """{"a;b;c": microseconds of own time} rebuilt from the call graph."""
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+
+    stacks = {}
+    attributed = {}
+    prefix = [root] if root else []
+
+    def walk(func, path, share):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        path = path + [_label(func)]
+        own = tt * share
+        if own >= _MIN_STACK_S:
+            key = ";".join(path)
+            stacks[key] = stacks.get(key, 0) + own
+            attributed[func] = attributed.get(func, 0) + own
+
+        if len(path) >= _MAX_DEPTH:
+            return
+        for callee, edge_ct in callees.get(func, {}).items():
+            callee_ct = stats.stats[callee][3]
+            if callee_ct <= 0 or callee == func:
+                continue
+            child_share = share * edge_ct / callee_ct
+            if callee_ct * child_share < _MIN_STACK_S or _label(callee) in path:
+                continue
+            walk(callee, path, child_share)
+
+    roots = [
+        func for func, (cc, nc, tt, ct, callers) in stats.stats.items()
+        if not any(caller in stats.stats for caller in callers)
+    ]
+    for func in roots:
+        walk(func, prefix, 1.0)
+
+    # Time not reached from a root (recursion, pruned stacks) is kept under
+    # one frame so the file still adds up to the profiled time
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        rest = tt - attributed.get(func, 0)
+        if rest >= _MIN_STACK_S:
+            key = ";".join(prefix + [_PARTIAL_STACK, _label(func)])
+            stacks[key] = stacks.get(key, 0) + rest
+
+    return {stack: int(round(seconds * 1e6)) for stack, seconds in stacks.items() if seconds * 1e6 >= 1}
+
+
+def write_collapsed(stacks, path):
+    with open(path, "w") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+# ------------------------------------------------------------
+# STAGE HOOK
+# ------------------------------------------------------------
+def _safe_name(name):
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("_") or NO_TENANT
+
+
+class StageProfiler:
+    """cProfile per stage, merged per (tenant, stage) until dump()."""
+
+    def __init__(self, out_dir, top=DEFAULT_TOP):
+        self.out_dir = out_dir
+        self.top = top
+        self.summary = {}       # tenant → {"dir", "stages", "hot"}
+        self._stats = {}        # (tenant, stage) → pstats.Stats
+        self._lock = threading.Lock()
+
+    # stages.py hook -------------------------------------------------
+    def start(self, stage):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # "Another profiling tool is already active" (Python 3.12+)
+            return None
+        return profile
+
+    def stop(self, profile):
+        if profile is not None:
+            profile.disable()
+
+    def finish(self, profile, record):
+        if profile is None:
+            return
+        key = (record.get("tenant", NO_TENANT), record["stage"])
+        with self._lock:
+            if key in self._stats:
+                self._stats[key].add(profile)
+            else:
+                self._stats[key] = pstats.Stats(profile)
+
+    # output ---------------------------------------------------------
+    def dump(self):
+        """
+        Writes the stats collected since the last dump and returns
+        {tenant: {"dir", "stages", "hot"}} for them (also kept in .summary).
+        """
+        with self._lock:
+            collected, self._stats = self._stats, {}
+
+        by_tenant = {}
+        for (tenant, stage), stats in collected.items():
+            by_tenant.setdefault(tenant, {})[stage] = stats
+
+        dumped = {}
+        for tenant, stages in by_tenant.items():
+            tenant_dir = os.path.join(self.out_dir, _safe_name(tenant))
+            os.makedirs(tenant_dir, exist_ok=True)
+
+            total = None
+            all_stacks = {}
+            for stage, stats in stages.items():
+                base = os.path.join(tenant_dir, _safe_name(stage))
+                stats.dump_stats(base + ".pstats")
+                write_collapsed(collapsed_stacks(stats), base + ".collapsed")
+                all_stacks.update(collapsed_stacks(stats, root=stage))
+
+                if total is None:
+                    total = pstats.Stats(base + ".pstats")
+                else:
+                    total.add(base + ".pstats")
+
+            total.dump_stats(os.path.join(tenant_dir, "all.pstats"))
+            write_collapsed(all_stacks, os.path.join(tenant_dir, "all.collapsed"))
+
+            dumped[tenant] = {
+                "dir": tenant_dir,
+                "stages": sorted(stages),
+                "hot": hot_functions(total, self.top),
+            }
+
+        self.add_summary(dumped)
+        return dumped
+
+    def add_summary(self, dumped):
+        """Merges a dump() result (e.g. from a worker process)."""
+        with self._lock:
+            self.summary.update(dumped)
+
+    def hot_summary(self):
+        """{tenant: hot functions} for the run telemetry summary."""
+        return {tenant: info["hot"] for tenant, info in self.summary.items()}
+
+    def write_summary(self):
+        path = os.path.join(self.out_dir, "summary.json")
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.summary, f, indent=2)
+        return path
+
+
+def print_hot_functions(summary, top=10):
+    for tenant, info in summary.items():
+        print(f"\n🔥 {tenant}: top functions by own time ({info['dir']})")
+        for row in info["hot"][:top]:
+            print(f"   {row['tottime_s']:9.4f}s own {row['cumtime_s']:9.4f}s cum "
+                  f"{row['calls']:>9} calls  {row['function']}")
+
+
+@contextmanager
+def profile_stages(out_dir, top=DEFAULT_TOP, enabled=True):
+    """
+    Profiles every stage while active; on exit writes the files, the
+    summary.json and prints the hot functions. Yields None when not enabled.
+    """
+    if not enabled:
+        yield None
+        return
+
+    profiler = StageProfiler(out_dir, top)
+    add_stage_hook(profiler)
+    try:
+        yield profiler
+    finally:
+        end_stage()
+        remove_stage_hook(profiler)
+        profiler.dump()
+        if profiler.summary:
+            print_hot_functions(profiler.summary)
+            print(f"\n📊 Profiles written to {profiler.write_summary()}")
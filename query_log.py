@@ -0,0 +1,360 @@
+"""
+Slow-query log for the SQL layer.
+
+Every query run through sql_fetch is timed from execute until its
+cursor is closed (all rows fetched). Queries slower than the threshold
+are appended to a local JSON-lines log with:
+
+- a fingerprint of the normalized query text (literals → ?, VALUES /
+  IN lists collapsed), so the same query shape groups together
+  whatever the tenant count or values
+- the aId(s) and date range (from query_context(), set by the callers
+  in sql_queries / metrics_cache)
+- rows, seconds and, with capture_statistics, the SET STATISTICS IO, TIME
+  messages of the query (logical / physical reads per table, CPU and
+  elapsed ms)
+
+Statistics are only available on SQL Server (pyodbc connections). They
+cost a round trip and server work per query, so by default they are only
+turned on for query shapes already known to be slow (slower than the
+threshold earlier in this process, or listed in the log by an earlier
+run); "all" runs every query with them. They are turned off again before
+the connection goes back to the pool.
+
+    REPORT_SLOW_QUERY_LOG=slow_queries.jsonl   # "" / off disables the log
+    REPORT_SLOW_QUERY_SECONDS=30
+    REPORT_SQL_STATISTICS=1                    # or "all"
+
+    python query_log.py slow_queries.jsonl     # per fingerprint / tenant summary
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+LOG_ENV = "REPORT_SLOW_QUERY_LOG"
+SECONDS_ENV = "REPORT_SLOW_QUERY_SECONDS"
+STATISTICS_ENV = "REPORT_SQL_STATISTICS"
+
+DEFAULT_LOG = "slow_queries.jsonl"
+DEFAULT_SLOW_SECONDS = 30.0
+
+_OFF = {"", "0", "off", "false", "no", "none"}
+
+_lock = threading.Lock()
+_local = threading.local()
+_config = {}
+_totals = {}        # fingerprint → {"count", "seconds", "max_seconds", "rows"}
+_logged = {}        # log path → fingerprints found in it
+
+
+# ------------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------------
+def _from_env():
+    log = os.environ.get(LOG_ENV, DEFAULT_LOG)
+    return {
+        "log_path": None if log.strip().lower() in _OFF else log,
+        "slow_seconds": float(os.environ.get(SECONDS_ENV, DEFAULT_SLOW_SECONDS)),
+        "capture_statistics": _statistics_mode(os.environ.get(STATISTICS_ENV, "")),
+    }
+
+
+def _statistics_mode(value):
+    """False, "slow" (known slow query shapes) or "all"."""
+    text = str(value).strip().lower()
+    if text in _OFF:
+        return False
+    return "all" if text == "all" else "slow"
+
+
+def config():
+    """Current settings (environment defaults until configure() is called)."""
+    if not _config:
+        _config.update(_from_env())
+    return dict(_config)
+
+
+def configure(log_path=None, slow_seconds=None, capture_statistics=None):
+    """
+    Overrides settings for this process; None keeps the current value
+    (log_path="" turns the log off). configure(**config()) copies the
+    settings into a worker process.
+    """
+    current = config()
+    if capture_statistics is not None:
+        capture_statistics = _statistics_mode(capture_statistics)
+    updates = {"log_path": log_path, "slow_seconds": slow_seconds,
+               "capture_statistics": capture_statistics}
+    current.update({k: v for k, v in updates.items() if v is not None})
+    _config.update(current)
+
+
+# ------------------------------------------------------------
+# FINGERPRINT
+# ------------------------------------------------------------
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_TUPLE = r"\(\s*\?(?:\s*,\s*\?)*\s*\)"
+_VALUES = re.compile(rf"\b(values\s*)({_TUPLE})(?:\s*,\s*{_TUPLE})*")
+_IN_LIST = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Lower-case query without comments / literals, one space between tokens."""
+    text = _COMMENTS.sub(" ", query)
+    text = _STRINGS.sub("?", text)
+    text = _NUMBERS.sub("?", text)
+    text = _SPACES.sub(" ", text).strip().lower()
+    # VALUES (?, ?), (?, ?), ... / IN (?, ?, ...) → same text whatever the count
+    text = _VALUES.sub(r"\1\2, ...", text)
+    return _IN_LIST.sub("in (?, ...)", text)
+
+
+def fingerprint_query(query):
+    return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()[:12]
+
+
+# ------------------------------------------------------------
+# QUERY CONTEXT (aId / date range for the log)
+# ------------------------------------------------------------
+def _context():
+    return getattr(_local, "context", {})
+
+
+@contextmanager
+def query_context(**fields):
+    """Fields logged with every slow query run on this thread."""
+    previous = _context()
+    _local.context = {**previous, **fields}
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+# ------------------------------------------------------------
+# SQL SERVER STATISTICS
+# ------------------------------------------------------------
+_TABLE_IO = re.compile(
+    r"Table '([^']+)'\. Scan count (\d+), logical reads (\d+), physical reads (\d+)"
+)
+_TIMES = re.compile(r"CPU time = (\d+) ms,\s+elapsed time = (\d+) ms")
+
+
+def supports_statistics(conn):
+    """SET STATISTICS needs SQL Server (a pyodbc connection)."""
+    return type(conn).__module__.split(".")[0] == "pyodbc"
+
+
+def enable_statistics(cursor):
+    cursor.execute("SET STATISTICS IO, TIME ON")
+
+
+def disable_statistics(cursor):
+    """Back to the session default before the connection is reused."""
+    try:
+        cursor.execute("SET STATISTICS IO, TIME OFF")
+    except Exception:
+        # A broken connection is dropped by the pool's health check anyway
+        pass
+
+
+def _logged_fingerprints(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {json.loads(line).get("fingerprint") for line in f if line.strip()}
+
+
+def _known_slow(fingerprint, settings):
+    """Slow earlier in this process or logged as slow by an earlier run."""
+    with _lock:
+        t = _totals.get(fingerprint)
+        if t and t["max_seconds"] >= settings["slow_seconds"]:
+            return True
+        path = settings["log_path"]
+        if not path:
+            return False
+        if path not in _logged:
+            _logged[path] = _logged_fingerprints(path)
+        return fingerprint in _logged[path]
+
+
+def collect_messages(cursor):
+    """Info messages of the current and remaining result sets (pyodbc)."""
+    messages = list(getattr(cursor, "messages", None) or [])
+    try:
+        while cursor.nextset():
+            messages.extend(getattr(cursor, "messages", None) or [])
+    except Exception:
+        pass
+    return [str(text) for _, text in messages]
+
+
+def parse_statistics(messages):
+    """STATISTICS IO / TIME messages → {tables, cpu_ms, elapsed_ms}."""
+    tables = {}
+    cpu_ms = elapsed_ms = 0
+    for message in messages:
+        for name, scans, logical, physical in _TABLE_IO.findall(message):
+            t = tables.setdefault(name, {"scan_count": 0, "logical_reads": 0, "physical_reads": 0})
+            t["scan_count"] += int(scans)
+            t["logical_reads"] += int(logical)
+            t["physical_reads"] += int(physical)
+        for cpu, elapsed in _TIMES.findall(message):
+            cpu_ms += int(cpu)
+            elapsed_ms += int(elapsed)
+
+    return {
+        "tables": tables,
+        "logical_reads": sum(t["logical_reads"] for t in tables.values()),
+        "cpu_ms": cpu_ms,
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+# ------------------------------------------------------------
+# TIMING
+# ------------------------------------------------------------
+class QueryTiming:
+    """One running query: rows are counted by the fetch loop."""
+
+    def __init__(self, conn, query):
+        settings = config()
+        self.query = query
+        self.fingerprint = fingerprint_query(query)
+        self.rows = 0
+        self.messages = None
+        self.capture = (
+            bool(settings["capture_statistics"])
+            and supports_statistics(conn)
+            and (settings["capture_statistics"] == "all" or _known_slow(self.fingerprint, settings))
+        )
+        self.started = time.perf_counter()
+
+    def add_rows(self, count):
+        self.rows += count
+
+    def finish(self, cursor):
+        """Called once all rows are read (picks up the statistics messages)."""
+        if self.capture:
+            self.messages = collect_messages(cursor)
+
+
+def _record(timing, seconds, error):
+    settings = config()
+    fingerprint = timing.fingerprint
+
+    with _lock:
+        t = _totals.setdefault(fingerprint, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0})
+        t["count"] += 1
+        t["seconds"] += seconds
+        t["max_seconds"] = max(t["max_seconds"], seconds)
+        t["rows"] += timing.rows
+
+    if not settings["log_path"] or seconds < settings["slow_seconds"]:
+        return
+
+    entry = {
+        "logged": datetime.now().isoformat(timespec="seconds"),
+        "fingerprint": fingerprint,
+        "seconds": round(seconds, 3),
+        "rows": timing.rows,
+        "threshold_s": settings["slow_seconds"],
+        **_context(),
+        "error": error,
+        "pid": os.getpid(),
+        "query": normalize_query(timing.query)[:500],
+    }
+    if timing.messages is not None:
+        entry["statistics"] = parse_statistics(timing.messages)
+        entry["messages"] = timing.messages[:50]
+
+    line = json.dumps(entry, default=str) + "\n"
+    with _lock:
+        folder = os.path.dirname(settings["log_path"])
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(settings["log_path"], "a") as f:
+            f.write(line)
+
+    print(f"🐢 Slow query {fingerprint}: {seconds:.1f}s, {timing.rows} rows "
+          f"(logged to {settings['log_path']})")
+
+
+@contextmanager
+def timed_query(conn, query):
+    """Times the block (execute → cursor closed) and logs it when slow."""
+    timing = QueryTiming(conn, query)
+    error = None
+    try:
+        yield timing
+    except GeneratorExit:
+        error = "stream closed early"
+        raise
+    except BaseException as exc:
+        error = repr(exc)
+        raise
+    finally:
+        _record(timing, time.perf_counter() - timing.started, error)
+
+
+def query_totals():
+    """{fingerprint: {count, seconds, max_seconds, rows}} for every query in this process."""
+    with _lock:
+        return {k: dict(v) for k, v in _totals.items()}
+
+
+# ------------------------------------------------------------
+# LOG SUMMARY
+# ------------------------------------------------------------
+def read_log(path):
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarize_log(log_df):
+    """Slow queries per fingerprint + aId: count, median / max seconds, reads."""
+    df = log_df.copy()
+    if "aids" in df.columns:
+        df["aId"] = df["aids"].apply(lambda a: ", ".join(a) if isinstance(a, list) else a)
+    else:
+        df["aId"] = None
+    df["logical_reads"] = df["statistics"].apply(
+        lambda s: s.get("logical_reads") if isinstance(s, dict) else None
+    ) if "statistics" in df.columns else None
+
+    return (
+        df.groupby(["fingerprint", "aId"], dropna=False)
+        .agg(count=("seconds", "size"), median_s=("seconds", "median"), max_s=("seconds", "max"),
+             rows=("rows", "max"), logical_reads=("logical_reads", "max"), last=("logged", "max"))
+        .reset_index()
+        .sort_values("max_s", ascending=False)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the slow-query log")
+    parser.add_argument("log", nargs="?", default=DEFAULT_LOG)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.log):
+        print(f"No slow-query log at {args.log}")
+        return 0
+
+    print(summarize_log(read_log(args.log)).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,183 @@
+"""
+Shared SQL connection manager.
+
+- a small pool of connections per worker process (threads borrow one each)
+- idle connections are health-checked (SELECT 1) before they are reused
+- transient ODBC / Azure SQL errors are retried at the query level with
+  exponential backoff on a fresh connection
+- every query runs with a query timeout, so one slow tenant cannot hang
+  the whole batch
+
+The manager is passed around where a pyodbc connection used to be:
+sql_fetch.read_sql() detects it and runs the query through run().
+"""
+import queue
+import random
+import time
+from contextlib import contextmanager
+
+try:
+    import pyodbc
+except ImportError:  # pragma: no cover - depends on the environment
+    pyodbc = None
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_QUERY_TIMEOUT = 600       # seconds per query (0 = no timeout)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 2.0             # seconds, doubled on every retry
+DEFAULT_HEALTH_CHECK_AFTER = 30   # seconds idle before a SELECT 1 check
+
+# Connection-level SQLSTATEs worth a retry. HYT00 (query timeout) is NOT
+# retried on purpose: a slow tenant should fail fast, not run 3 times.
+TRANSIENT_SQLSTATES = {"08S01", "08001", "08003", "08004", "08007", "40001"}
+
+# Azure SQL / TCP error numbers that show up in pyodbc messages as "(n)"
+TRANSIENT_ERROR_NUMBERS = {
+    233, 4060, 4221, 10053, 10054, 10060, 10928, 10929,
+    40143, 40197, 40501, 40540, 40613, 49918, 49919, 49920,
+}
+
+
+def is_transient_error(exc):
+    """True for disconnects / throttling errors that are safe to retry."""
+    if pyodbc is None or not isinstance(exc, pyodbc.Error):
+        return False
+
+    sqlstate = str(exc.args[0]) if exc.args else ""
+    if sqlstate in TRANSIENT_SQLSTATES:
+        return True
+
+    message = " ".join(str(a) for a in exc.args)
+    return any(f"({num})" in message for num in TRANSIENT_ERROR_NUMBERS)
+
+
+class SqlConnectionManager:
+    """
+    Pooled, health-checked, retrying connections for one worker process.
+
+    connect is an optional zero-argument factory (defaults to
+    pyodbc.connect(conn_str)); it lets other drivers reuse the pool.
+    dialect tells the query builders which SQL flavour to emit
+    (sql_queries.SQL_DIALECTS).
+    """
+
+    def __init__(self, conn_str=None, pool_size=DEFAULT_POOL_SIZE,
+                 query_timeout=DEFAULT_QUERY_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, health_check_after=DEFAULT_HEALTH_CHECK_AFTER,
+                 connect=None, dialect="mssql"):
+        if connect is None:
+            if pyodbc is None:
+                raise ImportError("pyodbc is required for SqlConnectionManager(conn_str)")
+            connect = lambda: pyodbc.connect(conn_str)
+
+        self._connect = connect
+        self.dialect = dialect
+        self.pool_size = pool_size
+        self.query_timeout = query_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.health_check_after = health_check_after
+
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._closed = False
+
+        # Open one connection up front so a bad config fails immediately
+        self._release(self._new_connection())
+
+    # --------------------------------------------------------
+    # POOL
+    # --------------------------------------------------------
+    def _new_connection(self):
+        conn = self._connect()
+        if self.query_timeout and hasattr(conn, "timeout"):
+            conn.timeout = self.query_timeout
+        return conn
+
+    @staticmethod
+    def _safe_close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _acquire(self):
+        try:
+            conn, last_used = self._pool.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+        idle = time.monotonic() - last_used
+        if idle > self.health_check_after and not self._is_healthy(conn):
+            self._safe_close(conn)
+            return self._new_connection()
+
+        return conn
+
+    def _release(self, conn, broken=False):
+        if broken or self._closed:
+            self._safe_close(conn)
+            return
+        try:
+            self._pool.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            self._safe_close(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a pooled connection (no retry)."""
+        conn = self._acquire()
+        broken = False
+        if timeout is not None and hasattr(conn, "timeout"):
+            conn.timeout = timeout
+        try:
+            yield conn
+        except Exception as exc:
+            broken = is_transient_error(exc)
+            raise
+        finally:
+            if timeout is not None and hasattr(conn, "timeout"):
+                conn.timeout = self.query_timeout or 0
+            self._release(conn, broken=broken)
+
+    # --------------------------------------------------------
+    # QUERY LEVEL RETRY
+    # --------------------------------------------------------
+    def run(self, fn, timeout=None):
+        """
+        Calls fn(connection) with a pooled connection.
+
+        Transient errors are retried (up to self.retries times) with
+        exponential backoff + jitter on a fresh connection; any other
+        error, including a query timeout, is raised straight away.
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.connection(timeout=timeout) as conn:
+                    return fn(conn)
+            except Exception as exc:
+                if not is_transient_error(exc) or attempt >= self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (1 + random.random() * 0.25)
+                attempt += 1
+                print(f"⚠️ Transient SQL error, retry {attempt}/{self.retries} in {delay:.1f}s: {exc}")
+                time.sleep(delay)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            self._safe_close(conn)
@@ -0,0 +1,144 @@
+"""
+Streamed, chunked SQL fetch.
+
+pd.read_sql() pulls the whole result through pyodbc as Python row objects
+before building the DataFrame, so peak memory is several times the final
+frame. Here rows are read with cursor.fetchmany() in bounded batches and
+each batch is turned straight into typed Arrow columns; only one batch of
+Python objects is alive at a time.
+
+- iter_arrow_batches() → generator of pyarrow.Table chunks
+- iter_query_chunks()  → generator of pandas DataFrame chunks
+- read_sql()           → one assembled DataFrame (drop-in for pd.read_sql)
+
+pyarrow is optional: without it chunks are built with
+DataFrame.from_records() and concatenated at the end.
+
+conn may be a raw DBAPI connection or a sql_conn.SqlConnectionManager;
+with a manager, read_sql() runs through manager.run() (pooled connection,
+query timeout, transient-error retry) and the generators borrow a pooled
+connection for the duration of the stream.
+
+Every query is timed until its cursor is closed; slow ones go to the
+slow-query log (query_log.py).
+"""
+from contextlib import contextmanager
+
+import pandas as pd
+
+from query_log import disable_statistics, enable_statistics, timed_query
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = None
+
+DEFAULT_CHUNK_ROWS = 50_000
+
+
+def _is_manager(conn):
+    return hasattr(conn, "run") and hasattr(conn, "connection")
+
+
+@contextmanager
+def _execute(conn, query, params):
+    """
+    (cursor, columns, timing) for query; the cursor is closed on exit and
+    the query is timed until then (query_log: slow-query log).
+    """
+    with timed_query(conn, query) as timing:
+        cursor = conn.cursor()
+        try:
+            if timing.capture:
+                enable_statistics(cursor)
+            cursor.execute(query, list(params or []))
+            columns = [col[0] for col in cursor.description]
+            yield cursor, columns, timing
+            timing.finish(cursor)
+        finally:
+            # SET STATISTICS sticks to the session: pooled connections are reused
+            if timing.capture:
+                disable_statistics(cursor)
+            cursor.close()
+
+
+def _rows_to_arrow(rows, columns):
+    """Row tuples → pyarrow.Table (one typed array per column)."""
+    if rows:
+        arrays = [pa.array(list(col), from_pandas=True) for col in zip(*rows)]
+    else:
+        arrays = [pa.array([], type=pa.null()) for _ in columns]
+    return pa.Table.from_arrays(arrays, names=columns)
+
+
+def iter_arrow_batches(conn, query, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yields pyarrow.Table chunks of at most chunk_rows rows."""
+    if pa is None:
+        raise ImportError("pyarrow is required for iter_arrow_batches()")
+
+    if _is_manager(conn):
+        with conn.connection() as raw:
+            yield from iter_arrow_batches(raw, query, params, chunk_rows)
+        return
+
+    with _execute(conn, query, params) as (cursor, columns, timing):
+        yielded = False
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            timing.add_rows(len(rows))
+            yield _rows_to_arrow(rows, columns)
+            yielded = True
+
+        if not yielded:
+            # Keep the column names for empty results
+            yield _rows_to_arrow([], columns)
+
+
+def iter_query_chunks(conn, query, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yields pandas DataFrame chunks of at most chunk_rows rows."""
+    if _is_manager(conn):
+        with conn.connection() as raw:
+            yield from iter_query_chunks(raw, query, params, chunk_rows)
+        return
+
+    if pa is not None:
+        for table in iter_arrow_batches(conn, query, params, chunk_rows):
+            yield table.to_pandas()
+        return
+
+    with _execute(conn, query, params) as (cursor, columns, timing):
+        yielded = False
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            timing.add_rows(len(rows))
+            yield pd.DataFrame.from_records([tuple(r) for r in rows], columns=columns)
+            yielded = True
+
+        if not yielded:
+            yield pd.DataFrame(columns=columns)
+
+
+def read_sql(conn, query, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Assembled DataFrame for query (same role as pd.read_sql).
+
+    With pyarrow the chunks stay columnar until the very end and are
+    converted with self_destruct, so Arrow buffers are released while
+    the pandas frame is being built.
+    """
+    if _is_manager(conn):
+        return conn.run(lambda raw: read_sql(raw, query, params, chunk_rows))
+
+    if pa is None:
+        chunks = list(iter_query_chunks(conn, query, params, chunk_rows))
+        return pd.concat(chunks, ignore_index=True)
+
+    tables = list(iter_arrow_batches(conn, query, params, chunk_rows))
+    table = pa.concat_tables(tables, promote_options="permissive")
+    del tables
+
+    return table.to_pandas(self_destruct=True, split_blocks=True)
@@ -0,0 +1,587 @@
+"""
+Doctor-metrics SQL shared by the pharma report scripts.
+
+The per-pharma scripts all run the same test_summary / rx_summary query,
+only the aId and the prescription key change. This module builds that
+query for one or many tenants and splits a multi-tenant result back into
+the per-pharma frames the report code expects.
+"""
+import math
+
+import pandas as pd
+
+from query_log import query_context
+from sql_fetch import read_sql
+
+
+# Columns returned for every tenant (same order as the original query)
+METRIC_COLUMNS = [
+    "empId",
+    "Doctor",
+    "Doctor ID",
+    "Doc Total Camps",
+    "Total Rx",
+    "Total Strips",
+    "Total Tests",
+]
+
+
+# ------------------------------------------------------------
+# HELPERS
+# ------------------------------------------------------------
+def clean_prescription_key(prescription_key):
+    """Returns the prescription key as a stripped string ("" when missing)."""
+    if prescription_key is None:
+        return ""
+    if isinstance(prescription_key, float) and math.isnan(prescription_key):
+        return ""
+    return str(prescription_key).strip()
+
+
+def clean_aid(aid):
+    """Normalised aId used to match result rows back to tenants."""
+    return str(aid).strip().lower()
+
+
+def sql_dialect(conn):
+    """SQL dialect of a connection / manager ("mssql" unless it says otherwise)."""
+    return getattr(conn, "dialect", "mssql")
+
+
+# ------------------------------------------------------------
+# QUERY BUILDER
+# ------------------------------------------------------------
+# aId and prescription key are NEVER formatted into the text: they are
+# bound as ? parameters through the tenants CTE, so SQL Server sees one
+# statement text per (tenant count, with/without Rx) shape and reuses
+# the cached plan across pharmas and runs. The aId is cast to VARCHAR so
+# pyodbc's NVARCHAR binding never forces an implicit convert on the
+# indexed column.
+#
+# Every builder takes dialect="mssql" (Azure SQL) or "sqlite" (offline
+# store in backends.py). Only the few expressions below differ; the
+# sqlite connection registers JSON_VALUE, CONCAT and TRY_CAST_INT.
+SQL_DIALECTS = ["mssql", "sqlite"]
+
+_ISNULL = {
+    "mssql": "ISNULL",
+    "sqlite": "IFNULL",   # ISNULL is an operator keyword in SQLite
+}
+
+_CAMP_DAY = {
+    "mssql": "CONVERT(date, {col})",
+    "sqlite": "date({col})",
+}
+
+_RX_PART = {
+    "mssql": (
+        "TRY_CAST(LEFT({v},\n                CHARINDEX('|', {v}) - 1) AS INT)",
+        "TRY_CAST(LTRIM(RIGHT({v},\n                LEN({v}) -\n                CHARINDEX('|', {v}))) AS INT)",
+    ),
+    "sqlite": (
+        "TRY_CAST_INT(SUBSTR({v}, 1,\n                INSTR({v}, '|') - 1))",
+        "TRY_CAST_INT(LTRIM(SUBSTR({v},\n                INSTR({v}, '|') + 1)))",
+    ),
+}
+
+
+def _check_dialect(dialect):
+    if dialect not in SQL_DIALECTS:
+        raise ValueError(f"Unknown SQL dialect {dialect!r} (expected one of {SQL_DIALECTS})")
+
+
+def _camp_day(col, dialect):
+    return _CAMP_DAY[dialect].format(col=col)
+
+
+TEST_SUMMARY_CTE = """
+    test_summary AS (
+        SELECT
+            u.aId,
+            u.empId,
+            u.docId AS [Doctor ID],
+            u.drName AS Doctor,
+            u.oId,
+            COUNT(DISTINCT u.testId) AS [Total Tests],
+            COUNT(DISTINCT {camp_day}) AS [Total Camps]
+        FROM dbo.user_tests u
+        JOIN dbo.aId a ON u.aId = a.aId
+        JOIN tenants k ON a.aId = k.aId
+        WHERE
+            u.statusCode = 200
+            AND u.isDeleted = 0
+            AND u.campDate BETWEEN ? AND ?
+        GROUP BY u.aId, u.empId, u.docId, u.drName, u.oId
+    )"""
+
+
+def _test_summary_cte(dialect="mssql"):
+    return TEST_SUMMARY_CTE.replace("{camp_day}", _camp_day("u.campDate", dialect))
+
+
+RX_VALUE = "JSON_VALUE(r.prescriptions, CONCAT('$.', k.presKey))"
+
+# rx_summary rollups:
+#   "oid"  → ONE row per (aId, oId) before the join. test_summary is already
+#            one row per (doctor, oId), so the LEFT JOIN is 1:1 and the outer
+#            SUM does not fan out over camp dates.
+#   "camp" → original query, one row per (aId, oId, campDate). Kept to
+#            cross-check totals with compare_rx_rollups().
+#   "day"  → one row per (aId, oId, calendar day); used by the
+#            month-to-date cache (metrics_cache.py), not by the report query.
+RX_ROLLUPS = {
+    "oid": ("r.aId, r.oId", "r.aId,\n            r.oId"),
+    "camp": ("r.aId, r.oId, r.campDate", "r.aId,\n            r.oId,\n            r.campDate"),
+    "day": (
+        "r.aId, r.oId, {camp_day}",
+        "r.aId,\n            r.oId,\n            {camp_day} AS campDay"
+    ),
+}
+REPORT_RX_ROLLUPS = ["camp", "oid"]
+
+
+def _rx_summary_cte(rx_rollup, dialect="mssql"):
+    if rx_rollup not in RX_ROLLUPS:
+        raise ValueError(f"Unknown rx_rollup {rx_rollup!r} (expected one of {sorted(RX_ROLLUPS)})")
+
+    camp_day = _camp_day("r.campDate", dialect)
+    group_cols, select_cols = (
+        cols.replace("{camp_day}", camp_day) for cols in RX_ROLLUPS[rx_rollup]
+    )
+    rx_part, strips_part = (part.format(v=RX_VALUE) for part in _RX_PART[dialect])
+
+    return f"""
+    rx_summary AS (
+        SELECT
+            {select_cols},
+            SUM({rx_part}) AS [Total Rx],
+            SUM({strips_part}) AS [Total Strips]
+        FROM dbo.rx r
+        JOIN dbo.aId a ON r.aId = a.aId
+        JOIN tenants k ON a.aId = k.aId
+        WHERE
+            k.presKey IS NOT NULL
+            AND r.isDeleted = 0
+            AND r.campDate BETWEEN ? AND ?
+        GROUP BY {group_cols}
+    )"""
+
+
+def _tenants_cte(tenant_count, dialect="mssql"):
+    values = ",\n            ".join(["(?, ?)"] * tenant_count)
+
+    if dialect == "sqlite":
+        # No column list on a derived table: VALUES columns are column1, column2
+        return f"""
+    tenants AS (
+        SELECT
+            CAST(v.column1 AS VARCHAR(64)) AS aId,
+            CAST(v.column2 AS NVARCHAR(128)) AS presKey
+        FROM (VALUES
+            {values}
+        ) AS v
+    )"""
+
+    return f"""
+    tenants AS (
+        SELECT
+            CAST(v.aId AS VARCHAR(64)) AS aId,
+            CAST(v.presKey AS NVARCHAR(128)) AS presKey
+        FROM (VALUES
+            {values}
+        ) AS v(aId, presKey)
+    )"""
+
+
+def build_doctor_metrics_query(tenant_count=1, with_rx=True, rx_rollup="oid", dialect="mssql"):
+    """
+    Returns the doctor-metrics statement text for tenant_count tenants.
+
+    - with_rx=True  → Rx & Strips parsed from dbo.rx prescriptions
+    - with_rx=False → Rx & Strips = 0 (no prescription key)
+    - rx_rollup     → "oid" (pre-aggregated per oId) or "camp" (original)
+    - dialect       → "mssql" or "sqlite" (offline store)
+
+    The text only depends on these arguments, never on the aId or
+    prescription key. Bind values with doctor_metrics_params().
+    """
+    if tenant_count < 1:
+        raise ValueError("build_doctor_metrics_query needs at least one tenant")
+    _check_dialect(dialect)
+
+    if with_rx:
+        ctes = [
+            _tenants_cte(tenant_count, dialect),
+            _test_summary_cte(dialect),
+            _rx_summary_cte(rx_rollup, dialect),
+        ]
+        isnull = _ISNULL[dialect]
+        query = "WITH" + ",\n".join(ctes) + f"""
+
+    SELECT
+        t.aId,
+        t.empId AS [empId],
+        t.Doctor,
+        t.[Doctor ID],
+        t.[Total Camps] AS [Doc Total Camps],
+        {isnull}(SUM(rx.[Total Rx]), 0) AS [Total Rx],
+        {isnull}(SUM(rx.[Total Strips]), 0) AS [Total Strips],
+        t.[Total Tests]
+    FROM test_summary t
+    LEFT JOIN rx_summary rx
+        ON t.aId = rx.aId
+        AND t.oId = rx.oId
+    GROUP BY
+        t.aId, t.empId, t.Doctor, t.[Doctor ID], t.[Total Camps], t.[Total Tests]
+    ORDER BY t.aId, t.empId;
+    """
+    else:
+        ctes = [_tenants_cte(tenant_count, dialect), _test_summary_cte(dialect)]
+        query = "WITH" + ",\n".join(ctes) + """
+
+    SELECT
+        t.aId,
+        t.empId AS [empId],
+        t.Doctor,
+        t.[Doctor ID],
+        t.[Total Camps] AS [Doc Total Camps],
+        0 AS [Total Rx],
+        0 AS [Total Strips],
+        t.[Total Tests]
+    FROM test_summary t
+    ORDER BY t.aId, t.empId;
+    """
+
+    return query
+
+
+def doctor_metrics_params(tenants, start_date, end_date, with_rx=True):
+    """
+    Parameter list matching build_doctor_metrics_query(len(tenants), with_rx).
+    tenants is a list of (aid, prescription_key).
+    """
+    params = []
+    for aid, pres_key in tenants:
+        pres_key = clean_prescription_key(pres_key)
+        params.extend([clean_aid(aid), pres_key or None])
+
+    params.extend([start_date, end_date])
+    if with_rx:
+        params.extend([start_date, end_date])
+
+    return params
+
+
+def split_by_tenant(batch_df, aids):
+    """
+    Splits a multi-tenant result into {aid: sql_df}.
+
+    Every requested aid gets a frame (empty if it had no tests) with the
+    same columns and row order the single-tenant query returned.
+    """
+    frames = {}
+    grouped = batch_df.groupby("aId", sort=False)
+    present = set(grouped.groups)
+
+    for aid in aids:
+        aid = clean_aid(aid)
+        if aid in present:
+            part = grouped.get_group(aid)[METRIC_COLUMNS]
+        else:
+            part = batch_df.iloc[0:0][METRIC_COLUMNS]
+        frames[aid] = part.reset_index(drop=True)
+
+    return frames
+
+
+# ------------------------------------------------------------
+# CLIENT-SIDE RX PARSING
+# ------------------------------------------------------------
+# rx_parse="client" keeps the string work off the shared SQL server:
+#   - test_summary is fetched on its own (no rx join)
+#   - dbo.rx is read with ONE JSON_VALUE per row (CROSS APPLY) and only
+#     grouped by the raw "rx|strips" value, so identical payloads come
+#     back once with a row count
+#   - the "rx|strips" split, TRY_CAST and the oId join run in pandas
+RX_PARSE_MODES = ["server", "client"]
+
+
+def build_test_summary_query(tenant_count=1, dialect="mssql"):
+    """test_summary only (one row per aId, doctor, oId)."""
+    _check_dialect(dialect)
+    return "WITH" + ",\n".join([_tenants_cte(tenant_count, dialect), _test_summary_cte(dialect)]) + """
+
+    SELECT
+        t.aId,
+        t.empId,
+        t.Doctor,
+        t.[Doctor ID],
+        t.oId,
+        t.[Total Camps],
+        t.[Total Tests]
+    FROM test_summary t;
+    """
+
+
+def build_rx_values_query(tenant_count=1, dialect="mssql"):
+    """Raw prescription values per (aId, oId), JSON parsed once per row."""
+    _check_dialect(dialect)
+
+    if dialect == "sqlite":
+        # No CROSS APPLY: the value is computed once in the select list
+        # and grouped by its alias
+        return "WITH" + _tenants_cte(tenant_count, dialect) + f"""
+
+    SELECT
+        r.aId,
+        r.oId,
+        {RX_VALUE} AS rxValue,
+        COUNT(*) AS rxRows
+    FROM dbo.rx r
+    JOIN dbo.aId a ON r.aId = a.aId
+    JOIN tenants k ON a.aId = k.aId
+    WHERE
+        k.presKey IS NOT NULL
+        AND r.isDeleted = 0
+        AND r.campDate BETWEEN ? AND ?
+    GROUP BY r.aId, r.oId, rxValue;
+    """
+
+    return "WITH" + _tenants_cte(tenant_count) + f"""
+
+    SELECT
+        r.aId,
+        r.oId,
+        p.rxValue,
+        COUNT(*) AS rxRows
+    FROM dbo.rx r
+    JOIN dbo.aId a ON r.aId = a.aId
+    JOIN tenants k ON a.aId = k.aId
+    CROSS APPLY (SELECT {RX_VALUE} AS rxValue) p
+    WHERE
+        k.presKey IS NOT NULL
+        AND r.isDeleted = 0
+        AND r.campDate BETWEEN ? AND ?
+    GROUP BY r.aId, r.oId, p.rxValue;
+    """
+
+
+def build_daily_tests_query(tenant_count=1, dialect="mssql"):
+    """Per-day test counts: one row per (aId, doctor, oId, campDay)."""
+    _check_dialect(dialect)
+    camp_day = _camp_day("u.campDate", dialect)
+
+    return "WITH" + _tenants_cte(tenant_count, dialect) + f"""
+
+    SELECT
+        u.aId,
+        u.empId,
+        u.drName AS Doctor,
+        u.docId AS [Doctor ID],
+        u.oId,
+        {camp_day} AS campDay,
+        COUNT(DISTINCT u.testId) AS [Total Tests]
+    FROM dbo.user_tests u
+    JOIN dbo.aId a ON u.aId = a.aId
+    JOIN tenants k ON a.aId = k.aId
+    WHERE
+        u.statusCode = 200
+        AND u.isDeleted = 0
+        AND u.campDate BETWEEN ? AND ?
+    GROUP BY u.aId, u.empId, u.docId, u.drName, u.oId, {camp_day};
+    """
+
+
+def build_daily_rx_query(tenant_count=1, dialect="mssql"):
+    """Per-day Rx/Strips: one row per (aId, oId, campDay)."""
+    _check_dialect(dialect)
+    ctes = [_tenants_cte(tenant_count, dialect), _rx_summary_cte("day", dialect)]
+
+    return "WITH" + ",\n".join(ctes) + """
+
+    SELECT * FROM rx_summary;
+    """
+
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def _to_int(values):
+    """TRY_CAST(x AS INT) for a string Series (not an INT32 → <NA>)."""
+    values = values.str.strip()
+    values = values.where(values.str.fullmatch(r"[+-]?\d+", na=False))
+    # float64 is exact over the INT32 range; longer digit runs only need to fail the range check
+    numbers = pd.to_numeric(values, errors="coerce").astype("float64")
+    numbers = numbers.where((numbers >= INT32_MIN) & (numbers <= INT32_MAX))
+    return numbers.astype("Int64")
+
+
+def parse_rx_payload(values):
+    """
+    Splits "rx|strips" strings into two Int64 Series (Total Rx, Total Strips).
+
+    Same rules as the server-side LEFT/RIGHT/CHARINDEX (SUBSTR/INSTR)
+    expression: rx is the text before the first "|" (<NA> without one),
+    strips the text after it — the whole value when there is no "|" —
+    and anything that is not an INT32 becomes <NA>.
+    """
+    values = values.astype("string")
+    parts = values.str.split("|", n=1, expand=True)
+
+    for col in (0, 1):
+        if col not in parts.columns:
+            parts[col] = pd.Series(pd.NA, index=values.index, dtype="string")
+
+    has_sep = values.str.contains("|", regex=False, na=False)
+
+    rx = _to_int(parts[0].where(has_sep).astype("string"))
+    strips = _to_int(parts[1].astype("string").where(has_sep, values))
+
+    return rx, strips
+
+
+def combine_client_rx(tests_df, rx_values_df):
+    """
+    Joins client-parsed Rx/Strips onto test_summary and rebuilds the
+    same output as the server-side query (aId + METRIC_COLUMNS).
+    """
+    rx_values_df = rx_values_df.copy()
+    rx, strips = parse_rx_payload(rx_values_df["rxValue"])
+    rx_values_df["Total Rx"] = rx * rx_values_df["rxRows"]
+    rx_values_df["Total Strips"] = strips * rx_values_df["rxRows"]
+
+    return join_rx_summary(tests_df, rx_values_df)
+
+
+def join_rx_summary(tests_df, rx_df):
+    """
+    pandas version of the final SELECT: rolls rx_df up per (aId, oId),
+    LEFT JOINs it to test_summary rows and sums per doctor row.
+
+    tests_df: aId, empId, Doctor, Doctor ID, oId, Total Camps, Total Tests
+    rx_df:    aId, oId, Total Rx, Total Strips (any granularity)
+    """
+    rx_summary = (
+        rx_df
+        .groupby(["aId", "oId"], dropna=False)[["Total Rx", "Total Strips"]]
+        .sum()
+        .reset_index()
+    )
+
+    joined = tests_df.merge(rx_summary, on=["aId", "oId"], how="left")
+    joined[["Total Rx", "Total Strips"]] = joined[["Total Rx", "Total Strips"]].fillna(0)
+
+    out = (
+        joined
+        .groupby(
+            ["aId", "empId", "Doctor", "Doctor ID", "Total Camps", "Total Tests"],
+            dropna=False, sort=False
+        )[["Total Rx", "Total Strips"]]
+        .sum()
+        .reset_index()
+        .rename(columns={"Total Camps": "Doc Total Camps"})
+    )
+
+    out[["Total Rx", "Total Strips"]] = out[["Total Rx", "Total Strips"]].astype("int64")
+    out = out.sort_values(["aId", "empId"], kind="stable").reset_index(drop=True)
+
+    return out[["aId"] + METRIC_COLUMNS]
+
+
+# ------------------------------------------------------------
+# FETCH
+# ------------------------------------------------------------
+def _read_metrics(conn, tenants, start_date, end_date, rx_rollup, rx_parse):
+    """Returns the multi-tenant frame (aId + METRIC_COLUMNS)."""
+    if rx_parse not in RX_PARSE_MODES:
+        raise ValueError(f"Unknown rx_parse {rx_parse!r} (expected one of {RX_PARSE_MODES})")
+
+    with_rx = any(clean_prescription_key(key) for _, key in tenants)
+    dialect = sql_dialect(conn)
+
+    # aId + date range for the slow-query log
+    with query_context(aids=[clean_aid(aid) for aid, _ in tenants],
+                       start_date=start_date, end_date=end_date):
+        return _read_metrics_frame(conn, tenants, start_date, end_date,
+                                   rx_rollup, rx_parse, with_rx, dialect)
+
+
+def _read_metrics_frame(conn, tenants, start_date, end_date, rx_rollup, rx_parse, with_rx, dialect):
+    if rx_parse == "client" and with_rx:
+        tenant_params = doctor_metrics_params(tenants, start_date, end_date, with_rx=False)
+
+        tests_df = read_sql(conn, build_test_summary_query(len(tenants), dialect), tenant_params)
+        rx_values_df = read_sql(conn, build_rx_values_query(len(tenants), dialect), tenant_params)
+
+        for frame in (tests_df, rx_values_df):
+            frame["aId"] = frame["aId"].astype(str).str.strip().str.lower()
+
+        return combine_client_rx(tests_df, rx_values_df)
+
+    query = build_doctor_metrics_query(len(tenants), with_rx=with_rx, rx_rollup=rx_rollup, dialect=dialect)
+    params = doctor_metrics_params(tenants, start_date, end_date, with_rx=with_rx)
+
+    metrics_df = read_sql(conn, query, params)
+    metrics_df["aId"] = metrics_df["aId"].astype(str).str.strip().str.lower()
+
+    return metrics_df
+
+
+def fetch_doctor_metrics(conn, aid, prescription_key, start_date, end_date,
+                         rx_rollup="oid", rx_parse="server"):
+    """
+    Runs the parameterized doctor-metrics query for ONE pharma.
+    Returns the same columns the old hard-coded per-script query did.
+    """
+    metrics_df = _read_metrics(
+        conn, [(aid, prescription_key)], start_date, end_date, rx_rollup, rx_parse
+    )
+
+    return metrics_df[METRIC_COLUMNS].reset_index(drop=True)
+
+
+def fetch_batch_doctor_metrics(conn, tenants, start_date, end_date,
+                               rx_rollup="oid", rx_parse="server"):
+    """
+    Runs the multi-tenant query once and returns {aid: sql_df}.
+    tenants is a list of (aid, prescription_key).
+    """
+    batch_df = _read_metrics(conn, tenants, start_date, end_date, rx_rollup, rx_parse)
+
+    return split_by_tenant(batch_df, [aid for aid, _ in tenants])
+
+
+# ------------------------------------------------------------
+# ROLLUP CROSS-CHECK
+# ------------------------------------------------------------
+def compare_rx_rollups(conn, aid, prescription_key, start_date, end_date):
+    """
+    Runs the query with the "camp" (original) and "oid" rx rollups and
+    compares Rx / Strips per doctor row.
+
+    Returns (ok, diff_df) where diff_df holds the mismatching rows.
+    """
+    keys = ["empId", "Doctor", "Doctor ID", "Doc Total Camps", "Total Tests"]
+    values = ["Total Rx", "Total Strips"]
+
+    camp_df = fetch_doctor_metrics(conn, aid, prescription_key, start_date, end_date, rx_rollup="camp")
+    oid_df = fetch_doctor_metrics(conn, aid, prescription_key, start_date, end_date, rx_rollup="oid")
+
+    merged = camp_df.merge(
+        oid_df, on=keys, how="outer", suffixes=(" (camp)", " (oid)"), indicator=True
+    )
+
+    mismatch = merged["_merge"] != "both"
+    for col in values:
+        mismatch |= merged[f"{col} (camp)"].fillna(0) != merged[f"{col} (oid)"].fillna(0)
+
+    diff_df = merged[mismatch].drop(columns="_merge")
+
+    print(
+        f"Rx rollup check [{clean_aid(aid)}]: "
+        f"camp Rx={camp_df['Total Rx'].sum()} Strips={camp_df['Total Strips'].sum()} | "
+        f"oid Rx={oid_df['Total Rx'].sum()} Strips={oid_df['Total Strips'].sum()} | "
+        f"mismatching rows={len(diff_df)}"
+    )
+
+    return diff_df.empty, diff_df
@@ -0,0 +1,374 @@
+"""
+Per-stage timing and run telemetry for the report flow.
+
+Report code marks where each stage starts:
+
+    mark("doctor_pivot", rows_in=len(sql_df))
+    ...
+    rows_out(len(pivoted))
+    mark("excel_write")
+    ...
+    end_stage()
+
+mark() closes the stage that is open on the current thread and opens
+the next one, so long report functions and scripts are split without
+re-indenting them. Nothing is measured unless a sink is active, so the
+marks cost one attribute lookup in normal runs.
+
+- record_stages()  → collect stage records in a list (benchmarks)
+- run_telemetry()  → one JSON log line per stage + a per-run summary
+  begin_run()        file (begin_run / finish_run in the flat scripts,
+  finish_run()       enabled by REPORT_TELEMETRY_DIR)
+- stage_context()  → tenant / aId added to every record on this thread
+
+Each record has wall / CPU seconds, peak RSS during the stage, row
+counts when given and, with trace_memory, the tracemalloc peak.
+tracemalloc and the RSS peak are process-wide: stages running at the
+same time on other threads share them.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not on Windows
+    resource = None
+
+TELEMETRY_ENV = "REPORT_TELEMETRY_DIR"
+
+_sinks = []
+_hooks = []
+_trace_memory = [0]
+_lock = threading.Lock()
+_local = threading.local()
+
+_CLEAR_REFS = "/proc/self/clear_refs"
+_STATUS = "/proc/self/status"
+
+
+# ------------------------------------------------------------
+# PEAK RSS
+# ------------------------------------------------------------
+def _reset_peak_rss():
+    """Resets the kernel's peak RSS (VmHWM); False where unsupported."""
+    try:
+        with open(_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS in MB; None where neither /proc nor resource is available."""
+    try:
+        with open(_STATUS) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is KB on Linux (process lifetime peak, not per stage)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ------------------------------------------------------------
+# CONTEXT (tenant, aId, ... added to every record)
+# ------------------------------------------------------------
+def _context():
+    return getattr(_local, "context", {})
+
+
+@contextmanager
+def stage_context(**fields):
+    previous = _context()
+    _local.context = {**previous, **fields}
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+def with_context(fields, fn, *args, **kwargs):
+    """fn(*args, **kwargs) inside stage_context(**fields) (for thread pools)."""
+    with stage_context(**fields):
+        return fn(*args, **kwargs)
+
+
+# ------------------------------------------------------------
+# MARKS
+# ------------------------------------------------------------
+def mark(name, rows_in=None, **fields):
+    """Closes the open stage on this thread (if any) and opens name."""
+    end_stage()
+    if not _sinks and not _hooks:
+        return
+
+    if _trace_memory[0] and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    _local.stage = {
+        "stage": name,
+        "thread": threading.current_thread().name,
+        "started": time.perf_counter(),
+        "cpu_started": time.thread_time(),
+        "peak_reset": _reset_peak_rss(),
+        "rows_in": rows_in,
+        "rows_out": None,
+        **_context(),
+        **fields,
+    }
+    # Hooks start last and stop first: a profiler sees only the stage body
+    _local.hook_tokens = [(hook, hook.start(_local.stage)) for hook in list(_hooks)]
+
+
+def rows_out(count):
+    """Output row count of the stage open on this thread."""
+    current = getattr(_local, "stage", None)
+    if current is not None:
+        current["rows_out"] = count
+
+
+def end_stage():
+    """Closes the open stage on this thread."""
+    current = getattr(_local, "stage", None)
+    if current is None:
+        return
+    _local.stage = None
+
+    tokens, _local.hook_tokens = getattr(_local, "hook_tokens", []), []
+    for hook, token in reversed(tokens):
+        hook.stop(token)
+
+    record = {
+        "stage": current.pop("stage"),
+        "wall_s": time.perf_counter() - current.pop("started"),
+        "cpu_s": time.thread_time() - current.pop("cpu_started"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    record["peak_rss_per_stage"] = current.pop("peak_reset")
+    if _trace_memory[0] and tracemalloc.is_tracing():
+        record["py_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    record.update(current)
+    for hook, token in tokens:
+        hook.finish(token, record)
+
+    with _lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        sink(record)
+
+
+def add_sink(sink):
+    with _lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    with _lock:
+        _sinks.remove(sink)
+
+
+def add_stage_hook(hook):
+    """
+    hook.start(stage) → token when a stage opens (on the stage's thread),
+    hook.stop(token) first thing when it closes, then
+    hook.finish(token, record) before the record goes to the sinks.
+    """
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_stage_hook(hook):
+    with _lock:
+        _hooks.remove(hook)
+
+
+def clear_sinks():
+    """Drops sinks and hooks inherited from the parent (forked worker processes)."""
+    with _lock:
+        _sinks.clear()
+        _hooks.clear()
+        _trace_memory[0] = 0
+
+
+@contextmanager
+def record_stages():
+    """Collects stage records from every thread while active."""
+    records = []
+    add_sink(records.append)
+    try:
+        yield records
+    finally:
+        end_stage()
+        remove_sink(records.append)
+
+
+def stage_totals(records):
+    """{stage: {wall_s, cpu_s, peak_rss_mb[, py_peak_mb], count}} (times summed, peaks = max)."""
+    totals = {}
+    for r in records:
+        t = totals.setdefault(r["stage"], {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0, "count": 0})
+        t["wall_s"] += r["wall_s"]
+        t["cpu_s"] += r["cpu_s"]
+        if r["peak_rss_mb"] is not None:
+            t["peak_rss_mb"] = max(t["peak_rss_mb"], r["peak_rss_mb"])
+        if r.get("py_peak_mb") is not None:
+            t["py_peak_mb"] = max(t.get("py_peak_mb", 0.0), r["py_peak_mb"])
+        t["count"] += 1
+    return totals
+
+
+# ------------------------------------------------------------
+# RUN TELEMETRY
+# ------------------------------------------------------------
+def _round_floats(record):
+    return {k: round(v, 4) if isinstance(v, float) else v for k, v in record.items()}
+
+
+def json_line_sink(run_id, stream=None):
+    """Sink that writes one JSON line per finished stage."""
+    def emit(record):
+        line = json.dumps({"event": "stage", "run_id": run_id, **_round_floats(record)}, default=str)
+        print(line, file=stream or sys.stdout, flush=True)
+    return emit
+
+
+def start_memory_tracing():
+    """tracemalloc on while at least one telemetry run wants it."""
+    with _lock:
+        _trace_memory[0] += 1
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def stop_memory_tracing():
+    with _lock:
+        _trace_memory[0] -= 1
+        last = _trace_memory[0] == 0
+    if last and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def telemetry_dir_from_env():
+    return os.environ.get(TELEMETRY_ENV) or None
+
+
+class RunTelemetry:
+    """Stage records of one run + the summary written at the end."""
+
+    def __init__(self, name, out_dir=None, collect=True, trace_memory=True):
+        self.name = name
+        self.out_dir = out_dir
+        self.collect = collect
+        self.trace_memory = trace_memory
+        self.run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.emit = json_line_sink(self.run_id)
+        self.started = time.time()
+        self.records = []
+        self.extra = {}
+        self.previous_context = {}
+
+    def add_records(self, records):
+        """Records collected elsewhere (e.g. returned by a worker process)."""
+        with _lock:
+            self.records.extend(records)
+
+    def summary(self, top=10):
+        tenants = {}
+        for r in self.records:
+            tenants.setdefault(r.get("tenant", self.name), []).append(r)
+
+        slowest = sorted(self.records, key=lambda r: r["wall_s"], reverse=True)[:top]
+
+        return {
+            "run_id": self.run_id,
+            "name": self.name,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "wall_s": round(time.time() - self.started, 3),
+            "tenants": {
+                tenant: {
+                    "stage_wall_s": round(sum(r["wall_s"] for r in recs), 4),
+                    "stages": {k: _round_floats(v) for k, v in stage_totals(recs).items()},
+                }
+                for tenant, recs in tenants.items()
+            },
+            "slowest_stages": [
+                {"tenant": r.get("tenant", self.name), "stage": r["stage"], "wall_s": round(r["wall_s"], 4)}
+                for r in slowest
+            ],
+            **self.extra,
+        }
+
+    def write_summary(self):
+        """<out_dir>/run-<name>-<run_id>.json → path (None without out_dir)."""
+        if not self.out_dir:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"run-{self.name}-{self.run_id}.json")
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2, default=str)
+        return path
+
+
+def begin_run(name, out_dir=None, trace_memory=True, collect=True, enabled=True, **context):
+    """
+    Starts run telemetry: a JSON line per stage from now on, context
+    fields (tenant, aid, ...) on this thread's records. Returns the
+    RunTelemetry for finish_run(), or None when not enabled.
+    For flat scripts; code wrapped in a function uses run_telemetry().
+    """
+    if not enabled:
+        return None
+
+    telemetry = RunTelemetry(name, out_dir, collect, trace_memory)
+    telemetry.previous_context = _context()
+    _local.context = {**telemetry.previous_context, **context}
+
+    add_sink(telemetry.emit)
+    if collect:
+        add_sink(telemetry.records.append)
+    if trace_memory:
+        start_memory_tracing()
+    return telemetry
+
+
+def finish_run(telemetry):
+    """Closes the open stage and writes the run summary (no-op for None)."""
+    if telemetry is None:
+        return None
+
+    end_stage()
+    remove_sink(telemetry.emit)
+    if telemetry.collect:
+        remove_sink(telemetry.records.append)
+    if telemetry.trace_memory:
+        stop_memory_tracing()
+    _local.context = telemetry.previous_context
+
+    path = telemetry.write_summary()
+    if path:
+        print(f"📈 Run telemetry written to {path}")
+    return path
+
+
+@contextmanager
+def run_telemetry(name, out_dir=None, trace_memory=True, collect=True, enabled=True, **context):
+    """begin_run() / finish_run() as a context manager (yields None when not enabled)."""
+    telemetry = begin_run(name, out_dir, trace_memory, collect, enabled, **context)
+    try:
+        yield telemetry
+    finally:
+        finish_run(telemetry)
@@ -0,0 +1,309 @@
+"""
+Synthetic tenants for scale testing, written straight into the offline
+backend (backends.py):
+
+- employee masters: SM → RBM → ABM → MR trees with vacant positions,
+  ABMs whose MRs sit under several RBMs, "Training" rows and
+  region_list lists → <dir>/bucket/org_access_codes/<tenant>.json
+- matching dbo.user_tests / dbo.rx rows (prescriptions JSON with
+  "rx|strips" strings, a few malformed) → <dir>/dbo.sqlite
+- <dir>/Pharma_list.xlsx listing every tenant
+
+Tenant sizes follow a power law (--skew), so one run covers a big
+pharma and a long tail of small ones:
+
+    python synth_org.py --out .local_backend --tenants 5 --mrs 2000 --skew 1.0
+    cd .local_backend && REPORT_BACKEND=local REPORT_LOCAL_DIR=. python ../TEST/code.py
+"""
+import argparse
+import json
+import os
+import random
+import uuid
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from backends import LocalBucket, create_local_store, write_table
+
+DEFAULT_TENANTS = 3
+DEFAULT_MRS = 200                 # MRs in the largest tenant
+DEFAULT_SKEW = 1.0                # tenant i gets mrs / (i + 1) ** skew MRs
+DEFAULT_MRS_PER_ABM = 6
+DEFAULT_ABMS_PER_RBM = 4
+DEFAULT_RBMS_PER_SM = 4
+DEFAULT_DOCTORS_PER_MR = 8
+DEFAULT_TESTS_PER_DOCTOR = 12     # mean per month, long-tailed per doctor
+DEFAULT_VACANCY_RATE = 0.1        # manager positions without an employee record
+DEFAULT_CROSS_RBM_RATE = 0.05     # MRs listed under another RBM than their ABM's
+DEFAULT_TRAINING_ROWS = 3
+DEFAULT_RX_RATE = 0.7             # camps with a prescriptions row
+DEFAULT_BAD_RX_RATE = 0.02        # malformed "rx|strips" values
+
+STATES = {
+    "Maharashtra": ["Mumbai", "Pune", "Nagpur", "Nashik"],
+    "Gujarat": ["Ahmedabad", "Surat", "Vadodara"],
+    "Karnataka": ["Bengaluru", "Mysuru", "Hubballi"],
+    "Tamil Nadu": ["Chennai", "Coimbatore", "Madurai"],
+    "Uttar Pradesh": ["Lucknow", "Kanpur", "Varanasi", "Agra"],
+    "West Bengal": ["Kolkata", "Siliguri"],
+}
+
+
+# ------------------------------------------------------------
+# EMPLOYEE MASTER
+# ------------------------------------------------------------
+def _person(name, designation, abm, rbm, sm, state, city, regions):
+    return {
+        "mr_name": name,
+        "mr_designation": designation,
+        "abm_name": abm,
+        "rbm_name": rbm,
+        "sm_name": sm,
+        "state": state,
+        "city": city,
+        "mr_region": f"{city} HQ",
+        "region_list": regions,
+    }
+
+
+def generate_master(rng, n_mrs, mrs_per_abm=DEFAULT_MRS_PER_ABM,
+                    abms_per_rbm=DEFAULT_ABMS_PER_RBM, rbms_per_sm=DEFAULT_RBMS_PER_SM,
+                    vacancy_rate=DEFAULT_VACANCY_RATE, cross_rbm_rate=DEFAULT_CROSS_RBM_RATE,
+                    training_rows=DEFAULT_TRAINING_ROWS):
+    """
+    Returns (employee_dict, mr_ids) for a tenant with n_mrs MRs.
+    Vacant managers are still named by their reports but have no record.
+    """
+    n_abms = max(1, -(-n_mrs // mrs_per_abm))
+    n_rbms = max(1, -(-n_abms // abms_per_rbm))
+    n_sms = max(1, -(-n_rbms // rbms_per_sm))
+
+    master = {}
+    emp_no = 0
+
+    def add(record):
+        nonlocal emp_no
+        emp_no += 1
+        master[f"E{emp_no:07d}"] = record
+        return f"E{emp_no:07d}"
+
+    def vacant():
+        return rng.random() < vacancy_rate
+
+    state_names = list(STATES)
+
+    sms = [f"SM {i + 1}" for i in range(n_sms)]
+    rbms = [(f"RBM {i + 1}", sms[i // rbms_per_sm]) for i in range(n_rbms)]
+    abms = [(f"ABM {i + 1}",) + rbms[i // abms_per_rbm] for i in range(n_abms)]
+
+    for i, sm in enumerate(sms):
+        state = state_names[i % len(state_names)]
+        add(_person(sm, "sm", "", "", sm, state, STATES[state][0], [state]))
+
+    for rbm, sm in rbms:
+        if not vacant():
+            state = rng.choice(state_names)
+            add(_person(rbm, "rbm", "", rbm, sm, state, STATES[state][0], [state]))
+
+    for abm, rbm, sm in abms:
+        if not vacant():
+            state = rng.choice(state_names)
+            add(_person(abm, "abm", abm, rbm, sm, state, rng.choice(STATES[state]), [state]))
+
+    mr_ids = []
+    for i in range(n_mrs):
+        abm, rbm, sm = abms[i // mrs_per_abm]
+
+        # Same ABM, but listed under another RBM (ABM covers two RBM blocks)
+        if len(rbms) > 1 and rng.random() < cross_rbm_rate:
+            rbm, sm = rng.choice([r for r in rbms if r[0] != rbm])
+
+        state = rng.choice(state_names)
+        city = rng.choice(STATES[state])
+        regions = rng.sample(STATES[state], k=rng.randint(0, len(STATES[state])))
+        mr_ids.append(add(_person(f"MR {i + 1}", "mr", abm, rbm, sm, state, city, regions)))
+
+    for i in range(training_rows):
+        add(_person("Training", "mr", "", "", "", "", "", []))
+
+    # Master keys are not sorted by role in the real files
+    keys = list(master)
+    rng.shuffle(keys)
+    return {k: master[k] for k in keys}, mr_ids
+
+
+# ------------------------------------------------------------
+# CAMP ACTIVITY (dbo.user_tests, dbo.rx)
+# ------------------------------------------------------------
+def generate_activity(np_rng, aid, pres_key, mr_ids, start, end,
+                      doctors_per_mr=DEFAULT_DOCTORS_PER_MR,
+                      tests_per_doctor=DEFAULT_TESTS_PER_DOCTOR,
+                      rx_rate=DEFAULT_RX_RATE, bad_rx_rate=DEFAULT_BAD_RX_RATE):
+    """
+    user_tests and rx frames for one tenant between start and end (dates).
+    Doctors per MR are Poisson, tests per doctor long-tailed (lognormal).
+    """
+    n_days = (end - start).days + 1
+
+    doctors_per = np.maximum(np_rng.poisson(doctors_per_mr, len(mr_ids)), 1)
+    doc_emp = np.repeat(np.asarray(mr_ids, dtype=object), doctors_per)
+    n_docs = len(doc_emp)
+    doc_no = np.arange(n_docs)
+
+    prefix = aid[:8]
+    doc_id = np.char.add(f"{prefix}-D", doc_no.astype(str)).astype(object)
+    doc_name = np.char.add("Dr ", doc_no.astype(str)).astype(object)
+    # ~5% of doctors share an organisation (oId) with the previous doctor
+    org_no = np.where(np_rng.random(n_docs) < 0.05, np.maximum(doc_no - 1, 0), doc_no)
+    doc_oid = np.char.add(f"{prefix}-O", org_no.astype(str)).astype(object)
+
+    weights = np_rng.lognormal(mean=0.0, sigma=1.0, size=n_docs)
+    tests_per = np_rng.poisson(tests_per_doctor * weights / weights.mean())
+    test_doc = np.repeat(doc_no, tests_per)
+    n_tests = len(test_doc)
+
+    # A doctor's tests cluster on a few camp days
+    camp_days = np_rng.integers(0, n_days, size=(n_docs, 3))
+    test_day = camp_days[test_doc, np_rng.integers(0, 3, n_tests)]
+    test_time = pd.to_timedelta(np_rng.integers(9 * 3600, 19 * 3600, n_tests), unit="s")
+    camp_date = pd.Timestamp(start) + pd.to_timedelta(test_day, unit="D") + test_time
+
+    tests_df = pd.DataFrame({
+        "testId": np.char.add(f"{prefix}-T", np.arange(n_tests).astype(str)).astype(object),
+        "aId": aid,
+        "empId": doc_emp[test_doc],
+        "docId": doc_id[test_doc],
+        "drName": doc_name[test_doc],
+        "oId": doc_oid[test_doc],
+        "campDate": camp_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "statusCode": np.where(np_rng.random(n_tests) < 0.95, 200, 500),
+        "isDeleted": (np_rng.random(n_tests) < 0.02).astype(int),
+    })
+
+    # One rx row per camp (oId, day) for a share of camps
+    camps = tests_df[["oId"]].assign(campDate=tests_df["campDate"].str[:10] + " 12:00:00")
+    camps = camps.drop_duplicates(ignore_index=True)
+    camps = camps[np_rng.random(len(camps)) < rx_rate].reset_index(drop=True)
+
+    rx = np_rng.integers(0, 20, len(camps))
+    strips = np_rng.integers(0, 10, len(camps))
+    payload = pd.Series(rx.astype(str)).str.cat(pd.Series(strips.astype(str)), sep="|")
+    bad = np_rng.random(len(camps)) < bad_rx_rate
+    payload[bad] = np_rng.choice(["x|2", "3", "|", "4|y"], int(bad.sum()))
+
+    key = pres_key or "rx"
+    rx_df = pd.DataFrame({
+        "aId": aid,
+        "oId": camps["oId"],
+        "campDate": camps["campDate"],
+        "isDeleted": (np_rng.random(len(camps)) < 0.02).astype(int),
+        "prescriptions": [json.dumps({key: p, "other": "1|1"}) for p in payload],
+    })
+
+    return tests_df, rx_df
+
+
+# ------------------------------------------------------------
+# WRITE TO THE OFFLINE BACKEND
+# ------------------------------------------------------------
+def tenant_sizes(tenants, mrs, skew):
+    return [max(1, int(round(mrs / (i + 1) ** skew))) for i in range(tenants)]
+
+
+def generate(out, tenants=DEFAULT_TENANTS, mrs=DEFAULT_MRS, skew=DEFAULT_SKEW,
+             start=None, end=None, seed=7, no_key_every=0, **shape):
+    """
+    Writes tenants into the local backend at out and returns the
+    Pharma_list frame. shape takes the generate_master /
+    generate_activity options (mrs_per_abm, doctors_per_mr, ...).
+    """
+    end = end or date.today()
+    start = start or end.replace(day=1)
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+
+    master_opts = {k: v for k, v in shape.items() if k in {
+        "mrs_per_abm", "abms_per_rbm", "rbms_per_sm",
+        "vacancy_rate", "cross_rbm_rate", "training_rows",
+    }}
+    activity_opts = {k: v for k, v in shape.items() if k in {
+        "doctors_per_mr", "tests_per_doctor", "rx_rate", "bad_rx_rate",
+    }}
+
+    paths = create_local_store(out)
+    bucket = LocalBucket(paths["bucket"])
+    pharma_rows = []
+
+    for i, n_mrs in enumerate(tenant_sizes(tenants, mrs, skew)):
+        name = f"synth{i + 1:02d}"
+        aid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        pres_key = "" if no_key_every and (i + 1) % no_key_every == 0 else name
+        json_file = f"org_access_codes/{name}.json"
+
+        master, mr_ids = generate_master(rng, n_mrs, **master_opts)
+        bucket.blob(json_file).upload_from_string(json.dumps(master))
+
+        tests_df, rx_df = generate_activity(np_rng, aid, pres_key, mr_ids, start, end, **activity_opts)
+
+        write_table(paths["sqlite"], "aId", pd.DataFrame({"aId": [aid]}))
+        write_table(paths["sqlite"], "user_tests", tests_df)
+        write_table(paths["sqlite"], "rx", rx_df)
+
+        print(f"{name}: {len(master)} employees ({n_mrs} MRs), "
+              f"{len(tests_df)} tests, {len(rx_df)} rx rows")
+
+        pharma_rows.append({
+            "pharma_name": name,
+            "aid": aid,
+            "json_file": json_file,
+            "prescription_key": pres_key,
+        })
+
+    pharma_df = pd.DataFrame(pharma_rows)
+    pharma_df.to_excel(os.path.join(out, "Pharma_list.xlsx"), index=False)
+
+    return pharma_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic tenants into the offline backend")
+    parser.add_argument("--out", default=".local_backend")
+    parser.add_argument("--tenants", type=int, default=DEFAULT_TENANTS)
+    parser.add_argument("--mrs", type=int, default=DEFAULT_MRS, help="MRs in the largest tenant")
+    parser.add_argument("--skew", type=float, default=DEFAULT_SKEW, help="Tenant size power law exponent (0 = equal sizes)")
+    parser.add_argument("--mrs-per-abm", type=int, default=DEFAULT_MRS_PER_ABM)
+    parser.add_argument("--abms-per-rbm", type=int, default=DEFAULT_ABMS_PER_RBM)
+    parser.add_argument("--rbms-per-sm", type=int, default=DEFAULT_RBMS_PER_SM)
+    parser.add_argument("--doctors-per-mr", type=float, default=DEFAULT_DOCTORS_PER_MR)
+    parser.add_argument("--tests-per-doctor", type=float, default=DEFAULT_TESTS_PER_DOCTOR)
+    parser.add_argument("--vacancy-rate", type=float, default=DEFAULT_VACANCY_RATE)
+    parser.add_argument("--cross-rbm-rate", type=float, default=DEFAULT_CROSS_RBM_RATE)
+    parser.add_argument("--training-rows", type=int, default=DEFAULT_TRAINING_ROWS)
+    parser.add_argument("--rx-rate", type=float, default=DEFAULT_RX_RATE)
+    parser.add_argument("--bad-rx-rate", type=float, default=DEFAULT_BAD_RX_RATE)
+    parser.add_argument("--no-key-every", type=int, default=0, help="Every Nth tenant has no prescription_key")
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD (default: 1st of this month)")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    parse_day = lambda s: datetime.strptime(s, "%Y-%m-%d").date() if s else None
+
+    generate(
+        args.out, tenants=args.tenants, mrs=args.mrs, skew=args.skew,
+        start=parse_day(args.start), end=parse_day(args.end),
+        seed=args.seed, no_key_every=args.no_key_every,
+        mrs_per_abm=args.mrs_per_abm, abms_per_rbm=args.abms_per_rbm,
+        rbms_per_sm=args.rbms_per_sm, doctors_per_mr=args.doctors_per_mr,
+        tests_per_doctor=args.tests_per_doctor, vacancy_rate=args.vacancy_rate,
+        cross_rbm_rate=args.cross_rbm_rate, training_rows=args.training_rows,
+        rx_rate=args.rx_rate, bad_rx_rate=args.bad_rx_rate,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,44 @@
+"""alljson prefetch on the local bucket."""
+import json
+
+import alljson
+from backends import LocalBucket
+
+MASTER = {
+    "mr1": {"mr_name": "MR One", "mr_designation": "mr", "abm_name": "ABM One", "rbm_name": "RBM One",
+            "sm_name": "SM One", "state": "S", "city": "C", "mr_region": "H"},
+}
+
+
+def test_empty_listing_gives_an_empty_table(tmp_path):
+    (tmp_path / "bucket").mkdir()
+
+    status_df = alljson.prefetch_all(LocalBucket(str(tmp_path / "bucket")), str(tmp_path / "cache"))
+
+    assert status_df.empty
+    assert list(status_df.columns) == alljson.STATUS_COLUMNS
+
+
+def test_main_exits_cleanly_without_masters(tmp_path, monkeypatch, capsys):
+    (tmp_path / "bucket").mkdir()
+    monkeypatch.setenv("REPORT_BACKEND", "local")
+    monkeypatch.setenv("REPORT_LOCAL_DIR", str(tmp_path))
+
+    assert alljson.main(["--cache-dir", str(tmp_path / "cache")]) == 1
+    assert "No *.json masters" in capsys.readouterr().out
+
+
+def test_masters_are_downloaded_then_fresh(tmp_path):
+    folder = tmp_path / "bucket" / "org_access_codes"
+    folder.mkdir(parents=True)
+    (folder / "tenant-uacr.json").write_text(json.dumps(MASTER))
+    (folder / "notes.txt").write_text("not a master")
+    bucket = LocalBucket(str(tmp_path / "bucket"))
+
+    first = alljson.prefetch_all(bucket, str(tmp_path / "cache"))
+    second = alljson.prefetch_all(bucket, str(tmp_path / "cache"))
+
+    assert first[["json_file", "status", "employees"]].values.tolist() == [
+        ["org_access_codes/tenant-uacr.json", "downloaded", 1],
+    ]
+    assert second["status"].tolist() == ["fresh"]
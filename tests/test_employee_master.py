@@ -0,0 +1,117 @@
+"""Employee master frame and its Parquet cache (local bucket)."""
+import json
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from backends import LocalBucket
+from employee_master import (
+    MASTER_FORMAT_VERSION, MASTER_SCHEMA, TEXT_DTYPE, VERSION_KEY, cached_master, employee_master_frame,
+    load_employee_master, save_master_cache,
+)
+
+JSON_FILE = "org_access_codes/tenant-uacr.json"
+
+MASTER = {
+    "mr1": {"mr_name": "MR One", "mr_designation": "mr", "abm_name": "ABM One", "rbm_name": "RBM One",
+            "sm_name": "SM One", "state": "S", "city": "C", "mr_region": "H", "region_list": ["r1", "r2"]},
+    "abm1": {"mr_name": "ABM One", "mr_designation": "abm", "abm_name": "ABM One", "rbm_name": "RBM One",
+             "sm_name": "SM One", "state": "S", "city": "C", "mr_region": "H"},
+    "t1": {"mr_name": "Training", "mr_designation": "mr"},
+}
+
+
+def _bucket(tmp_path, master, generation):
+    path = tmp_path / "bucket" / JSON_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(master))
+    os.utime(path, ns=(generation, generation))
+    return LocalBucket(str(tmp_path / "bucket"))
+
+
+def test_frame_follows_the_schema():
+    emp_df = employee_master_frame(MASTER)
+
+    assert list(emp_df.columns) == list(MASTER_SCHEMA)
+    assert emp_df.dtypes.to_dict() == MASTER_SCHEMA
+    assert emp_df["region_list"].tolist()[0] == "r1, r2"
+    assert pd.isna(emp_df["region_list"].tolist()[1])
+
+
+def test_missing_and_all_null_fields_get_the_declared_dtype():
+    emp_df = employee_master_frame({
+        "7": {"mr_name": "A", "mr_designation": "mr", "state": None, "city": 5, "phone": "99"},
+        "8": {"mr_name": "B", "mr_designation": "abm", "state": None},
+    })
+
+    assert list(emp_df.columns) == list(MASTER_SCHEMA) + ["phone"]
+    assert emp_df.dtypes.to_dict() == {**MASTER_SCHEMA, "phone": TEXT_DTYPE}
+    assert emp_df["state"].isna().all() and emp_df["sm_name"].isna().all()
+    assert emp_df["city"].tolist()[0] == "5"
+
+
+def test_empty_master_keeps_the_schema():
+    emp_df = employee_master_frame({"t1": MASTER["t1"]})
+
+    assert emp_df.empty
+    assert emp_df.dtypes.to_dict() == MASTER_SCHEMA
+
+
+def test_missing_manager_names_stay_missing():
+    # A "nan" text name would become a manager of its own downstream
+    emp_df = employee_master_frame({
+        "mr1": {k: v for k, v in MASTER["mr1"].items() if k not in ("sm_name", "abm_name")},
+        "mr2": dict(MASTER["mr1"], rbm_name=None),
+    })
+
+    for col in ["sm_name", "rbm_name", "abm_name"]:
+        assert not emp_df[col].isin(["nan", "None", ""]).any()
+    assert emp_df["sm_name"].isna().tolist() == [True, False]
+    assert emp_df["rbm_name"].isna().tolist() == [False, True]
+    assert emp_df["abm_name"].isna().tolist() == [True, False]
+    assert (emp_df["rbm_name"] == "RBM One").tolist() == [True, False]
+
+
+def test_loader_rejects_an_unusable_master(tmp_path):
+    bucket = _bucket(tmp_path, {"t1": MASTER["t1"]}, 1_000)
+
+    with pytest.raises(ValueError, match="no employees"):
+        load_employee_master(bucket, JSON_FILE)
+    with pytest.raises(ValueError, match="no employees"):
+        load_employee_master(bucket, JSON_FILE, cache_dir=str(tmp_path / "cache"))
+    assert not (tmp_path / "cache" / (JSON_FILE + ".parquet")).exists()
+
+
+def test_cache_round_trip_keeps_mixed_and_nested_values(tmp_path):
+    emp_df = employee_master_frame({
+        "1": {"mr_name": "A", "code": 1, "tags": [1, "a"], "extra": {"k": 1}},
+        "2": {"mr_name": "B", "code": "two", "score": 3.5},
+    })
+    version = {"generation": "7", "md5": None, "format": MASTER_FORMAT_VERSION}
+
+    save_master_cache(str(tmp_path), JSON_FILE, emp_df, version)
+
+    pd.testing.assert_frame_equal(cached_master(str(tmp_path), JSON_FILE, version), emp_df)
+    assert cached_master(str(tmp_path), JSON_FILE, {**version, "generation": "8"}) is None
+
+
+def test_cache_follows_the_blob_generation(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    bucket = _bucket(tmp_path, MASTER, 1_000)
+
+    downloaded = load_employee_master(bucket, JSON_FILE, cache_dir=cache_dir)
+    cached = load_employee_master(bucket, JSON_FILE, cache_dir=cache_dir)
+
+    pd.testing.assert_frame_equal(cached, downloaded)
+    assert downloaded["empId"].tolist() == ["mr1", "abm1"]
+
+    metadata = pq.read_schema(os.path.join(cache_dir, JSON_FILE + ".parquet")).metadata
+    assert json.loads(metadata[VERSION_KEY])["generation"] == "1000"
+
+    # Overwritten blob → new generation → downloaded again
+    bucket = _bucket(tmp_path, {**MASTER, "mr2": dict(MASTER["mr1"], mr_name="MR Two")}, 2_000)
+    reloaded = load_employee_master(bucket, JSON_FILE, cache_dir=cache_dir)
+
+    assert reloaded["empId"].tolist() == ["mr1", "abm1", "mr2"]
@@ -0,0 +1,50 @@
+"""fetch_month_to_date: same frame cold, incremental and uncached (sqlite dialect)."""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backends import create_local_store, local_sql_manager, write_table
+from metrics_cache import fetch_month_to_date
+from synth_org import generate_activity
+
+AID = "tenant-a"
+PRES_KEY = "rx"
+START = "2025-01-01"
+
+
+@pytest.fixture(params=[1, 2])
+def conn(tmp_path, request):
+    tests_df, rx_df = generate_activity(
+        np.random.default_rng(request.param), AID, PRES_KEY, [f"E{i}" for i in range(30)],
+        date(2025, 1, 1), date(2025, 1, 31),
+    )
+    paths = create_local_store(str(tmp_path / "store"))
+    write_table(paths["sqlite"], "aId", pd.DataFrame({"aId": [AID]}))
+    write_table(paths["sqlite"], "user_tests", tests_df)
+    write_table(paths["sqlite"], "rx", rx_df)
+
+    manager = local_sql_manager(paths["sqlite"])
+    yield manager
+    manager.close()
+
+
+def test_incremental_run_matches_cold_run(conn, tmp_path):
+    cold = fetch_month_to_date(conn, AID, PRES_KEY, START, "2025-01-31", cache_dir=str(tmp_path / "cold"))
+
+    # Same month built up over three runs: cached days come first in the cache
+    for end_date in ["2025-01-09", "2025-01-20", "2025-01-31"]:
+        warm = fetch_month_to_date(
+            conn, AID, PRES_KEY, START, end_date, cache_dir=str(tmp_path / "warm"), recheck_days=1
+        )
+
+    assert len(cold) > 0
+    pd.testing.assert_frame_equal(warm, cold)
+
+
+def test_cached_run_matches_uncached_fetch(conn, tmp_path):
+    cached = fetch_month_to_date(conn, AID, PRES_KEY, START, "2025-01-31", cache_dir=str(tmp_path / "cache"))
+    uncached = fetch_month_to_date(conn, AID, PRES_KEY, START, "2025-01-31")
+
+    pd.testing.assert_frame_equal(cached, uncached, check_dtype=False)
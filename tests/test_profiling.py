@@ -0,0 +1,66 @@
+"""--profile together with --prefetch (one active cProfile per process on 3.12+)."""
+import importlib.util
+import os
+import threading
+
+import profiling
+from stages import end_stage, mark
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _report_code():
+    spec = importlib.util.spec_from_file_location("report_code", os.path.join(ROOT, "TEST", "code.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SingleProfile(profiling.cProfile.Profile):
+    """cProfile.Profile as on Python 3.12+: enable() fails while another one is active."""
+
+    active = None
+
+    def enable(self, *args, **kwargs):
+        if SingleProfile.active is not None:
+            raise ValueError("Another profiling tool is already active")
+        SingleProfile.active = self
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        SingleProfile.active = None
+
+
+def test_profile_turns_prefetch_off():
+    code = _report_code()
+
+    assert code.parse_args(["--profile", "--prefetch", "2"]).prefetch == 0
+    assert code.parse_args(["--prefetch", "2"]).prefetch == 2
+
+
+def test_overlapping_stage_on_another_thread_runs_unprofiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling.cProfile, "Profile", SingleProfile)
+
+    with profiling.profile_stages(str(tmp_path)) as profiler:
+        mark("hierarchy", tenant="t1")
+
+        errors = []
+
+        def producer():
+            try:
+                mark("sql_fetch", tenant="t2")
+                sum(range(1000))
+                end_stage()
+            except ValueError as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=producer, name="prefetch-producer")
+        thread.start()
+        thread.join()
+        sum(range(1000))
+
+    assert errors == []
+    assert list(profiler.summary) == ["t1"]
+    assert profiler.summary["t1"]["stages"] == ["hierarchy"]
+    assert os.path.exists(os.path.join(str(tmp_path), "t1", "hierarchy.pstats"))
@@ -0,0 +1,91 @@
+"""SET STATISTICS capture in sql_fetch / query_log (fake pyodbc connection)."""
+import json
+
+import pytest
+
+import query_log
+from sql_fetch import read_sql
+
+QUERY = "SELECT empId FROM dbo.user_tests WHERE aId = ?"
+
+
+class Cursor:
+    def __init__(self, log):
+        self.log = log
+        self.description = None
+        self.messages = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.log.append(query)
+        if query.startswith("SET STATISTICS"):
+            return
+        self.description = [("empId",)]
+        self._rows = [("E1",), ("E2",)]
+        self.messages = [(None, "Table 'user_tests'. Scan count 1, logical reads 7, physical reads 0")]
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class Connection:
+    """Looks like a pyodbc connection to query_log.supports_statistics()."""
+
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return Cursor(self.log)
+
+
+Cursor.__module__ = Connection.__module__ = "pyodbc"
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    """Slow-query log path; settings and totals are reset after the test."""
+    for name in ("_config", "_totals", "_logged"):
+        monkeypatch.setattr(query_log, name, {})
+    return str(tmp_path / "slow.jsonl")
+
+
+def test_statistics_are_turned_off_after_the_query(settings):
+    query_log.configure(log_path=settings, slow_seconds=0, capture_statistics="all")
+    conn = Connection()
+
+    assert read_sql(conn, QUERY, ["a"])["empId"].tolist() == ["E1", "E2"]
+    assert conn.log == ["SET STATISTICS IO, TIME ON", QUERY, "SET STATISTICS IO, TIME OFF"]
+
+    with open(settings) as f:
+        entry = json.loads(f.readline())
+    assert entry["statistics"]["logical_reads"] == 7
+
+
+def test_statistics_only_for_known_slow_shapes(settings):
+    query_log.configure(log_path=settings, slow_seconds=0, capture_statistics=True)
+    conn = Connection()
+
+    read_sql(conn, QUERY, ["a"])        # not known yet: logged without statistics
+    read_sql(conn, QUERY, ["b"])        # slow once → captured from now on
+
+    assert conn.log == [QUERY, "SET STATISTICS IO, TIME ON", QUERY, "SET STATISTICS IO, TIME OFF"]
+
+
+def test_shapes_logged_by_an_earlier_run_are_captured(settings):
+    fingerprint = query_log.fingerprint_query(QUERY)
+    with open(settings, "w") as f:
+        f.write(json.dumps({"fingerprint": fingerprint, "seconds": 45.0}) + "\n")
+    query_log.configure(log_path=settings, slow_seconds=30, capture_statistics=True)
+    conn = Connection()
+
+    read_sql(conn, QUERY, ["a"])
+    read_sql(conn, "SELECT 1 AS empId", [])
+
+    assert conn.log == ["SET STATISTICS IO, TIME ON", QUERY, "SET STATISTICS IO, TIME OFF", "SELECT 1 AS empId"]
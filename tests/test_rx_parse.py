@@ -0,0 +1,104 @@
+"""rx_parse="client" against the server-side Rx / Strips expression (sqlite dialect)."""
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backends import create_local_store, local_sql_manager, write_table
+from sql_queries import fetch_doctor_metrics, parse_rx_payload
+from synth_org import generate_activity
+
+AID = "tenant-a"
+PRES_KEY = "rx"
+START, END = "2025-01-01 00:00:00", "2025-01-31 23:59:59"
+
+# Payloads the dbo.rx prescriptions carry, well-formed or not
+PAYLOADS = [
+    "3|4", "3", "", "|", "x|2", "4|y", None, " 7 | 8", "1|2|3", "+5|-6",
+    "99999999999|5", "1|99999999999", "2147483647|-2147483648", "2147483648|-2147483649",
+]
+
+
+def _store(tmp_path, tests_df, rx_df):
+    paths = create_local_store(str(tmp_path))
+    write_table(paths["sqlite"], "aId", pd.DataFrame({"aId": [AID]}))
+    write_table(paths["sqlite"], "user_tests", tests_df)
+    write_table(paths["sqlite"], "rx", rx_df)
+    return local_sql_manager(paths["sqlite"])
+
+
+def _fixed_activity():
+    """One doctor / oId per payload, two camps each."""
+    n = len(PAYLOADS)
+    tests_df = pd.DataFrame({
+        "testId": [f"T{i}" for i in range(n)],
+        "aId": AID,
+        "empId": [f"E{i % 3}" for i in range(n)],
+        "docId": [f"D{i}" for i in range(n)],
+        "drName": [f"Dr {i}" for i in range(n)],
+        "oId": [f"O{i}" for i in range(n)],
+        "campDate": "2025-01-10 10:00:00",
+        "statusCode": 200,
+        "isDeleted": 0,
+    })
+    rx_df = pd.DataFrame({
+        "aId": AID,
+        "oId": [f"O{i}" for i in range(n)] * 2,
+        "campDate": ["2025-01-10 12:00:00"] * n + ["2025-01-11 12:00:00"] * n,
+        "isDeleted": 0,
+        "prescriptions": [json.dumps({PRES_KEY: p}) for p in PAYLOADS] * 2,
+    })
+    return tests_df, rx_df
+
+
+def _both_paths(conn):
+    server = fetch_doctor_metrics(conn, AID, PRES_KEY, START, END, rx_parse="server")
+    client = fetch_doctor_metrics(conn, AID, PRES_KEY, START, END, rx_parse="client")
+    keys = ["empId", "Doctor ID"]
+    return (
+        server.sort_values(keys, ignore_index=True),
+        client.sort_values(keys, ignore_index=True),
+    )
+
+
+def test_parse_rx_payload_follows_try_cast():
+    rx, strips = parse_rx_payload(pd.Series(PAYLOADS, dtype=object))
+
+    assert rx.tolist() == [
+        3, pd.NA, pd.NA, pd.NA, pd.NA, 4, pd.NA, 7, 1, 5,
+        pd.NA, 1, 2147483647, pd.NA,
+    ]
+    assert strips.tolist() == [
+        4, 3, pd.NA, pd.NA, 2, pd.NA, pd.NA, 8, pd.NA, -6,
+        5, pd.NA, -2147483648, pd.NA,
+    ]
+
+
+def test_client_parse_matches_server_on_fixed_payloads(tmp_path):
+    conn = _store(tmp_path, *_fixed_activity())
+    try:
+        server, client = _both_paths(conn)
+    finally:
+        conn.close()
+
+    assert len(server) == len(PAYLOADS)
+    pd.testing.assert_frame_equal(server, client, check_dtype=False)
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_client_parse_matches_server_on_synthetic_tenant(tmp_path, seed):
+    # synth_org mixes in "x|2", "3", "|" and "4|y" payloads
+    tests_df, rx_df = generate_activity(
+        np.random.default_rng(seed), AID, PRES_KEY, [f"E{i}" for i in range(20)],
+        date(2025, 1, 1), date(2025, 1, 31), bad_rx_rate=0.2,
+    )
+    conn = _store(tmp_path, tests_df, rx_df)
+    try:
+        server, client = _both_paths(conn)
+    finally:
+        conn.close()
+
+    assert server["Total Strips"].sum() > 0
+    pd.testing.assert_frame_equal(server, client, check_dtype=False)
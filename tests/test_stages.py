@@ -0,0 +1,28 @@
+"""stages.py on hosts without the resource module (non-Unix)."""
+import importlib.util
+import sys
+
+import stages
+
+
+def test_imports_without_resource(monkeypatch):
+    monkeypatch.setitem(sys.modules, "resource", None)       # import resource → ImportError
+    spec = importlib.util.spec_from_file_location("stages_without_resource", stages.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    assert module.resource is None
+
+
+def test_stages_are_recorded_without_a_peak_rss(monkeypatch, tmp_path):
+    monkeypatch.setattr(stages, "resource", None)
+    monkeypatch.setattr(stages, "_STATUS", str(tmp_path / "missing"))
+
+    assert stages.peak_rss_mb() is None
+    with stages.record_stages() as records:
+        stages.mark("load")
+        stages.mark("write")
+
+    assert [r["peak_rss_mb"] for r in records] == [None, None]
+    totals = stages.stage_totals(records)
+    assert totals["load"]["count"] == 1 and totals["load"]["peak_rss_mb"] == 0.0
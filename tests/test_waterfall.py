@@ -0,0 +1,234 @@
+"""insert_missing_managers / insert_missing_abm_managers against the loops they replaced."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from waterfall import MANAGER_ROW_COLUMNS, insert_missing_abm_managers, insert_missing_managers
+
+
+# ------------------------------------------------------------
+# REFERENCE (the INSERT MISSING MANAGER ROWS loops of ipca / benitowa)
+# ------------------------------------------------------------
+def legacy_insert_missing(waterfall_df):
+    """ipca: INSERT MISSING MANAGER ROWS — HIERARCHY AWARE."""
+    df = waterfall_df.copy()
+    final_rows = []
+
+    def make_row(desig, name, sm, rbm, abm, total=0.0, exp=0.0):
+        return pd.Series({
+            "empId": "", "name": name, "designation": desig, "sm_name": sm,
+            "rbm_name": rbm, "abm_name": abm, "state": "", "city": "", "hq": "",
+            "total_camps": float(total), "expected_camps": float(exp), "execution_percent": 0,
+        })
+
+    for sm, sm_block in df.groupby("sm_name", dropna=False):
+        sm_present = len(sm_block[(sm_block["designation"] == "sm") & (sm_block["name"] == sm)]) > 0
+        for rbm, rbm_block in sm_block.groupby("rbm_name", dropna=False):
+            rbm_present = len(rbm_block[(rbm_block["designation"] == "rbm") & (rbm_block["name"] == rbm)]) > 0
+            for abm, abm_block in rbm_block.groupby("abm_name", dropna=False):
+                abm_present = len(abm_block[(abm_block["designation"] == "abm") & (abm_block["name"] == abm)]) > 0
+                mr_rows = abm_block[abm_block["designation"] == "mr"]
+                for _, r in mr_rows.iterrows():
+                    final_rows.append(r)
+                if abm and (not abm_present) and (not rbm_present) and (not sm_present):
+                    total = mr_rows["total_camps"].sum()
+                    final_rows.append(make_row("abm", abm, sm, rbm, abm, total=total, exp=2.0))
+                elif abm_present:
+                    final_rows.append(abm_block[abm_block["designation"] == "abm"].iloc[0])
+
+            if rbm and (not rbm_present) and (not sm_present):
+                abm_part = [r for r in final_rows if r["rbm_name"] == rbm and r["designation"] == "abm"]
+                total = sum(r["total_camps"] for r in abm_part)
+                final_rows.append(make_row("rbm", rbm, sm, rbm, "", total=total, exp=0.0))
+            elif rbm_present:
+                final_rows.append(rbm_block[rbm_block["designation"] == "rbm"].iloc[0])
+
+        if sm and (not sm_present):
+            rbm_part = [r for r in final_rows if r["sm_name"] == sm and r["designation"] == "rbm"]
+            total = sum(r["total_camps"] for r in rbm_part)
+            final_rows.append(make_row("sm", sm, sm, "", "", total=total, exp=0.0))
+        elif sm_present:
+            final_rows.append(sm_block[sm_block["designation"] == "sm"].iloc[0])
+
+    return pd.DataFrame(final_rows).reset_index(drop=True)
+
+
+def legacy_insert_missing_abm(waterfall_df):
+    """benitowa: INSERT MISSING RBM/SM ROWS WITH HIERARCHY RULES."""
+    df = waterfall_df.copy()
+    out_rows = []
+
+    def make_row(desig, name, sm, rbm, abm, total=0.0, expected=0.0):
+        return pd.Series({
+            "empId": "", "name": name, "designation": desig, "sm_name": sm,
+            "rbm_name": rbm, "abm_name": abm, "state": "", "city": "", "hq": "",
+            "total_camps": float(total), "expected_camps": float(expected), "execution_percent": 0,
+        })
+
+    for sm, sm_group in df.groupby("sm_name", dropna=False):
+        sm_present = (sm_group["designation"].str.lower() == "sm").any()
+        for rbm, rbm_group in sm_group.groupby("rbm_name", dropna=False):
+            rbm_present = (rbm_group["designation"].str.lower() == "rbm").any()
+            for abm, abm_group in rbm_group.groupby("abm_name", dropna=False):
+                abm_present = (abm_group["designation"].str.lower() == "abm").any()
+                abm_workers = abm_group[abm_group["designation"].str.lower() == "abm"]
+                for _, r in abm_workers.iterrows():
+                    out_rows.append(r)
+                if abm and (not abm_present) and (not rbm_present) and (not sm_present):
+                    total = abm_workers["total_camps"].sum()
+                    out_rows.append(make_row("abm", abm, sm, rbm, abm, total=total, expected=4.0))
+
+            if rbm and (not rbm_present) and (not sm_present):
+                worker_under_rbm = df[(df["rbm_name"] == rbm) & (df["designation"].str.lower() == "abm")]
+                total = worker_under_rbm["total_camps"].sum()
+                expected = 4.0 * len(worker_under_rbm)
+                out_rows.append(make_row("rbm", rbm, sm, rbm, "", total=total, expected=expected))
+            elif rbm_present:
+                rbm_row = rbm_group[rbm_group["designation"].str.lower() == "rbm"]
+                out_rows.append(rbm_row.iloc[0])
+
+        if sm and (not sm_present):
+            rbm_under_sm = df[(df["sm_name"] == sm) & (df["designation"].str.lower() == "rbm")]
+            abm_under_sm = df[(df["sm_name"] == sm) & (df["designation"].str.lower() == "abm")]
+            if not rbm_under_sm.empty:
+                total = rbm_under_sm["total_camps"].sum()
+                expected = rbm_under_sm["expected_camps"].sum()
+            else:
+                total = abm_under_sm["total_camps"].sum()
+                expected = abm_under_sm["expected_camps"].sum()
+            out_rows.append(make_row("sm", sm, sm, "", "", total=total, expected=expected))
+        else:
+            sm_row = sm_group[sm_group["designation"].str.lower() == "sm"]
+            if not sm_row.empty:
+                out_rows.append(sm_row.iloc[0])
+
+    return pd.DataFrame(out_rows).reset_index(drop=True)
+
+
+# ------------------------------------------------------------
+# FIXED ORGS
+# ------------------------------------------------------------
+def _row(designation, name, sm, rbm, abm, total=0.0, expected=0.0, emp_id="E"):
+    return {
+        "empId": emp_id, "name": name, "designation": designation, "sm_name": sm,
+        "rbm_name": rbm, "abm_name": abm, "state": "S", "city": "C", "hq": "H",
+        "total_camps": float(total), "expected_camps": float(expected), "execution_percent": 50,
+    }
+
+
+def _sheet(rows):
+    df = pd.DataFrame(rows, columns=MANAGER_ROW_COLUMNS)
+    for col in ["empId", "name", "designation", "sm_name", "rbm_name", "abm_name", "state", "city", "hq"]:
+        df[col] = df[col].astype("str")
+    return df
+
+
+# MR waterfalls (ipca): MRs under their ABM, then ABM / RBM / SM rows
+MR_ORGS = {
+    "complete": [
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("mr", "M2", "S1", "R1", "A1", 5),
+        _row("abm", "A1", "S1", "R1", "A1", 8, 4),
+        _row("rbm", "R1", "S1", "R1", "A1", 8, 4), _row("sm", "S1", "S1", "R1", "A1", 8, 4),
+    ],
+    "missing rbm": [
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("abm", "A1", "S1", "R1", "A1", 3, 2),
+        _row("mr", "M2", "S1", "R2", "A2", 4), _row("abm", "A2", "S1", "R2", "A2", 4, 2),
+    ],
+    "missing rbm under an sm row": [
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("abm", "A1", "S1", "R1", "A1", 3, 2),
+        _row("sm", "S1", "S1", "R1", "A1", 3, 2),
+    ],
+    "missing sm": [
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("abm", "A1", "S1", "R1", "A1", 3, 2),
+        _row("rbm", "R1", "S1", "R1", "A1", 3, 2),
+        _row("mr", "M2", "S1", "R2", "A2", 6), _row("abm", "A2", "S1", "R2", "A2", 6, 2),
+        _row("rbm", "R2", "S1", "R2", "A2", 6, 2),
+    ],
+    "missing abm, rbm and sm": [
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("mr", "M2", "S1", "R1", "A1", 2),
+        _row("mr", "M3", "S1", "R1", "A2", 7),
+    ],
+    "vacant abm": [
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("abm", "A1", "S1", "R1", "A1", 3, 2),
+        _row("mr", "M2", "S1", "R1", "Vacant (R1)", 4),
+        _row("abm", "Vacant (R1)", "S1", "R1", "Vacant (R1)", 4, 2, emp_id=""),
+        _row("mr", "M3", "S2", "R2", "Vacant (R2)", 1),
+    ],
+    "cross-rbm mrs": [
+        # R1 reports to two SMs; M3's ABM row sits under another RBM
+        _row("mr", "M1", "S1", "R1", "A1", 3), _row("abm", "A1", "S1", "R1", "A1", 3, 2),
+        _row("mr", "M2", "S2", "R1", "A2", 5), _row("abm", "A2", "S2", "R1", "A2", 5, 2),
+        _row("mr", "M3", "S2", "R2", "A2", 7), _row("abm", "A3", "S2", "R2", "A3", 1, 2),
+    ],
+    "nan and empty names": [
+        _row("mr", "M1", np.nan, "R1", "A1", 3), _row("abm", "A1", np.nan, "R1", "A1", 3, 2),
+        _row("mr", "M2", "S1", "", "A2", 4), _row("mr", "M3", "S1", np.nan, "", 2),
+        _row("mr", "M4", "", "R3", np.nan, 6), _row("mr", "M5", "S2", "R4", np.nan, 1),
+        _row("rbm", np.nan, "S2", np.nan, "", 9, 2),
+    ],
+    "non-lowercase designations": [
+        _row("MR", "M1", "S1", "R1", "A1", 3), _row("mr", "M2", "S1", "R1", "A1", 5),
+        _row("Abm", "A1", "S1", "R1", "A1", 8, 4), _row("RBM", "R1", "S1", "R1", "A1", 8, 4),
+        _row("mr", "M3", "S2", "R2", "A2", 1), _row("Sm", "S2", "S2", "R2", "A2", 1, 2),
+    ],
+}
+
+# ABM waterfalls (benitowa): ABMs are the workers, then RBM / SM rows
+ABM_ORGS = {
+    "complete": [
+        _row("abm", "A1", "S1", "R1", "A1", 3, 4), _row("abm", "A2", "S1", "R1", "A2", 5, 4),
+        _row("rbm", "R1", "S1", "R1", "", 8, 8), _row("sm", "S1", "S1", "", "", 8, 8),
+    ],
+    "missing rbm": [
+        _row("abm", "A1", "S1", "R1", "A1", 3, 4), _row("abm", "A2", "S1", "R1", "A2", 5, 4),
+        _row("abm", "A3", "S1", "R2", "A3", 2, 4), _row("rbm", "R2", "S1", "R2", "", 2, 4),
+    ],
+    "missing sm": [
+        _row("abm", "A1", "S1", "R1", "A1", 3, 4), _row("rbm", "R1", "S1", "R1", "", 3, 4),
+        _row("abm", "A2", "S2", "R2", "A2", 6, 4),
+    ],
+    "vacant abm": [
+        _row("abm", "A1", "S1", "R1", "A1", 3, 4),
+        _row("abm", "Vacant (R1)", "S1", "R1", "Vacant (R1)", 2, 4, emp_id=""),
+        _row("rbm", "R1", "S1", "R1", "", 5, 8),
+        _row("rbm", "R2", "S1", "R2", "Vacant (R2)", 0, 0),
+    ],
+    "cross-rbm abms": [
+        # R1 reports to two SMs: its inserted rows count every R1 ABM
+        _row("abm", "A1", "S1", "R1", "A1", 3, 4), _row("abm", "A2", "S2", "R1", "A2", 5, 4),
+        _row("abm", "A3", "S2", "R2", "A3", 1, 4), _row("rbm", "R2", "S2", "R2", "", 1, 4),
+    ],
+    "nan and empty names": [
+        _row("abm", "A1", np.nan, "R1", "A1", 3, 4), _row("abm", "A2", "S1", "", "A2", 4, 4),
+        _row("abm", "A3", "S1", np.nan, "", 2, 4), _row("rbm", np.nan, "S2", np.nan, "", 9, 2),
+        _row("sm", "", "", "", "", 1, 1),
+    ],
+    "non-lowercase designations": [
+        _row("ABM", "A1", "S1", "R1", "A1", 3, 4), _row("Abm", "A2", "S1", "R2", "A2", 5, 4),
+        _row("Rbm", "R1", "S1", "R1", "", 3, 4), _row("abm", "A3", "S2", "R3", "A3", 1, 4),
+        _row("SM", "S2", "S2", "", "", 1, 4),
+    ],
+}
+
+
+@pytest.mark.parametrize("org", list(MR_ORGS))
+def test_insert_missing_managers_matches_loop(org):
+    sheet = _sheet(MR_ORGS[org])
+
+    pd.testing.assert_frame_equal(insert_missing_managers(sheet), legacy_insert_missing(sheet))
+
+
+@pytest.mark.parametrize("org", list(ABM_ORGS))
+def test_insert_missing_abm_managers_matches_loop(org):
+    sheet = _sheet(ABM_ORGS[org])
+
+    pd.testing.assert_frame_equal(insert_missing_abm_managers(sheet), legacy_insert_missing_abm(sheet))
+
+
+def test_insert_missing_managers_fills_the_hierarchy():
+    out = insert_missing_managers(_sheet(MR_ORGS["missing abm, rbm and sm"]))
+
+    assert out["name"].tolist() == ["M1", "M2", "A1", "M3", "A2", "R1", "S1"]
+    assert out["designation"].tolist() == ["mr", "mr", "abm", "mr", "abm", "rbm", "sm"]
+    assert out["total_camps"].tolist() == [3.0, 2.0, 5.0, 7.0, 7.0, 12.0, 12.0]
+    assert out["expected_camps"].tolist() == [0.0, 0.0, 2.0, 0.0, 2.0, 0.0, 0.0]
@@ -0,0 +1,459 @@
+"""
+Waterfall Summary sheet: every row of the summary sheet placed under its
+manager, with the vacant blocks filled in.
+
+    build_waterfall       MR → ABM → RBM → SM   (ipca, lupin, TEST/code.py)
+    build_abm_waterfall   ABM → RBM → SM        (benitowa)
+
+    insert_missing_managers       named but missing ABM / RBM / SM rows (ipca)
+    insert_missing_abm_managers   named but missing RBM / SM rows (benitowa)
+
+Order of build_waterfall, per SM (sorted, missing last), per RBM under it
+(sorted, missing last):
+
+    MRs + ABM row of every real ABM block (sorted by ABM)
+    leftover MRs (no real ABM above them)
+    "Vacant (<rbm>)" ABM row summing the leftover MRs
+    RBM row — or a synthetic one summing the ABM rows for "Vacant (...)" RBMs
+    ...
+    SM row
+
+The scripts walked three nested groupbys, appended every kept row with
+iterrows() / iloc[0] and the vacant rows as pd.Series, then built the
+sheet with pd.DataFrame(list of rows). Here every kept row gets a sort
+key (sm, rbm, slot, abm, ...), the vacant rows are built as one small
+frame, and the sheet is a single concat + stable sort. The missing
+manager rows are added the same way, with their totals from per-block
+sums instead of rescanning the rows placed so far. bench_waterfall.py
+checks both give the same sheet as the loops.
+"""
+import numpy as np
+import pandas as pd
+
+SYNTHETIC_COLUMNS = [
+    "empId", "name", "abm_name", "rbm_name", "sm_name",
+    "state", "city", "designation", "hq",
+    "total_camps", "expected_camps", "execution_percent",
+]
+
+# Slots of the rows of one RBM block
+REAL_ABM, LEFTOVER_MR, VACANT_ABM, RBM = 0, 1, 2, 3
+
+
+def _sorted_codes(values):
+    """Codes in groupby(sort=True, dropna=False) order: sorted, missing last."""
+    codes, uniques = pd.factorize(values, sort=True)
+    codes = codes.astype(np.int64)
+    codes[codes < 0] = len(uniques)
+    return codes, uniques
+
+
+def _group_ids(*codes):
+    """One compact id per combination of codes."""
+    combined = np.zeros(len(codes[0]), dtype=np.int64)
+    for c in codes:
+        combined = combined * (int(c.max(initial=0)) + 1) + c
+    return pd.factorize(combined)[0]
+
+
+def _sum_by(ids, weights, size):
+    """Sum of weights per id (float, also when there is nothing to sum)."""
+    return np.bincount(ids, weights=weights, minlength=size).astype("float64")
+
+
+def _first(mask, groups):
+    """Positions of the first row of every group among the rows in mask."""
+    rows = np.flatnonzero(mask)
+    _, first = np.unique(groups[rows], return_index=True)
+    return rows[np.sort(first)]
+
+
+def _is_vacant(uniques):
+    """Per code (plus one for missing): the name is a "Vacant (...)" label."""
+    flags = [isinstance(v, str) and v.startswith("Vacant (") for v in uniques]
+    return np.array(flags + [False], dtype=bool)
+
+
+def _execution_percent(total, expected):
+    """round(total / expected × 100), 0 without an expectation."""
+    safe = np.where(expected > 0, expected, 1.0)
+    return np.where(expected > 0, np.round(total / safe * 100), 0).astype(np.int64)
+
+
+def _text(values, n, dtype):
+    """n names (a scalar is repeated) with the sheet's string dtype, even when all missing."""
+    return pd.array(np.broadcast_to(np.asarray(values, dtype=object), (n,)), dtype=dtype)
+
+
+def _synthetic_rows(df, designation, name, rbm, sm, total, expected, percent_expected=None):
+    n = len(name)
+    dtype = df["name"].dtype
+    if percent_expected is None:
+        percent_expected = expected
+    return pd.DataFrame({
+        "empId": [""] * n,
+        "name": _text(name, n, dtype),
+        "abm_name": _text(name, n, dtype),
+        "rbm_name": _text(rbm, n, dtype),
+        "sm_name": _text(sm, n, dtype),
+        "state": [""] * n,
+        "city": [""] * n,
+        "designation": [designation] * n,
+        "hq": [""] * n,
+        "total_camps": total,
+        "expected_camps": expected,
+        "execution_percent": _execution_percent(total, percent_expected),
+    }, columns=SYNTHETIC_COLUMNS)
+
+
+def _assemble(parts):
+    """
+    parts = [(frame, keys)] → one frame: a single concat, rows in
+    (stable) key order, columns in the order the first row brings them
+    (as pd.DataFrame(list of rows) did).
+    """
+    parts = [(frame, keys) for frame, keys in parts if len(frame)]
+    if not parts:
+        return pd.DataFrame()
+
+    keys = [np.concatenate(column) for column in zip(*(k for _, k in parts))]
+    order = np.lexsort(keys[::-1])
+
+    sheet = pd.concat([frame for frame, _ in parts], ignore_index=True).take(order)
+    sizes = np.cumsum([len(frame) for frame, _ in parts])
+    first_part = parts[int(np.searchsorted(sizes, order[0], side="right"))][0]
+    columns = list(first_part.columns) + [c for c in sheet.columns if c not in first_part.columns]
+    return sheet[columns].reset_index(drop=True)
+
+
+def build_waterfall(summary_df, vacant_abm_expected=None):
+    """
+    MR → ABM → RBM → SM waterfall of summary_df (see the module docstring).
+    Vacant ABM rows expect vacant_abm_expected camps, or the sum over
+    their MRs when it is None; their execution % is always taken over
+    the MRs' expectation.
+    """
+    df = summary_df.reset_index(drop=True)
+    n = len(df)
+    designation = df["designation"].to_numpy(dtype=object)
+    is_mr, is_abm = designation == "mr", designation == "abm"
+    is_rbm, is_sm = designation == "rbm", designation == "sm"
+    total = df["total_camps"].to_numpy(dtype="float64")
+    expected = df["expected_camps"].to_numpy(dtype="float64")
+
+    sm, _ = _sorted_codes(df["sm_name"])
+    rbm, rbm_names = _sorted_codes(df["rbm_name"])
+    abm, abm_names = _sorted_codes(df["abm_name"])
+    block = _group_ids(sm, rbm)
+    group = _group_ids(sm, rbm, abm)
+    n_blocks = int(block.max(initial=-1)) + 1
+
+    # Real ABM block: not a "Vacant (...)" name and has an ABM row
+    real = (np.bincount(group[is_abm], minlength=n) > 0)[group] & ~_is_vacant(abm_names)[abm]
+    vacant_rbm = _is_vacant(rbm_names)[rbm]
+
+    mr_rows = np.flatnonzero(is_mr)
+    abm_rows = _first(is_abm & real, group)
+    rbm_rows = _first(is_rbm & ~vacant_rbm, block)
+    sm_rows = _first(is_sm, sm)
+    kept = np.concatenate([mr_rows, abm_rows, rbm_rows, sm_rows])
+
+    slot = np.where(is_rbm, RBM, np.where(is_mr & ~real, LEFTOVER_MR, REAL_ABM))
+    after_rbms = rbm.max(initial=0) + 1
+    keys = (
+        sm[kept],
+        np.where(is_sm, after_rbms, rbm)[kept],
+        slot[kept],
+        np.where(slot == REAL_ABM, abm, 0)[kept],
+        is_abm.astype(np.int64)[kept],
+        kept,
+    )
+    parts = [(df.iloc[kept], keys)]
+
+    # Vacant ABM per RBM block with leftover MRs
+    leftover = is_mr & ~real
+    if leftover.any():
+        rows = _first(leftover, block)
+        vacant_total = _sum_by(block[leftover], total[leftover], n_blocks)[block[rows]]
+        mr_expected = _sum_by(block[leftover], expected[leftover], n_blocks)[block[rows]]
+        vacant_expected = mr_expected if vacant_abm_expected is None else np.full(len(rows), float(vacant_abm_expected))
+        rbm_values = df["rbm_name"].iloc[rows].to_numpy(dtype=object)
+        frame = _synthetic_rows(
+            df, "abm", [f"Vacant ({rbm})" for rbm in rbm_values], rbm_values, df["sm_name"].iloc[rows].to_numpy(),
+            vacant_total, vacant_expected, mr_expected,
+        )
+        zeros = np.zeros(len(rows), dtype=np.int64)
+        parts.append((frame, (sm[rows], rbm[rows], zeros + VACANT_ABM, zeros, zeros, zeros)))
+
+    # Synthetic RBM row per "Vacant (...)" RBM block, summing its ABM rows
+    if vacant_rbm.any():
+        rows = _first(vacant_rbm, block)
+        abm_in_block = is_abm & vacant_rbm
+        rbm_total = _sum_by(block[abm_in_block], total[abm_in_block], n_blocks)[block[rows]]
+        rbm_expected = _sum_by(block[abm_in_block], expected[abm_in_block], n_blocks)[block[rows]]
+        rbm_values = df["rbm_name"].iloc[rows].to_numpy()
+        frame = _synthetic_rows(
+            df, "rbm", rbm_values, rbm_values, df["sm_name"].iloc[rows].to_numpy(), rbm_total, rbm_expected,
+        )
+        zeros = np.zeros(len(rows), dtype=np.int64)
+        parts.append((frame, (sm[rows], rbm[rows], zeros + RBM, zeros, zeros, zeros)))
+
+    return _assemble(parts)
+
+
+def build_abm_waterfall(summary_df):
+    """
+    ABM → RBM → SM waterfall (ABMs are the workers). Per SM (sorted,
+    missing last), per RBM in order of first appearance (missing and ""
+    are one block): ABM rows by name, then the RBM row; the SM row last.
+    Rows without an SM only keep their SM row, as before.
+    """
+    df = summary_df.reset_index(drop=True)
+    n = len(df)
+    designation = df["designation"].to_numpy(dtype=object)
+    is_abm, is_rbm, is_sm = designation == "abm", designation == "rbm", designation == "sm"
+
+    sm, _ = _sorted_codes(df["sm_name"])
+    has_sm = df["sm_name"].notna().to_numpy()
+    rbm_filled, _ = pd.factorize(df["rbm_name"].fillna(""))
+    block = _group_ids(sm, rbm_filled)
+
+    # RBMs in order of first appearance within the SM
+    first_seen = np.full(int(block.max(initial=-1)) + 1, n, dtype=np.int64)
+    np.minimum.at(first_seen, block, np.arange(n))
+    name, _ = _sorted_codes(df["name"])
+
+    abm_rows = np.flatnonzero(is_abm & has_sm)
+    rbm_rows = _first(is_rbm & has_sm, block)
+    sm_rows = _first(is_sm, sm)
+    kept = np.concatenate([abm_rows, rbm_rows, sm_rows])
+
+    keys = (
+        sm[kept],
+        np.where(is_sm, n, first_seen[block])[kept],
+        is_rbm.astype(np.int64)[kept],
+        np.where(is_abm, name, 0)[kept],
+        kept,
+    )
+    return _assemble([(df.iloc[kept], keys)])
+
+
+
+# ------------------------------------------------------------
+# MISSING MANAGER ROWS
+# ------------------------------------------------------------
+MANAGER_ROW_COLUMNS = [
+    "empId", "name", "designation", "sm_name", "rbm_name", "abm_name",
+    "state", "city", "hq", "total_camps", "expected_camps", "execution_percent",
+]
+
+
+def _truthy(uniques):
+    """Per code (plus one for missing): `if name:` of the old loops (NaN is truthy)."""
+    return np.array([bool(v) for v in uniques] + [True], dtype=bool)
+
+
+def _any_in(mask, ids):
+    """Per row: whether some row of its group (ids) is in mask."""
+    return (np.bincount(ids[mask], minlength=int(ids.max(initial=-1)) + 1) > 0)[ids]
+
+
+def _mask(rows, n):
+    mask = np.zeros(n, dtype=bool)
+    mask[rows] = True
+    return mask
+
+
+def _keys(n, *columns):
+    """Sort keys of n synthetic rows (scalars are repeated)."""
+    return tuple(np.broadcast_to(np.asarray(c, dtype=np.int64), (n,)) for c in columns)
+
+
+def _manager_rows(df, rows, designation, name, rbm, abm, total, expected):
+    """Synthetic manager rows, one per position in rows (sm_name taken from it)."""
+    n = len(rows)
+    dtype = df["name"].dtype
+    return pd.DataFrame({
+        "empId": [""] * n,
+        "name": _text(name, n, dtype),
+        "designation": [designation] * n,
+        "sm_name": _text(df["sm_name"].to_numpy(dtype=object)[rows], n, dtype),
+        "rbm_name": _text(rbm, n, dtype),
+        "abm_name": _text(abm, n, dtype),
+        "state": [""] * n,
+        "city": [""] * n,
+        "hq": [""] * n,
+        "total_camps": np.asarray(total, dtype="float64"),
+        "expected_camps": np.broadcast_to(np.asarray(expected, dtype="float64"), (n,)),
+        "execution_percent": np.zeros(n, dtype=np.int64),
+    }, columns=MANAGER_ROW_COLUMNS)
+
+
+def _levels(df):
+    designation = df["designation"].to_numpy(dtype=object)
+    return (designation == lvl for lvl in ("mr", "abm", "rbm", "sm"))
+
+
+def insert_missing_managers(waterfall_df, abm_expected=2.0):
+    """
+    Regroups the MR waterfall per SM / RBM / ABM (sorted, missing last)
+    and adds the manager rows that are referenced but missing:
+
+        ABM  named ABM without its row, when neither its RBM nor its SM
+             has one — sum of the block's MRs, abm_expected camps
+        RBM  named RBM without its row, when its SM has none — sum of the
+             ABM rows placed so far under that RBM name (any SM)
+        SM   named SM without its row — sum of the RBM rows under it
+
+    "Placed so far" is a running per-RBM total over the SMs in order, so
+    the pass is O(rows) instead of rescanning every row placed before.
+    """
+    df = waterfall_df.reset_index(drop=True)
+    n = len(df)
+    is_mr, is_abm, is_rbm, is_sm = _levels(df)
+    name = df["name"].to_numpy(dtype=object)
+    total = df["total_camps"].to_numpy(dtype="float64")
+    sm_col, rbm_col, abm_col = (df[c].to_numpy(dtype=object) for c in ["sm_name", "rbm_name", "abm_name"])
+
+    sm, sm_names = _sorted_codes(df["sm_name"])
+    rbm, rbm_names = _sorted_codes(df["rbm_name"])
+    abm, abm_names = _sorted_codes(df["abm_name"])
+    block = _group_ids(sm, rbm)
+    group = _group_ids(sm, rbm, abm)
+    n_sms, n_blocks, n_groups = (int(ids.max(initial=-1)) + 1 for ids in (sm, block, group))
+
+    # A manager is present when a row of their level carries their name
+    sm_present = _any_in(is_sm & (name == sm_col), sm)
+    rbm_present = _any_in(is_rbm & (name == rbm_col), block)
+    abm_present = _any_in(is_abm & (name == abm_col), group)
+
+    abm_rows = _first(is_abm & abm_present, group)
+    rbm_rows = _first(is_rbm & rbm_present, block)
+    sm_rows = _first(is_sm & sm_present, sm)
+    kept = np.concatenate([np.flatnonzero(is_mr), abm_rows, rbm_rows, sm_rows])
+
+    after_rbms = rbm.max(initial=0) + 1
+    keys = (
+        sm[kept],
+        np.where(is_sm, after_rbms, rbm)[kept],
+        is_rbm.astype(np.int64)[kept],
+        np.where(is_mr | is_abm, abm, 0)[kept],
+        is_abm.astype(np.int64)[kept],
+        kept,
+    )
+    parts = [(df.iloc[kept], keys)]
+
+    # ABM: one row per block of MRs without any manager row above them
+    new_abm = _first(_truthy(abm_names)[abm] & ~abm_present & ~rbm_present & ~sm_present, group)
+    abm_total = _sum_by(group[is_mr], total[is_mr], n_groups)[group[new_abm]]
+    frame = _manager_rows(df, new_abm, "abm", abm_col[new_abm], rbm_col[new_abm], abm_col[new_abm],
+                          abm_total, float(abm_expected))
+    parts.append((frame, _keys(len(new_abm), sm[new_abm], rbm[new_abm], 0, abm[new_abm], 1, 0)))
+
+    # RBM: ABM totals per block (kept + new rows), running per RBM name over the SMs
+    placed = _mask(abm_rows, n)
+    block_total = _sum_by(block[placed], total[placed], n_blocks)
+    block_total += _sum_by(block[new_abm], abm_total, n_blocks)
+    heads = _first(np.ones(n, dtype=bool), block)
+    per_block = pd.DataFrame(
+        {"rbm": rbm[heads], "sm": sm[heads], "total": block_total[block[heads]]}, index=block[heads]
+    ).sort_values(["rbm", "sm"], kind="stable")
+    running = np.zeros(n_blocks)
+    running[per_block.index] = per_block.groupby("rbm")["total"].cumsum().to_numpy()
+    running[block[rbm == len(rbm_names)]] = 0.0            # a missing RBM name matches no row
+
+    new_rbm = _first(_truthy(rbm_names)[rbm] & ~rbm_present & ~sm_present, block)
+    rbm_total = running[block[new_rbm]]
+    frame = _manager_rows(df, new_rbm, "rbm", rbm_col[new_rbm], rbm_col[new_rbm], "", rbm_total, 0.0)
+    parts.append((frame, _keys(len(new_rbm), sm[new_rbm], rbm[new_rbm], 1, 0, 0, 0)))
+
+    # SM: RBM rows (kept + new) under the SM
+    placed = _mask(rbm_rows, n)
+    sm_total = _sum_by(sm[placed], total[placed], n_sms)
+    sm_total += _sum_by(sm[new_rbm], rbm_total, n_sms)
+    sm_total[len(sm_names):] = 0.0                           # a missing SM name matches no row
+
+    new_sm = _first(_truthy(sm_names)[sm] & ~sm_present, sm)
+    frame = _manager_rows(df, new_sm, "sm", sm_col[new_sm], "", "", sm_total[sm[new_sm]], 0.0)
+    parts.append((frame, _keys(len(new_sm), sm[new_sm], after_rbms, 0, 0, 0, 0)))
+
+    return _assemble(parts)
+
+
+def insert_missing_abm_managers(waterfall_df, abm_expected=4.0):
+    """
+    Same pass for the ABM-level waterfall (benitowa, ABMs are the
+    workers). A level counts as present when any of its rows is in the
+    block, whatever its name:
+
+        ABM  named ABM block without ABM rows, no RBM / SM row — 0 camps
+        RBM  named RBM without a row, no SM row — sum of all ABM rows of
+             that RBM name, abm_expected camps per ABM
+        SM   named SM without a row — sum of its RBM rows, or of its ABM
+             rows when it has no RBM row
+    """
+    df = waterfall_df.reset_index(drop=True)
+    n = len(df)
+    designation = df["designation"].str.lower().to_numpy(dtype=object)
+    is_abm, is_rbm, is_sm = designation == "abm", designation == "rbm", designation == "sm"
+    total = df["total_camps"].to_numpy(dtype="float64")
+    expected = df["expected_camps"].to_numpy(dtype="float64")
+    sm_col, rbm_col, abm_col = (df[c].to_numpy(dtype=object) for c in ["sm_name", "rbm_name", "abm_name"])
+
+    sm, sm_names = _sorted_codes(df["sm_name"])
+    rbm, rbm_names = _sorted_codes(df["rbm_name"])
+    abm, abm_names = _sorted_codes(df["abm_name"])
+    block = _group_ids(sm, rbm)
+    group = _group_ids(sm, rbm, abm)
+    n_sms, n_rbms = len(sm_names) + 1, len(rbm_names) + 1
+
+    sm_present = _any_in(is_sm, sm)
+    rbm_present = _any_in(is_rbm, block)
+    abm_present = _any_in(is_abm, group)
+
+    rbm_rows = _first(is_rbm, block)
+    sm_rows = _first(is_sm, sm)
+    kept = np.concatenate([np.flatnonzero(is_abm), rbm_rows, sm_rows])
+
+    after_rbms = rbm.max(initial=0) + 1
+    keys = (
+        sm[kept],
+        np.where(is_sm, after_rbms, rbm)[kept],
+        is_rbm.astype(np.int64)[kept],
+        np.where(is_abm, abm, 0)[kept],
+        np.zeros(len(kept), dtype=np.int64),
+        kept,
+    )
+    parts = [(df.iloc[kept], keys)]
+
+    new_abm = _first(_truthy(abm_names)[abm] & ~abm_present & ~rbm_present & ~sm_present, group)
+    frame = _manager_rows(df, new_abm, "abm", abm_col[new_abm], rbm_col[new_abm], abm_col[new_abm],
+                          np.zeros(len(new_abm)), float(abm_expected))
+    parts.append((frame, _keys(len(new_abm), sm[new_abm], rbm[new_abm], 0, abm[new_abm], 1, 0)))
+
+    # RBM: all ABM rows of that RBM name, whatever their SM
+    rbm_total = _sum_by(rbm[is_abm], total[is_abm], n_rbms)
+    rbm_count = np.bincount(rbm[is_abm], minlength=n_rbms)
+    rbm_total[-1] = rbm_count[-1] = 0                       # a missing RBM name matches no row
+
+    new_rbm = _first(_truthy(rbm_names)[rbm] & ~rbm_present & ~sm_present, block)
+    frame = _manager_rows(df, new_rbm, "rbm", rbm_col[new_rbm], rbm_col[new_rbm], "",
+                          rbm_total[rbm[new_rbm]], abm_expected * rbm_count[rbm[new_rbm]])
+    parts.append((frame, _keys(len(new_rbm), sm[new_rbm], rbm[new_rbm], 1, 0, 0, 0)))
+
+    # SM: its RBM rows, or its ABM rows without any
+    def sums(mask, values):
+        out = _sum_by(sm[mask], values[mask], n_sms)
+        out[-1] = 0.0                                        # a missing SM name matches no row
+        return out
+
+    has_rbm = np.bincount(sm[is_rbm], minlength=n_sms) > 0
+    sm_total = np.where(has_rbm, sums(is_rbm, total), sums(is_abm, total))
+    sm_expected = np.where(has_rbm, sums(is_rbm, expected), sums(is_abm, expected))
+
+    new_sm = _first(_truthy(sm_names)[sm] & ~sm_present, sm)
+    frame = _manager_rows(df, new_sm, "sm", sm_col[new_sm], "", "",
+                          sm_total[sm[new_sm]], sm_expected[sm[new_sm]])
+    parts.append((frame, _keys(len(new_sm), sm[new_sm], after_rbms, 0, 0, 0, 0)))
+
+    return _assemble(parts)